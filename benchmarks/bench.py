@@ -0,0 +1,235 @@
+import argparse
+import copy
+import json
+import logging
+import math
+import platform
+import random
+import sys
+import time
+
+from mathrandomcrack.mathrandomcrack import *
+from mathrandomcrack.mathrandomcrack import _iter_math_randoms, _solve_hypotheses
+from mathrandomcrack.xs128tables import XS128Tables, get_tables
+
+RESULTS_VERSION = 1
+# A benchmark is reported as a regression when it is this many times slower than the baseline
+DEFAULT_THRESHOLD = 1.25
+# Measures shorter than this (in seconds) are too noisy to be reported as regressions
+MIN_COMPARED_TIME = 0.01
+
+class Scenario():
+    """
+    A synthetic leak set generated by MathRandom from a fixed seed.
+
+    Attributes:
+        name: the name of the benchmark.
+
+        method: the kind of leaked values ("doubles", "scaled" or "bounds").
+
+        leaks, positions: the leaked values and their positions.
+
+        factor, translation: the integers used by the "scaled" method.
+
+        expected: the MathRandom state before the leaks, which must be among the recovered states.
+    """
+    def __init__(self, name, method, count, spacing=1, factor=1, translation=0, width=0.0, seed=0):
+        self.name = name
+        self.method = method
+        self.factor = factor
+        self.translation = translation
+        rng = random.Random(seed)
+        math_random = MathRandom(rng.getrandbits(64) | 1, rng.getrandbits(64) | 1)
+        math_random.advance(rng.randrange(64))
+        self.expected = copy.copy(math_random)
+        self.positions = []
+        position = 0
+        for _ in range(count):
+            self.positions.append(position)
+            position += spacing if spacing > 0 else rng.randint(1, -spacing)
+        doubles = [self.expected.at(position) for position in self.positions]
+        if method == 'doubles':
+            self.leaks = doubles
+        elif method == 'scaled':
+            self.leaks = [math.floor(d * factor + translation) for d in doubles]
+        elif method == 'bounds':
+            self.leaks = [(max(0.0, d - rng.uniform(0, width)), min(1.0, d + rng.uniform(0, width))) for d in doubles]
+        else:
+            raise ValueError(f'Unsupported method "{method}"')
+
+    def state_bounds(self):
+        if self.method == 'doubles':
+            return [state_bounds_from_double(d) for d in self.leaks]
+        elif self.method == 'scaled':
+            return [state_bounds_from_scaled_value(v, self.factor, self.translation) for v in self.leaks]
+        return [state_bounds_from_approximate_value(b) for b in self.leaks]
+
+    def recover(self):
+        if self.method == 'doubles':
+            return recover_state_from_math_random_doubles(self.leaks, self.positions)
+        elif self.method == 'scaled':
+            return recover_state_from_math_random_scaled_values(self.leaks, self.factor, self.translation, self.positions)
+        return recover_state_from_math_random_approximate_values(self.leaks, self.positions)
+
+def default_scenarios():
+    """
+    Return the list of the cracking scenarios.
+    """
+    return [
+        Scenario('doubles-4', 'doubles', 4),
+        Scenario('doubles-10', 'doubles', 10),
+        Scenario('scaled-2', 'scaled', 200, factor=2),
+        Scenario('scaled-36', 'scaled', 40, factor=36),
+        Scenario('scaled-1000', 'scaled', 25, factor=1000, translation=5),
+        Scenario('scaled-2^20', 'scaled', 10, factor=1 << 20),
+        Scenario('bounds-1e-3', 'bounds', 20, width=1e-3),
+        Scenario('bounds-1e-6', 'bounds', 10, width=1e-6),
+        Scenario('scattered-doubles', 'doubles', 8, spacing=-40),
+        Scenario('long-span-doubles', 'doubles', 6, spacing=5003),
+        Scenario('long-span-scaled-36', 'scaled', 40, spacing=-1000, factor=36),
+    ]
+
+def time_call(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+def bench_scenario(scenario):
+    """
+    Time each phase of the recovery of a scenario and the full recovery.
+
+    Return a dict with the time of each phase in seconds and the number of recovered states.
+    """
+    phases = {}
+    phases['bounds'], state_bounds = time_call(scenario.state_bounds)
+    def known_bits():
+        bits = []
+        for low, high in state_bounds:
+            common_known_bits = common_bits_between(low, high)
+            bits.append([None for _ in range(64 - len(common_known_bits))] + common_known_bits)
+        return bits
+    phases['known_bits'], bits = time_call(known_bits)
+    phases['engine'], engine = time_call(lambda: RecoveryEngine(bits, scenario.positions))
+    phases['solve'], solutions = time_call(lambda: list(_solve_hypotheses(engine, None, None, False)))
+    def verify():
+        rows_cache = {}
+        return [state for cache_idx, v0, kernel in solutions
+                for state in _iter_math_randoms(cache_idx, v0, kernel, scenario.positions, state_bounds, rows_cache=rows_cache)]
+    phases['verify'], _ = time_call(verify)
+    full, states = time_call(lambda: list(scenario.recover()))
+    if scenario.expected not in states:
+        raise AssertionError(f'{scenario.name}: expected state was not recovered')
+    return {'phases': phases, 'full': full, 'states': len(states)}
+
+def bench_simulation():
+    """
+    Time the MathRandom simulation primitives.
+
+    Return a dict that maps the name of each primitive to its time in seconds.
+    """
+    math_random = MathRandom(6770692079143846949, 12009346246601641483)
+    results = {}
+    results['next-100k'], _ = time_call(lambda: [math_random.next() for _ in range(100000)])
+    results['previous-100k'], _ = time_call(lambda: [math_random.previous() for _ in range(100000)])
+    results['take-1M'], _ = time_call(lambda: math_random.take(1000000))
+    results['take-uint64-1M'], _ = time_call(lambda: math_random.take(1000000, 'uint64'))
+    results['take-previous-1M'], _ = time_call(lambda: math_random.take_previous(1000000))
+    results['advance-1e15-x100'], _ = time_call(lambda: [math_random.advance(10 ** 15) for _ in range(100)])
+    results['rewind-1e15-x100'], _ = time_call(lambda: [math_random.rewind(10 ** 15) for _ in range(100)])
+    results['find-scaled-1M'], _ = time_call(lambda: math_random.find([1, 2, 3, 4, 5, 6, 7, 8], 'scaled', 1000, max_distance=1000000))
+    results['tables-build'], _ = time_call(XS128Tables.build)
+    return results
+
+def run_benchmarks(names=None, repeat=3):
+    """
+    Run the benchmarks and return the results as a JSON-serializable dict.
+    The best time of the repeats is kept for each measure.
+
+    Arguments:
+        (optional) names: a list of substrings. If specified, only the benchmarks whose name contains one of them are run.
+
+        (optional) repeat: the number of runs of each benchmark.
+    """
+    selected = lambda name: not names or any(n in name for n in names)
+    # Tables are loaded once so that they are not counted by the first benchmark
+    get_tables()
+    benchmarks = {}
+    for scenario in default_scenarios():
+        if not selected(scenario.name):
+            continue
+        runs = [bench_scenario(scenario) for _ in range(repeat)]
+        measures = {f'phase.{phase}': min(run['phases'][phase] for run in runs) for phase in runs[0]['phases']}
+        measures['full'] = min(run['full'] for run in runs)
+        benchmarks[scenario.name] = {'measures': measures, 'states': runs[0]['states']}
+    if selected('simulation'):
+        runs = [bench_simulation() for _ in range(repeat)]
+        benchmarks['simulation'] = {'measures': {name: min(run[name] for run in runs) for name in runs[0]}}
+    return {
+        'version': RESULTS_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'repeat': repeat,
+        'benchmarks': benchmarks,
+    }
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare results with baseline results of run_benchmarks.
+
+    Return a list of (benchmark, measure, baseline_time, time, ratio, regression) tuples for the measures found in both.
+    A measure is a regression if it is more than threshold times slower than the baseline and not too short to be reliable.
+    """
+    if baseline.get('version') != RESULTS_VERSION:
+        raise ValueError(f'Unsupported baseline version {baseline.get("version")}')
+    comparison = []
+    for name, benchmark in results['benchmarks'].items():
+        baseline_measures = baseline['benchmarks'].get(name, {}).get('measures', {})
+        for measure, seconds in benchmark['measures'].items():
+            if measure not in baseline_measures:
+                continue
+            base = baseline_measures[measure]
+            ratio = seconds / base if base > 0 else (math.inf if seconds > 0 else 1.0)
+            regression = ratio > threshold and seconds >= MIN_COMPARED_TIME
+            comparison.append((name, measure, base, seconds, ratio, regression))
+    return comparison
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+            prog = 'python3 -m benchmarks.bench',
+            description = 'Benchmark Math.random() state recovery and simulation on synthetic leak sets')
+    parser.add_argument('--output',
+            help='the JSON file where the results are saved')
+    parser.add_argument('--baseline',
+            help='a JSON file with previous results to compare against')
+    parser.add_argument('--threshold', default=DEFAULT_THRESHOLD, type=float,
+            help=f'the slowdown ratio reported as a regression (default: {DEFAULT_THRESHOLD})')
+    parser.add_argument('--fail-on-regression', action='store_true',
+            help='exit with status 1 if a regression is found')
+    parser.add_argument('--repeat', default=3, type=int,
+            help='the number of runs of each benchmark (default: 3)')
+    parser.add_argument('names', nargs='*',
+            help='only run the benchmarks whose name contains one of these strings')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    logging.basicConfig(stream=sys.stderr, level=logging.ERROR)
+    results = run_benchmarks(args.names, args.repeat)
+    for name, benchmark in results['benchmarks'].items():
+        for measure, seconds in benchmark['measures'].items():
+            print(f'{name:24} {measure:20} {seconds * 1000:10.2f} ms')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = 0
+        print()
+        for name, measure, base, seconds, ratio, regression in compare(results, baseline, args.threshold):
+            regressions += regression
+            print(f'{name:24} {measure:20} {base * 1000:10.2f} ms -> {seconds * 1000:10.2f} ms  x{ratio:.2f}{"  REGRESSION" if regression else ""}')
+        print(f'{regressions} regression(s) against {args.baseline}')
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
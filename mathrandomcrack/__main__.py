@@ -1,10 +1,18 @@
 import argparse
-import ast
+import json
 import logging
-import math
+import os
 import sys
 
 from .mathrandomcrack import *
+from .stats import RecoveryStats
+from .resultcache import RESULT_CACHE_MAX_ENTRIES, ResultCache, default_result_cache_path
+from .batch import INPUT_FORMATS, LEAK_METHODS, OUTPUT_FORMATS, crack_batch, load_leak_sets, load_leaks, parse_segment_lines
+from .xs128crack import DEFAULT_SOLVER_BACKEND, SOLVER_BACKENDS
+
+OUTPUT_MODES = ['text', 'lines', 'ndjson', 'binary']
+# Number of values generated and written at once by the streaming output modes
+OUTPUT_CHUNK_SIZE = 1 << 16
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -14,13 +22,23 @@ def parse_args():
             epilog = 'Example usages:\n' \
                     '  python3 -m mathrandomcrack --method doubles --next 10 ./samples/doubles.txt\n' \
                     '  python3 -m mathrandomcrack --method scaled --next 5 --previous 5 --factor 36 --output-fmt scaled ./samples/scaled_values.txt\n'\
-                    '  python3 -m mathrandomcrack --method bounds --next 10 ./samples/bounds.txt --debug\n',
+                    '  python3 -m mathrandomcrack --method bounds --next 10 ./samples/bounds.txt --debug\n'\
+                    '  python3 -m mathrandomcrack --method doubles --next 10 ./samples/segments.txt\n'\
+                    '  python3 -m mathrandomcrack serve --socket /tmp/mathrandomcrack.sock --jobs 4 (see serve --help)\n',
                     formatter_class=argparse.RawTextHelpFormatter)
-    parser.add_argument('--method', required=True, choices=['doubles', 'scaled', 'bounds'],
+    parser.add_argument('--method', choices=LEAK_METHODS,
             help='the kind of leaked values to use to recover possible Math.random() states\n'\
                  '"doubles": one output of Math.random() per line (between 0.0 and 1.0)\n'\
                  '"scaled": one output of Math.floor(Math.random() * factor + translation) per line\n'\
                  '"bounds": one pair of space-separated min / max bounds of Math.random() outputs per line')
+    parser.add_argument('--input-fmt', choices=INPUT_FORMATS,
+            help='the format of the file of leaked values (default: "npy" for .npy files, else "text")\n'\
+                 '"text": one leaked value per line\n'\
+                 '"f64", "u64", "i64": raw little-endian 64-bit values (float64 doubles or bounds pairs,\n'\
+                 '    uint64 or int64 scaled values), a NaN double is an unknown output of Math.random()\n'\
+                 '"npy": a NumPy array of float64, uint64 or int64 values (shape (n, 2) for bounds)')
+    parser.add_argument('--positions',
+            help='a binary file (raw uint64 or .npy) with the position of each leaked value of a binary file')
     parser.add_argument('--factor', default=1, type=int,
             help='the factor to use for method / output_fmt "scaled"')
     parser.add_argument('--translation', default=0, type=int,
@@ -31,98 +49,208 @@ def parse_args():
             help='how many previous Math.random() outputs to predict')
     parser.add_argument('--show-leaks', action='store_true',
             help='show the recovered leaked values corresponding to the input file')
-    parser.add_argument('--output-fmt', default='doubles', choices=['doubles', 'scaled'],
+    parser.add_argument('--output-fmt', default='doubles', choices=list(OUTPUT_FORMATS),
             help='the format of the predicted values\n'\
                  '"doubles" (default): a list of doubles\n'\
-                 '"scaled": a list of integers generated with Math.floor(Math.random() * factor + translation')
+                 '"scaled": a list of integers generated with Math.floor(Math.random() * factor + translation\n'\
+                 '"uint64": a list of the raw 64-bit values generated by xs128')
+    parser.add_argument('--output-mode', default='text', choices=OUTPUT_MODES,
+            help='how the predicted values are written, values are generated and written in chunks except for "text"\n'\
+                 '"text" (default): human readable lists of values\n'\
+                 '"lines": one value per line (previous values, then leaks with --show-leaks, then next values)\n'\
+                 '"ndjson": one JSON object per line, tagged with the index of the possible state\n'\
+                 '"binary": little-endian float64 for "doubles", int64 for "scaled" and uint64 for "uint64"')
+    parser.add_argument('--output-file',
+            help='the file where the values are written instead of stdout\n'\
+                 '"{state}" is replaced by the index of each possible state to write each one to its own file')
+    parser.add_argument('--solver', default=DEFAULT_SOLVER_BACKEND, choices=list(SOLVER_BACKENDS),
+            help='the backend used to solve linear systems in GF(2)\n'\
+                 '"native" (default): bit-packed XOR-row elimination in pure Python\n'\
+                 '"sage": Sage matrices (requires Sage)')
+    parser.add_argument('--jobs', default=1, type=int,
+            help='the number of processes used to search possible Math.random() states in parallel')
+    parser.add_argument('--ordered', action='store_true',
+            help='always show possible states in the same order when using --jobs')
+    parser.add_argument('--batch', action='store_true',
+            help='crack many independent leak sets and print one JSON result per line\n'\
+                 'file is either a JSONL file with one leak set per line or a directory with one input file per leak set\n'\
+                 'options of the command line are used for the keys missing from a JSON leak set')
+    parser.add_argument('--cache', action='store_true',
+            help='look up and store the recovered states in an SQLite result cache, so that a leak set\n'\
+                 'that was already cracked only has to rebuild its states')
+    parser.add_argument('--cache-file',
+            help=f'the SQLite file of the result cache, implies --cache (default: {default_result_cache_path()})')
+    parser.add_argument('--cache-entries', default=RESULT_CACHE_MAX_ENTRIES, type=int,
+            help=f'the number of leak sets kept in the result cache, the least recently used ones are evicted (default: {RESULT_CACHE_MAX_ENTRIES})')
+    parser.add_argument('--stats', choices=['json'],
+            help='print timers and counters of the recovery to stderr when it is done\n'\
+                 '"json": a JSON object (one per leak set with --batch, added to each result)')
     parser.add_argument('--debug', action='store_true',
             help='raise log level')
     parser.add_argument('file',
-            help='the file containing the random leaked values')
+            help='the file containing the random leaked values (or the leak sets with --batch)\n'\
+                 'a line "? MIN MAX" separates segments of values with between MIN and MAX unknown values between them')
     args = parser.parse_args()
 
-    if args.method == 'scaled' and args.factor < 2:
+    if args.method is None and not args.batch:
+        raise ValueError(f'--method should be specified')
+    if args.method is None and args.batch and os.path.isdir(args.file):
+        # Only JSON leak sets can specify their own method
+        raise ValueError(f'--method should be specified when using --batch with a directory')
+    if args.jobs < 1:
+        raise ValueError(f'--jobs should be at least 1')
+    if args.method == 'scaled' and args.factor < 2 and not args.batch:
         raise ValueError(f'--factor should be specified and larger than 1 when using method "scaled"')
 
     return args
 
-def parse_file(filename, method):
-    leaks = []
-    indices = []
-    curr_index = 0
+def parse_file(filename, method, input_fmt=None, positions=None):
+    return load_leaks(filename, method, input_fmt, positions)
+
+def parse_segments_file(filename, method, input_fmt=None):
+    if input_fmt not in [None, 'text'] or filename.endswith('.npy'):
+        return None
     with open(filename, 'r') as f:
-        for line in f:
-            if line.startswith("#"):
-                # Skip commented lines
-                continue
-            if not line.strip():
-                # Empty line means unknown state
-                pass
-            elif method == 'doubles':
-                d = ast.literal_eval(line)
-                assert type(d) in [int, float] and d >= 0.0 and d <= 1.0
-                leaks.append(d)
-                indices.append(curr_index)
-            elif method == 'scaled':
-                i = ast.literal_eval(line)
-                assert type(i) is int and i >= 0 and i <= pow(2, 64) - 1
-                leaks.append(i)
-                indices.append(curr_index)
-            elif method == 'bounds':
-                splitted = line.split(' ')
-                bounds = [ast.literal_eval(s) for s in splitted]
-                assert len(bounds) == 2 and all(type(b) in [int, float] and b >= 0 and b <= 1.0 for b in bounds)
-                leaks.append(bounds)
-                indices.append(curr_index)
-            else:
-                raise NotImplementedError(f'Unsupported method "{method}"')
-            curr_index += 1
-    return leaks, indices
+        lines = f.readlines()
+    if not any(line.startswith('?') for line in lines):
+        return None
+    return parse_segment_lines(lines, method)
+
+def open_result_cache(args):
+    if not args.cache and args.cache_file is None:
+        return None
+    return ResultCache(args.cache_file, args.cache_entries)
 
-def recover_all_states(leaks, indices, args):
+def recover_all_states(leaks, indices, args, stats=None, result_cache=None):
     if args.method == 'doubles':
-        return recover_state_from_math_random_doubles(leaks, indices)
+        return recover_state_from_math_random_doubles(leaks, indices, args.solver, args.jobs, args.ordered, stats=stats, result_cache=result_cache)
     elif args.method == 'scaled':
-        return recover_state_from_math_random_scaled_values(leaks, args.factor, args.translation, indices)
+        return recover_state_from_math_random_scaled_values(leaks, args.factor, args.translation, indices, args.solver, args.jobs, args.ordered, stats=stats, result_cache=result_cache)
     elif args.method == 'bounds':
-        return recover_state_from_math_random_approximate_values(leaks, indices)
+        return recover_state_from_math_random_approximate_values(leaks, indices, args.solver, args.jobs, args.ordered, stats=stats, result_cache=result_cache)
     else:
         raise NotImplementedError(f'Unsupported method "{method}"')
 
-def format_random(value, args):
-    if args.output_fmt == 'doubles':
-        return value
-    elif args.output_fmt == 'scaled':
-        return math.floor(value * args.factor + args.translation)
+def take_chunks(state, n, args):
+    """
+    Yield the next n values of a MathRandom in the --output-fmt format, in arrays of at most OUTPUT_CHUNK_SIZE values.
+    """
+    while n > 0:
+        chunk = state.take(min(n, OUTPUT_CHUNK_SIZE), OUTPUT_FORMATS[args.output_fmt], args.factor, args.translation)
+        n -= len(chunk)
+        yield chunk
+
+def write_values(out, index, kind, chunks, mode):
+    """
+    Write chunks of values of the index-th possible state in a streaming output mode.
+    """
+    for chunk in chunks:
+        if mode == 'lines':
+            out.write(''.join(f'{value!r}\n' for value in chunk))
+        elif mode == 'ndjson':
+            out.write(json.dumps({'state': index, 'kind': kind, 'values': chunk.tolist()}) + '\n')
+        elif mode == 'binary':
+            if sys.byteorder != 'little':
+                chunk.byteswap()
+            chunk.tofile(out)
+        else:
+            raise NotImplementedError(f'Unsupported output mode "{mode}"')
+
+def stream_state(out, index, state, found_gaps, last_index, args):
+    """
+    Write the values predicted by a possible state in a streaming output mode, from the oldest to the newest.
+    """
+    if args.output_mode == 'ndjson':
+        header = {'state': index, 'state0': state.state0, 'state1': state.state1, 'cache_idx': state.cache_idx}
+        if found_gaps is not None:
+            header['gaps'] = found_gaps
+        out.write(json.dumps(header) + '\n')
+    state.rewind(args.previous)
+    write_values(out, index, 'previous', take_chunks(state, args.previous, args), args.output_mode)
+    if args.show_leaks:
+        write_values(out, index, 'leaks', take_chunks(state, last_index + 1, args), args.output_mode)
+    else:
+        state.advance(last_index + 1) # Skip leaks
+    write_values(out, index, 'next', take_chunks(state, args.next, args), args.output_mode)
+    out.flush()
+
+def open_output(args, index=None):
+    """
+    Open the output of the streaming output modes, for the index-th possible state if specified.
+    """
+    binary = args.output_mode == 'binary'
+    if args.output_file is None:
+        return sys.stdout.buffer if binary else sys.stdout
+    path = args.output_file if index is None else args.output_file.replace('{state}', str(index))
+    return open(path, 'wb' if binary else 'w')
+
+def print_state(state, found_gaps, last_index, args):
+    print('Found a possible Math.random internal state')
+    if found_gaps is not None:
+        print(f'Gaps between segments: {found_gaps}')
+    # Show --previous values
+    if args.previous > 0:
+        print(f'Predicted previous {args.previous} values:', state.take_previous(args.previous, OUTPUT_FORMATS[args.output_fmt], args.factor, args.translation).tolist()[::-1])
+        state.advance(args.previous) # Return to initial state
+    # Show leaked values if --show-leaks
+    if args.show_leaks:
+        print(f'Recovered leaked values:', state.take(last_index + 1, OUTPUT_FORMATS[args.output_fmt], args.factor, args.translation).tolist())
     else:
-        raise NotImplementedError(f'Unsupported output_fmt "{method}"')
+        state.advance(last_index + 1) # Skip leaks
+    if args.next > 0:
+        # Show --next values
+        print(f'Predicted next {args.next} values:', state.take(args.next, OUTPUT_FORMATS[args.output_fmt], args.factor, args.translation).tolist())
+    print()
 
 if __name__ == '__main__':
+    if sys.argv[1:2] == ['serve']:
+        from .server import main
+        main(sys.argv[2:])
+        sys.exit(0)
     args = parse_args()
     logging.basicConfig(stream=sys.stderr, level=logging.DEBUG if args.debug else logging.INFO)
-    leaks, indices = parse_file(args.file, args.method)
-
-    found = False
-    for state in recover_all_states(leaks, indices, args):
-        found = True
-        print('Found a possible Math.random internal state')
-        # Show --previous values
-        if args.previous > 0:
-            print(f'Predicted previous {args.previous} values:',
-                    [format_random(state.previous(), args) for _ in range(args.previous)][::-1])
-            [state.next() for _ in range(args.previous)] # Return to initial state
-        # Show leaked values if --show-leaks
-        if args.show_leaks:
-            print(f'Recovered leaked values:',
-                    [format_random(state.next(), args) for _ in range(max(indices) + 1)])
+    if args.batch:
+        defaults = {'method': args.method, 'factor': args.factor, 'translation': args.translation,
+                'next': args.next, 'previous': args.previous, 'output_fmt': args.output_fmt}
+        leak_sets = load_leak_sets(args.file, {key: value for key, value in defaults.items() if value is not None})
+        for result in crack_batch(leak_sets, args.solver, args.jobs, args.ordered, args.stats is not None, open_result_cache(args)):
+            print(json.dumps(result), flush=True)
+        sys.exit(0)
+    stats = RecoveryStats()
+    parsed_segments = parse_segments_file(args.file, args.method, args.input_fmt)
+    if parsed_segments is None:
+        leaks, indices = parse_file(args.file, args.method, args.input_fmt, args.positions)
+        results = ((state, None) for state in recover_all_states(leaks, indices, args, stats, open_result_cache(args)))
+    else:
+        segments, gaps = parsed_segments
+        results = recover_state_from_math_random_segments(segments, gaps, args.method, args.factor, args.translation, stats)
+
+    streaming = args.output_mode != 'text'
+    # Without "{state}" in the output file, all the possible states are written to the same stream one after the other
+    per_state_files = streaming and args.output_file is not None and '{state}' in args.output_file
+    out = open_output(args) if streaming and not per_state_files else None
+    found = 0
+    last_index = max(indices, default=-1) if parsed_segments is None else None
+    for state, found_gaps in results:
+        if found_gaps is not None:
+            # Leaked values span the segments and the gaps between them
+            last_index = sum(map(len, segments)) + sum(found_gaps) - 1
+        if not streaming:
+            print_state(state, found_gaps, last_index, args)
         else:
-            [state.next() for _ in range(max(indices) + 1)] # Skip leaks
-        if args.next > 0:
-        # Show --next values
-            print(f'Predicted next {args.next} values:',
-                    [format_random(state.next(), args) for _ in range(args.next)])
-        print()
+            print(f'Found a possible Math.random internal state (state {found})', file=sys.stderr)
+            if found == 1 and not per_state_files and args.output_mode != 'ndjson':
+                logging.warning('Several possible states were found, their values are written one after the other')
+            if per_state_files:
+                with open_output(args, found) as state_out:
+                    stream_state(state_out, found, state, found_gaps, last_index, args)
+            else:
+                stream_state(out, found, state, found_gaps, last_index, args)
+        found += 1
+    if out is not None and args.output_file is not None:
+        out.close()
 
     if not found:
-        print("Couldn't recover any possible Math.random internal state. Please check your values file.")
-
+        print("Couldn't recover any possible Math.random internal state. Please check your values file.", file=sys.stderr if streaming else sys.stdout)
+    if args.stats == 'json':
+        print(json.dumps(stats.to_dict()), file=sys.stderr)
@@ -0,0 +1,447 @@
+from .mathrandomcrack import *
+from .xs128tables import get_tables, jump_xs128
+from .stats import RecoveryStats
+
+import ast
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+logger = logging.getLogger(__name__)
+
+LEAK_METHODS = ['doubles', 'scaled', 'bounds']
+INPUT_FORMATS = ['text', 'f64', 'u64', 'i64', 'npy']
+# Array typecodes of the raw binary input formats
+RAW_FORMATS = {'f64': 'd', 'u64': 'Q', 'i64': 'q'}
+NPY_MAGIC = b'\x93NUMPY'
+# Array typecodes of the supported .npy dtypes
+NPY_DESCRS = {'<f8': 'd', '<u8': 'Q', '<i8': 'q'}
+# Output formats and the matching formats of MathRandom.take
+OUTPUT_FORMATS = {'doubles': 'double', 'scaled': 'scaled', 'uint64': 'uint64'}
+# Byte offsets of the two most significant bytes of 64-bit values in memory
+HIGH_BYTE, SECOND_BYTE = (7, 6) if sys.byteorder == 'little' else (0, 1)
+# Most significant bytes of non-negative int64 values and of float64 values in [0, 2)
+POSITIVE_HIGH_BYTES = bytes(range(0x80))
+UNIT_HIGH_BYTES = bytes(range(0x40))
+# Tables of bytes.translate that flag the two most significant bytes of float64 values in [1, 2)
+HIGH_BYTE_OF_ONE = bytes(int(byte == 0x3f) for byte in range(256))
+SECOND_BYTE_OF_ONE = bytes(int(byte >= 0xf0) for byte in range(256))
+
+def parse_leak_lines(lines, method):
+    """
+    Parse leaked values in the text format of the CLI input files.
+    Lines starting with # are skipped and an empty line represents an unknown output of Math.random().
+
+    Arguments:
+        lines: an iterable of lines.
+
+        method: the kind of leaked values ("doubles", "scaled" or "bounds").
+
+    Return a (leaks, positions) tuple.
+    """
+    if method == 'doubles':
+        convert = float
+    elif method == 'scaled':
+        convert = lambda s: int(s, 0)
+    elif method == 'bounds':
+        convert = lambda s: tuple(float(b) for b in s.split())
+    else:
+        raise NotImplementedError(f'Unsupported method "{method}"')
+    leaks = []
+    positions = []
+    curr_index = 0
+    for line in lines:
+        if line.startswith("#"):
+            # Skip commented lines
+            continue
+        line = line.strip()
+        # Empty line means unknown state
+        if line:
+            leaks.append(convert(line))
+            positions.append(curr_index)
+        curr_index += 1
+    # Values are checked all at once
+    if method == 'doubles':
+        assert not leaks or (min(leaks) >= 0.0 and max(leaks) <= 1.0)
+    elif method == 'scaled':
+        assert not leaks or (min(leaks) >= 0 and max(leaks) <= pow(2, 64) - 1)
+    else:
+        assert all(len(bounds) == 2 and 0.0 <= bounds[0] <= 1.0 and 0.0 <= bounds[1] <= 1.0 for bounds in leaks)
+    return leaks, positions
+
+def load_leaks(path, method, input_fmt=None, positions_path=None):
+    """
+    Load leaked values from a text or a binary file.
+
+    Binary files are memory-mapped and their values are read through memoryviews, without a Python object per value.
+    Values of method "doubles" are float64 where NaN represents an unknown output of Math.random(), values of method
+    "scaled" are uint64 or int64 and values of method "bounds" are pairs of float64.
+
+    Arguments:
+        path: the file of leaked values.
+
+        method: the kind of leaked values ("doubles", "scaled" or "bounds").
+
+        (optional) input_fmt: the format of the file (see INPUT_FORMATS).
+            If not specified, files ending with .npy are NumPy arrays and other files are text files.
+            "text": the text format of the CLI input files (see parse_leak_lines).
+            "f64", "u64", "i64": raw little-endian 64-bit values.
+            "npy": a NumPy .npy file with a 1-dimensional array, or a 2-dimensional array of bounds.
+
+        (optional) positions_path: a file with the position of each leaked value in the same binary formats
+            (a raw uint64 file or a .npy file of integers). By default, values are at successive positions.
+
+    Return a (leaks, positions) tuple.
+    """
+    if input_fmt is None:
+        input_fmt = 'npy' if path.endswith('.npy') else 'text'
+    if input_fmt == 'text':
+        if positions_path is not None:
+            raise ValueError('positions can only be loaded for binary input files')
+        with open(path, 'r') as f:
+            return parse_leak_lines(f.read().split('\n'), method)
+    if input_fmt not in INPUT_FORMATS:
+        raise ValueError(f'Unsupported input format "{input_fmt}"')
+    values = _map_values(path, input_fmt)
+    positions = None
+    if positions_path is not None:
+        positions = _map_values(positions_path, 'npy' if positions_path.endswith('.npy') else 'u64')
+        if positions.format not in 'Qq':
+            raise ValueError('positions should be integers')
+    if method == 'doubles':
+        if values.format != 'd':
+            raise ValueError('doubles should be float64 values')
+        if not _unit_doubles(values):
+            # NaN values are unknown outputs
+            known = [i for i, d in enumerate(values) if d == d]
+            positions = [positions[i] for i in known] if positions is not None else known
+            values = [values[i] for i in known]
+            assert all(0.0 <= d <= 1.0 for d in values)
+        leaks = values
+    elif method == 'scaled':
+        if values.format not in 'Qq':
+            raise ValueError('scaled values should be uint64 or int64 values')
+        assert values.format == 'Q' or not bytes(values.cast('B')[HIGH_BYTE::8]).translate(None, POSITIVE_HIGH_BYTES)
+        leaks = values
+    elif method == 'bounds':
+        if values.format != 'd' or len(values) % 2:
+            raise ValueError('bounds should be pairs of float64 values')
+        assert _unit_doubles(values) or all(0.0 <= d <= 1.0 for d in values)
+        leaks = list(zip(values[0::2], values[1::2]))
+    else:
+        raise NotImplementedError(f'Unsupported method "{method}"')
+    if positions is None:
+        positions = range(len(leaks))
+    if len(positions) != len(leaks):
+        raise ValueError('leaks and positions should have the same length')
+    return leaks, positions
+
+def _unit_doubles(values):
+    # Return whether all the float64 values of a memoryview are in [0, 1], from their two most significant bytes
+    # instead of a Python float per value: a double is in [0, 1) when its sign bit is clear and its 16 most
+    # significant bits are below 0x3ff0, the exponent of 1.0
+    raw = values.cast('B')
+    high_bytes = bytes(raw[HIGH_BYTE::8])
+    if high_bytes.translate(None, UNIT_HIGH_BYTES):
+        return False
+    # Doubles with a high byte of 0x3f and a second byte from 0xf0 are at least 1.0, only 1.0 itself is allowed
+    at_least_one = int.from_bytes(high_bytes.translate(HIGH_BYTE_OF_ONE)) & int.from_bytes(bytes(raw[SECOND_BYTE::8]).translate(SECOND_BYTE_OF_ONE))
+    while at_least_one:
+        bit = at_least_one.bit_length() - 1
+        if values[len(values) - 1 - bit // 8] != 1.0:
+            return False
+        at_least_one ^= 1 << bit
+    return True
+
+def _map_values(path, input_fmt):
+    # Return a read-only memoryview of the 64-bit values of a binary file
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            buffer = b''
+        else:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(buffer)
+    if input_fmt == 'npy':
+        typecode, offset = _parse_npy_header(view)
+    else:
+        typecode, offset = RAW_FORMATS[input_fmt], 0
+    view = view[offset:]
+    if len(view) % 8:
+        raise ValueError(f'truncated binary file {path}')
+    if sys.byteorder != 'little':
+        values = array(typecode, view)
+        values.byteswap()
+        return memoryview(values)
+    return view.cast(typecode)
+
+def _parse_npy_header(view):
+    # Return the array typecode and the offset of the data of a .npy file (see numpy.lib.format)
+    if bytes(view[:6]) != NPY_MAGIC:
+        raise ValueError('not a .npy file')
+    major = view[6]
+    if major == 1:
+        header_len, = struct.unpack_from('<H', view, 8)
+        offset = 10
+    else:
+        header_len, = struct.unpack_from('<I', view, 8)
+        offset = 12
+    header = ast.literal_eval(bytes(view[offset:offset + header_len]).decode('latin1'))
+    typecode = NPY_DESCRS.get(header['descr'])
+    if typecode is None:
+        raise ValueError(f'unsupported .npy dtype {header["descr"]}')
+    if header['fortran_order'] and len(header['shape']) > 1:
+        raise ValueError('unsupported .npy Fortran order')
+    if len(header['shape']) > 2 or (len(header['shape']) == 2 and header['shape'][1] != 2):
+        raise ValueError(f'unsupported .npy shape {header["shape"]}')
+    return typecode, offset + header_len
+
+def parse_segment_lines(lines, method):
+    """
+    Parse segments of leaked values separated by gap lines in the text format of the CLI input files.
+    A line "? MIN MAX" separates two segments with between MIN and MAX unknown outputs of Math.random() (inclusive),
+    and a line "? N" separates two segments with exactly N unknown outputs.
+
+    Arguments:
+        lines: an iterable of lines.
+
+        method: the kind of leaked values ("doubles", "scaled" or "bounds").
+
+    Return a (segments, gaps) tuple where each segment is a list of leaks with None for unknown outputs
+        (see mathrandomcrack.recover_state_from_math_random_segments).
+    """
+    segments = []
+    gaps = []
+    segment_lines = []
+    def add_segment():
+        leaks, positions = parse_leak_lines(segment_lines, method)
+        segment = [None for _ in range(len([line for line in segment_lines if not line.startswith('#')]))]
+        for leak, position in zip(leaks, positions):
+            segment[position] = leak
+        segments.append(segment)
+    for line in lines:
+        if line.startswith('?'):
+            gap = [int(s) for s in line[1:].split()]
+            assert len(gap) in [1, 2] and 0 <= gap[0] <= gap[-1]
+            gaps.append((gap[0], gap[-1]))
+            add_segment()
+            segment_lines = []
+        else:
+            segment_lines.append(line)
+    add_segment()
+    return segments, gaps
+
+def load_leak_sets(path, defaults=None):
+    """
+    Yield the leak sets stored in a JSONL file or in a directory.
+
+    Each line of a JSONL file is a JSON object with a "leaks" list and optional "id", "method", "factor",
+    "translation", "positions", "next", "previous" and "output_fmt" keys. If "positions" is not specified,
+    null leaks represent unknown outputs of Math.random().
+    Each file of a directory is a leak set in the text format of the CLI input files and its id is the file name.
+
+    Arguments:
+        path: the JSONL file or the directory.
+
+        (optional) defaults: a dict of values used for the keys missing from a leak set.
+    """
+    defaults = defaults or {}
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            filename = os.path.join(path, name)
+            if not os.path.isfile(filename):
+                continue
+            leak_set = dict(defaults, id=name)
+            if leak_set.get('method') is None:
+                raise ValueError(f'method should be specified for the leak sets of directory {path}')
+            with open(filename, 'r') as f:
+                leak_set['leaks'], leak_set['positions'] = parse_leak_lines(f, leak_set.get('method'))
+            yield leak_set
+        return
+    with open(path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            leak_set = dict(defaults, id=line_number)
+            leak_set.update(json.loads(line))
+            yield leak_set
+
+class BatchCracker():
+    """
+    A class that recovers the MathRandom states of many independent leak sets in a single process.
+
+    The xs128 tables, the solver backend and the worker processes are set up once and shared by all the leak sets.
+
+    Attributes:
+        backend: the name of the linear system solver backend (see xs128crack.SOLVER_BACKENDS).
+
+        workers: the number of worker processes. If not specified, the leak sets are cracked in the current process.
+
+        ordered: if True, states are always reported in increasing cache_idx order.
+
+        collect_stats: if True, the stats of the recovery (see stats.RecoveryStats) are added to each result.
+
+        result_cache: a resultcache.ResultCache where the recovered states of each leak set are looked up and stored.
+    """
+    def __init__(self, backend=None, workers=None, ordered=False, collect_stats=False, result_cache=None):
+        self.backend = backend
+        self.workers = workers
+        self.ordered = ordered
+        self.collect_stats = collect_stats
+        self.result_cache = result_cache
+        # Load the tables before the worker processes are started so that they share them
+        get_tables()
+        self._executor = None
+        if workers and workers > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def recover(self, leak_set, stats=None):
+        """
+        Yield the possible MathRandom states of a leak set (see load_leak_sets for the keys of a leak set).
+
+        Arguments:
+            leak_set: the leak set.
+
+            (optional) stats: a stats.RecoveryStats object that collects timers and counters of the recovery.
+        """
+        method = leak_set.get('method')
+        leaks, positions = _leaks_and_positions(leak_set)
+        options = (positions, self.backend, self.workers, self.ordered, self._executor, stats, self.result_cache)
+        if method == 'doubles':
+            return recover_state_from_math_random_doubles(leaks, *options)
+        elif method == 'scaled':
+            factor = leak_set.get('factor', 1)
+            if factor < 2:
+                raise ValueError('factor should be larger than 1 when using method "scaled"')
+            return recover_state_from_math_random_scaled_values(leaks, factor, leak_set.get('translation', 0), *options)
+        elif method == 'bounds':
+            return recover_state_from_math_random_approximate_values(leaks, *options)
+        else:
+            raise ValueError(f'Unsupported method "{method}"')
+
+    def crack(self, leak_set):
+        """
+        Recover the possible MathRandom states of a leak set and predict the values around the leaks.
+
+        Return a JSON-serializable dict with the id of the leak set and a list of states. Each state has the
+        state0, state1 and cache_idx of MathRandom before the first leak, the "previous" values before the first leak
+        and the "next" values after the last leak. If the leak set is invalid, an "error" message is returned instead.
+        """
+        result = {'id': leak_set.get('id')}
+        stats = RecoveryStats()
+        try:
+            result['states'] = list(self.iter_states(leak_set, stats))
+        except (AssertionError, KeyError, TypeError, ValueError) as e:
+            logger.debug(f'Could not crack leak set {result["id"]}: {e!r}')
+            result['error'] = str(e) or type(e).__name__
+        if self.collect_stats:
+            result['stats'] = stats.to_dict()
+        return result
+
+    def iter_states(self, leak_set, stats=None):
+        """
+        Yield the JSON-serializable dict of each possible state of a leak set (see crack) as soon as it is found.
+
+        Arguments:
+            leak_set: the leak set.
+
+            (optional) stats: a stats.RecoveryStats object that collects timers and counters of the recovery.
+        """
+        fmt = _take_format(leak_set)
+        factor, translation = leak_set.get('factor', 1), leak_set.get('translation', 0)
+        _, positions = _leaks_and_positions(leak_set)
+        last_position = max(positions, default=-1)
+        for state in self.recover(leak_set, stats):
+            state_result = {'state0': state.state0, 'state1': state.state1, 'cache_idx': state.cache_idx}
+            previous = state.take_previous(leak_set.get('previous', 0), fmt, factor, translation)
+            state_result['previous'] = previous.tolist()[::-1]
+            state.advance(len(previous) + last_position + 1)
+            state_result['next'] = state.take(leak_set.get('next', 10), fmt, factor, translation).tolist()
+            yield state_result
+
+    def warm_up(self):
+        """
+        Start all the worker processes now, so that the first leak sets do not wait for them.
+        """
+        if self._executor is not None:
+            for future in [self._executor.submit(_warm_worker, self.backend) for _ in range(self.workers)]:
+                future.result()
+
+    def crack_all(self, leak_sets):
+        """
+        Yield the result of crack for each leak set, as soon as it is available.
+        """
+        for leak_set in leak_sets:
+            yield self.crack(leak_set)
+
+def predict(request):
+    """
+    Predict the values around a known MathRandom state.
+
+    Arguments:
+        request: a dict with the "state0", "state1" and "cache_idx" of MathRandom and optional "previous", "next",
+            "output_fmt", "factor" and "translation" keys like a leak set.
+
+    Return a JSON-serializable dict with the "previous" values before the state and the "next" values after it.
+    """
+    fmt = _take_format(request)
+    factor, translation = request.get('factor', 1), request.get('translation', 0)
+    # The cache is regenerated from the state before the last refill
+    prev_state0, prev_state1 = jump_xs128(request['state0'], request['state1'], -MATH_RANDOM_CACHE_SIZE)
+    state = MathRandom.from_previous_state(prev_state0, prev_state1, request['cache_idx'])
+    previous = state.take_previous(request.get('previous', 0), fmt, factor, translation)
+    state.advance(len(previous))
+    return {'previous': previous.tolist()[::-1], 'next': state.take(request.get('next', 10), fmt, factor, translation).tolist()}
+
+def _take_format(leak_set):
+    output_fmt = leak_set.get('output_fmt', 'doubles')
+    if output_fmt not in OUTPUT_FORMATS:
+        raise ValueError(f'Unsupported output_fmt "{output_fmt}"')
+    return OUTPUT_FORMATS[output_fmt]
+
+def _warm_worker(backend):
+    # Load the tables and the solver backend in a worker process
+    get_tables()
+    if backend == 'sage':
+        import sage.all
+
+def _leaks_and_positions(leak_set):
+    leaks = leak_set['leaks']
+    positions = leak_set.get('positions')
+    if positions is None:
+        # Null leaks are unknown outputs
+        positions = [i for i, leak in enumerate(leaks) if leak is not None]
+        leaks = [leak for leak in leaks if leak is not None]
+    if len(leaks) != len(positions):
+        raise ValueError('leaks and positions should have the same length')
+    return leaks, positions
+
+def crack_batch(leak_sets, backend=None, workers=None, ordered=False, collect_stats=False, result_cache=None):
+    """
+    Yield the result of BatchCracker.crack for each leak set, sharing one warm BatchCracker between all of them.
+
+    Arguments:
+        leak_sets: an iterable of leak sets (see load_leak_sets).
+
+        (optional) backend, workers, ordered, collect_stats, result_cache: the options of the BatchCracker.
+    """
+    with BatchCracker(backend, workers, ordered, collect_stats, result_cache) as cracker:
+        yield from cracker.crack_all(leak_sets)
@@ -0,0 +1,188 @@
+from .xs128 import STATE_SIZE
+
+import random
+
+class EchelonBasis():
+    """
+    A class that represents a linear system in GF(2) reduced to echelon form, with bit-packed rows.
+
+    Each row is an integer where bit i (i < size) is the coefficient of the i-th unknown
+    and bit size is the result of the equation.
+    The pivot of a row is its most significant coefficient.
+
+    Attributes:
+        size: the number of unknowns.
+
+        pivots: a dict that maps a pivot index to the only row of the basis with that pivot.
+    """
+    def __init__(self, size=STATE_SIZE):
+        self.size = size
+        self.pivots = {}
+        self._coeff_mask = (1 << size) - 1
+
+    @property
+    def rank(self):
+        return len(self.pivots)
+
+    def copy(self):
+        basis = EchelonBasis(self.size)
+        basis.pivots = dict(self.pivots)
+        return basis
+
+    def reduce(self, row):
+        """
+        Reduce a packed row with the rows of the basis until its pivot is not in the basis.
+        """
+        coeff_mask = self._coeff_mask
+        pivots = self.pivots
+        while True:
+            coeffs = row & coeff_mask
+            if not coeffs:
+                return row
+            pivot_row = pivots.get(coeffs.bit_length() - 1)
+            if pivot_row is None:
+                return row
+            row ^= pivot_row
+
+    def add(self, row):
+        """
+        Add a packed row to the basis.
+
+        Return True if the row increased the rank of the system, False if it was redundant.
+        Raise ValueError if the row is inconsistent with the system.
+        """
+        row = self.reduce(row)
+        coeffs = row & self._coeff_mask
+        if coeffs:
+            self.pivots[coeffs.bit_length() - 1] = row
+            return True
+        if row:
+            raise ValueError('Linear system has no solution')
+        return False
+
+    def solve(self):
+        """
+        Return a particular solution of the system as a packed integer, where all free unknowns are 0.
+        """
+        size = self.size
+        solution = 0
+        # Each row only depends on unknowns lower than its pivot
+        for pivot in sorted(self.pivots):
+            row = self.pivots[pivot]
+            bit = ((row >> size) ^ (row & solution).bit_count()) & 1
+            solution |= bit << pivot
+        return solution
+
+    def kernel(self):
+        """
+        Return a basis of the kernel of the system as a list of packed integers.
+        """
+        kernel = []
+        sorted_pivots = sorted(self.pivots)
+        for free in range(self.size):
+            if free in self.pivots:
+                continue
+            vector = 1 << free
+            for pivot in sorted_pivots:
+                if pivot > free:
+                    # Unknowns lower than pivot are already set
+                    vector |= ((self.pivots[pivot] & vector).bit_count() & 1) << pivot
+            kernel.append(vector)
+        return kernel
+
+class SolutionSpace():
+    """
+    A class that represents all the solutions of a linear system in GF(2) without enumerating them.
+
+    Solutions are numbered from 0 to count - 1 in Gray code order: solution i is the particular solution XOR the
+    kernel vectors selected by the bits of i ^ (i >> 1), so that two successive solutions differ by a single vector.
+
+    Attributes:
+        v0: a particular solution as a packed integer.
+
+        kernel: a basis of the kernel as a list of packed integers.
+    """
+    __slots__ = ('v0', 'kernel')
+
+    def __init__(self, v0, kernel):
+        self.v0 = v0
+        self.kernel = list(kernel)
+
+    @property
+    def dimension(self):
+        return len(self.kernel)
+
+    @property
+    def count(self):
+        """
+        The exact number of solutions, which can be too large to enumerate.
+        """
+        return 1 << len(self.kernel)
+
+    def __getitem__(self, index):
+        """
+        Return the solution at an index in Gray code order. Negative indices count from the end.
+        """
+        count = self.count
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError('Solution index out of range')
+        gray = index ^ (index >> 1)
+        solution = self.v0
+        for vector in self.kernel:
+            if not gray:
+                break
+            if gray & 1:
+                solution ^= vector
+            gray >>= 1
+        return solution
+
+    def __iter__(self):
+        return self.iter_range()
+
+    def iter_range(self, start=0, stop=None):
+        """
+        Yield the solutions from index start to index stop (excluded) in Gray code order.
+        Each solution after the first one costs a single XOR, and an enumeration can be split in chunks
+        or resumed from any index.
+        """
+        stop = self.count if stop is None else min(stop, self.count)
+        if start >= stop:
+            return
+        solution = self[start]
+        yield solution
+        kernel = self.kernel
+        for i in range(start + 1, stop):
+            # Solutions i - 1 and i differ by the vector of the lowest set bit of i
+            solution ^= kernel[(i & -i).bit_length() - 1]
+            yield solution
+
+    def sample(self, n=1, rng=None):
+        """
+        Return a list of n solutions drawn uniformly at random, with replacement.
+
+        Arguments:
+            (optional) n: the number of solutions.
+
+            (optional) rng: a random.Random object. If not specified, the random module is used.
+        """
+        rng = rng or random
+        return [self[rng.getrandbits(len(self.kernel))] for _ in range(n)]
+
+def solve_packed(rows, size=STATE_SIZE):
+    """
+    Solve a linear system in GF(2) with XOR-row elimination on packed rows.
+
+    Arguments:
+        rows: an iterable of packed rows (see EchelonBasis).
+
+        size: the number of unknowns.
+
+    Return a particular solution and a basis of the kernel as packed integers.
+    Raise ValueError if the system has no solution.
+    """
+    basis = EchelonBasis(size)
+    for row in rows:
+        basis.add(row)
+    return basis.solve(), basis.kernel()
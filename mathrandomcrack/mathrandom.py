@@ -1,10 +1,25 @@
 from .xs128 import *
+from .xs128tables import apply_rows, get_tables, jump_xs128
 
 import copy
+import math
 import struct
+from array import array
 from random import randint
 
 MATH_RANDOM_CACHE_SIZE = 64
+# Maximum number of cache blocks generated at once by MathRandom.take
+BULK_MAX_LANES = 1024
+# Minimum number of whole cache blocks for MathRandom.take to generate them at once
+BULK_MIN_BLOCKS = 64
+# Number of values converted at once to the "double" and "scaled" formats
+FORMAT_CHUNK_SIZE = 1 << 16
+# Number of values generated and searched at once by MathRandom.find
+FIND_CHUNK_SIZE = 1 << 16
+# Default number of values searched by MathRandom.find
+FIND_MAX_DISTANCE = 1 << 20
+# Layout of MathRandom.snapshot: state0, state1, cache_idx and the 64 cached values, little-endian
+SNAPSHOT_STRUCT = struct.Struct(f'<QQh{MATH_RANDOM_CACHE_SIZE}Q')
 
 def v8_to_double(state0):
     """
@@ -31,6 +46,34 @@ def int64_to_bits(val):
     """
     return [(val >> i) & 1 for i in range(64)]
 
+def _format_values(values, fmt, factor, translation):
+    if fmt == 'uint64':
+        return values
+    # Values are converted by chunks so that only the Python objects of one chunk are alive at once
+    scale = 2.0 ** -53
+    if fmt == 'double':
+        formatted = array('d')
+        for start in range(0, len(values), FORMAT_CHUNK_SIZE):
+            # Same as v8_to_double for each value
+            formatted.extend([(v >> 11) * scale for v in values[start:start + FORMAT_CHUNK_SIZE]])
+        return formatted
+    floor = math.floor
+    formatted = array('q')
+    for start in range(0, len(values), FORMAT_CHUNK_SIZE):
+        formatted.extend([floor((v >> 11) * scale * factor + translation) for v in values[start:start + FORMAT_CHUNK_SIZE]])
+    return formatted
+
+def _aligned_matches(haystack, needle, itemsize):
+    """
+    Yield the item offsets where needle occurs in haystack, two byte strings of items of the given size.
+    """
+    start = haystack.find(needle)
+    while start >= 0:
+        misalignment = start % itemsize
+        if not misalignment:
+            yield start // itemsize
+        start = haystack.find(needle, start + itemsize - misalignment)
+
 class MathRandom():
     """
     A class that simulates V8 Math.random behaviour.
@@ -41,8 +84,10 @@ class MathRandom():
         cache_idx: the index in the internal cache.
             Decrements every time a random value is consumed by next().
 
-        cache: the 64-long list of random 64-bit values generated by xs128.
+        cache: the 64-long array of random 64-bit values generated by xs128.
     """
+    __slots__ = ('state0', 'state1', 'cache_idx', 'cache')
+
     def __init__(self, state0=None, state1=None):
         """
         Initialize internal Math.random state.
@@ -57,9 +102,60 @@ class MathRandom():
         self.state0 = state0
         self.state1 = state1
         self.cache_idx = -1
-        self.cache = []
+        self.cache = array('Q')
         self._refill()
 
+    @classmethod
+    def from_previous_state(cls, prev_state0, prev_state1, cache_idx):
+        """
+        Create a MathRandom from the values of state0 and state1 before the previous refill, with a single refill.
+
+        Arguments:
+            prev_state0, prev_state1: the values of state0 and state1 before the previous refill.
+
+            cache_idx: the cache index that should be set after refill.
+        """
+        math_random = cls.__new__(cls)
+        math_random.recover_from_previous_state(prev_state0, prev_state1, cache_idx)
+        return math_random
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """
+        Create a MathRandom from a byte string returned by snapshot(), without generating any value.
+        """
+        math_random = cls.__new__(cls)
+        math_random.restore(snapshot)
+        return math_random
+
+    def fork(self):
+        """
+        Return an independent MathRandom in the same state, without generating any value.
+        """
+        math_random = MathRandom.__new__(MathRandom)
+        math_random.state0 = self.state0
+        math_random.state1 = self.state1
+        math_random.cache_idx = self.cache_idx
+        math_random.cache = array('Q', self.cache)
+        return math_random
+
+    def snapshot(self):
+        """
+        Save the state as a byte string of SNAPSHOT_STRUCT.size bytes that can be given to restore() or from_snapshot().
+        """
+        cache = self.cache if len(self.cache) == MATH_RANDOM_CACHE_SIZE else [0] * MATH_RANDOM_CACHE_SIZE
+        return SNAPSHOT_STRUCT.pack(self.state0, self.state1, self.cache_idx, *cache)
+
+    def restore(self, snapshot):
+        """
+        Set the state saved by snapshot().
+        """
+        state0, state1, cache_idx, *cache = SNAPSHOT_STRUCT.unpack(snapshot)
+        self.state0 = state0
+        self.state1 = state1
+        self.cache_idx = cache_idx
+        self.cache = array('Q', cache)
+
     def next(self):
         """
         Output the result of a call to Math.random() (a double between 0.0 and 1.0).
@@ -82,6 +178,210 @@ class MathRandom():
         val = v8_to_double(self.cache[self.cache_idx])
         return val
 
+    def advance(self, n):
+        """
+        Skip the next n outputs of Math.random(), exactly as if next() was called n times.
+        Whole cache blocks are skipped with a single xs128 jump.
+        """
+        assert n >= 0
+        if n <= self.cache_idx + 1:
+            self.cache_idx -= n
+            return
+        remaining = n - (self.cache_idx + 1)
+        # Number of refills needed to consume the remaining values
+        refills = (remaining + MATH_RANDOM_CACHE_SIZE - 1) // MATH_RANDOM_CACHE_SIZE
+        self.state0, self.state1 = jump_xs128(self.state0, self.state1, (refills - 1) * MATH_RANDOM_CACHE_SIZE)
+        self.cache_idx = -1
+        self._refill()
+        self.cache_idx -= remaining - (refills - 1) * MATH_RANDOM_CACHE_SIZE
+
+    def rewind(self, n):
+        """
+        Go back over the n previous outputs of Math.random(), exactly as if previous() was called n times.
+        Whole cache blocks are skipped with a single xs128 jump.
+        """
+        assert n >= 0
+        if self.cache_idx + n < MATH_RANDOM_CACHE_SIZE:
+            self.cache_idx += n
+            return
+        remaining = self.cache_idx + n - (MATH_RANDOM_CACHE_SIZE - 1)
+        # Number of backward refills needed to go back over the remaining values
+        refills = (remaining + MATH_RANDOM_CACHE_SIZE - 1) // MATH_RANDOM_CACHE_SIZE
+        # The cache of the last backward refill is generated from the state one more block before
+        self.state0, self.state1 = jump_xs128(self.state0, self.state1, -(refills + 1) * MATH_RANDOM_CACHE_SIZE)
+        self.cache_idx = -1
+        self._refill()
+        self.cache_idx = remaining - (refills - 1) * MATH_RANDOM_CACHE_SIZE - 1
+
+    def at(self, index):
+        """
+        Return the output of Math.random() at a given index relatively to the current state without changing it.
+        Index 0 is the value returned by the next call to next(), index -1 is the value returned by the next call to previous().
+        """
+        math_random = copy.copy(self)
+        if index >= 0:
+            math_random.advance(index)
+            return math_random.next()
+        math_random.rewind(-index - 1)
+        return math_random.previous()
+
+    def take(self, n, fmt='double', factor=1, translation=0):
+        """
+        Output the results of the next n calls to Math.random(), exactly as if next() was called n times.
+        Values are generated by whole cache blocks and converted in bulk.
+
+        Arguments:
+            n: the number of values to generate.
+
+            (optional) fmt: the format of the values.
+                "double" (default): the doubles returned by Math.random() in an array of type 'd'.
+                "uint64": the raw 64-bit state0 values of xs128 in an array of type 'Q'.
+                "scaled": the integers Math.floor(Math.random() * factor + translation) in an array of type 'q'.
+
+            (optional) factor, translation: the integers used by the "scaled" format.
+
+        Return an array.array of n values, which supports the buffer protocol (e.g. for numpy.frombuffer).
+        """
+        if fmt not in ['double', 'uint64', 'scaled']:
+            raise ValueError(f'Unsupported fmt "{fmt}"')
+        values = array('Q')
+        while n > 0:
+            if self.cache_idx < 0:
+                # Whole cache blocks before the last one are generated at once
+                blocks = (n - 1) // MATH_RANDOM_CACHE_SIZE
+                if blocks >= BULK_MIN_BLOCKS:
+                    bulk_values = self._bulk_blocks(blocks)
+                    values.extend(bulk_values)
+                    n -= len(bulk_values)
+                    continue
+                self._refill()
+            count = min(n, self.cache_idx + 1)
+            # Math.random() consumes the cache from the end
+            values.extend(reversed(self.cache[self.cache_idx - count + 1:self.cache_idx + 1]))
+            self.cache_idx -= count
+            n -= count
+        return _format_values(values, fmt, factor, translation)
+
+    def take_previous(self, n, fmt='double', factor=1, translation=0):
+        """
+        Output the results of the n previous calls to Math.random(), exactly as if previous() was called n times.
+        The values are generated forwards in bulk with take() after a single jump backwards.
+
+        Arguments:
+            n: the number of values to generate.
+
+            (optional) fmt, factor, translation: the format of the values (see take).
+
+        Return an array.array of n values, in the order they are returned by previous().
+        """
+        if fmt not in ['double', 'uint64', 'scaled']:
+            raise ValueError(f'Unsupported fmt "{fmt}"')
+        self.rewind(n)
+        saved = self.state0, self.state1, self.cache_idx, self.cache
+        values = self.take(n, 'uint64')
+        self.state0, self.state1, self.cache_idx, self.cache = saved
+        values.reverse()
+        return _format_values(values, fmt, factor, translation)
+
+    def find(self, pattern, fmt='double', factor=1, translation=0, max_distance=FIND_MAX_DISTANCE, direction='forward', limit=None):
+        """
+        Find where a pattern of successive outputs of Math.random() occurs in the stream, without changing the state.
+        Values are generated by chunks with take() or take_previous() and each chunk is searched at once.
+
+        Arguments:
+            pattern: a sequence of successive values in the order they are returned by next(), or a single value.
+                Can also be a list of such sequences to search several patterns at once.
+
+            (optional) fmt, factor, translation: the format of the values of the pattern (see take).
+
+            (optional) max_distance: the number of values searched, a match must be entirely within them.
+
+            (optional) direction: "forward" to search the next values, "backward" to search the previous values.
+
+            (optional) limit: stop the search once this number of matches is found.
+
+        Return the list of the indices of the matches, nearest first, with the same convention as at():
+        index i means that the pattern starts with the output at index i, which is returned after i calls to next().
+        With several patterns, return a list of (index, pattern_number) tuples instead.
+        """
+        if fmt not in ['double', 'uint64', 'scaled']:
+            raise ValueError(f'Unsupported fmt "{fmt}"')
+        if direction not in ['forward', 'backward']:
+            raise ValueError(f'Unsupported direction "{direction}"')
+        if not isinstance(pattern, (list, tuple, array)):
+            pattern = [pattern]
+        several = len(pattern) > 0 and all(isinstance(p, (list, tuple, array)) for p in pattern)
+        patterns = pattern if several else [pattern]
+        if not patterns or not all(len(p) for p in patterns):
+            raise ValueError('Patterns should not be empty')
+        typecode = {'double': 'd', 'uint64': 'Q', 'scaled': 'q'}[fmt]
+        needles = [array(typecode, p) for p in patterns]
+        itemsize = needles[0].itemsize
+        longest = max(len(needle) for needle in needles)
+        math_random = self.fork()
+        matches = []
+        scanned = 0
+        # Values of the previous chunk where a match of the next chunk can end (forward) or start (backward)
+        overlap = array(typecode)
+        while scanned < max_distance and (limit is None or len(matches) < limit):
+            count = min(FIND_CHUNK_SIZE, max_distance - scanned)
+            if direction == 'forward':
+                values = overlap + math_random.take(count, fmt, factor, translation)
+                first = scanned - len(overlap)
+            else:
+                values = math_random.take_previous(count, fmt, factor, translation)
+                values.reverse()
+                values += overlap
+                first = -scanned - count
+            haystack = values.tobytes()
+            found = []
+            for number, needle in enumerate(needles):
+                for offset in _aligned_matches(haystack, needle.tobytes(), itemsize):
+                    # Matches that are entirely in the overlap were found with the previous chunk
+                    if (direction == 'forward' and offset + len(needle) > len(overlap)) \
+                            or (direction == 'backward' and offset < count):
+                        found.append((first + offset, number))
+            found.sort(key=lambda match: (abs(match[0]), match[1]))
+            matches.extend(found)
+            if direction == 'forward':
+                overlap = values[len(values) - (longest - 1):]
+            else:
+                overlap = values[:longest - 1]
+            scanned += count
+        if limit is not None:
+            matches = matches[:limit]
+        if several:
+            return matches
+        return [index for index, _ in matches]
+
+    def _bulk_blocks(self, blocks):
+        """
+        Generate up to the given number of whole cache blocks at once, starting from an empty cache.
+        The blocks are split into lanes that are generated in parallel by xs128_parallel_states.
+
+        Return the generated values in Math.random() output order. The state is set after the last generated block.
+        """
+        assert self.cache_idx == -1
+        lanes = min(blocks, BULK_MAX_LANES)
+        blocks_per_lane = blocks // lanes
+        steps = blocks_per_lane * MATH_RANDOM_CACHE_SIZE
+        # Starting states of the lanes
+        lane_jump = get_tables().transition(steps)
+        state = self.state0 | (self.state1 << HALF_STATE_SIZE)
+        states = []
+        for _ in range(lanes):
+            states.append((state & ((1 << HALF_STATE_SIZE) - 1), state >> HALF_STATE_SIZE))
+            state = apply_rows(lane_jump, state)
+        generated, final_states = xs128_parallel_states(states, steps)
+        values = array('Q')
+        for lane in range(lanes):
+            lane_values = generated[lane::lanes]
+            # Math.random() consumes each cache block from the end
+            for start in range(0, steps, MATH_RANDOM_CACHE_SIZE):
+                values.extend(lane_values[start + MATH_RANDOM_CACHE_SIZE - 1:start - 1 if start else None:-1])
+        self.state0, self.state1 = final_states[-1]
+        return values
+
     def recover_from_previous_state(self, prev_state0, prev_state1, cache_idx):
         """
         Recover a MathRandom internal state using the values of state0 and state1 before the previous refill.
@@ -92,7 +392,6 @@ class MathRandom():
 
             cache_idx: the cache index that should be set after refill.
         """
-        self.cache = []
         self.cache_idx = -1
         self.state0 = prev_state0
         self.state1 = prev_state1
@@ -104,14 +403,12 @@ class MathRandom():
         Refill the Math.random cache using xs128.
         Can only be used when Math.random cache is empty.
 
-        A new 64-long list of random values is stored in cache.
+        A new 64-long array of random values is stored in cache.
         The cache_idx is set to the last index of the cache (63).
         """
         assert self.cache_idx == -1
-        self.cache = []
-        for _ in range(MATH_RANDOM_CACHE_SIZE):
-            self.state0, self.state1 = xs128(self.state0, self.state1)
-            self.cache.append(self.state0)
+        cache, (self.state0, self.state1) = xs128_states(self.state0, self.state1, MATH_RANDOM_CACHE_SIZE)
+        self.cache = array('Q', cache)
         self.cache_idx = MATH_RANDOM_CACHE_SIZE - 1
 
     def _refill_backwards(self):
@@ -119,34 +416,24 @@ class MathRandom():
         Refill the Math.random cache backwards using xs128.
         Can only be used when Math.random cache is full.
 
-        A new 64-long list of random values is stored in cache.
+        A new 64-long array of random values is stored in cache.
         The cache_idx is set to the first index of the cache (0).
         """
         assert self.cache_idx == 64
-        self.cache = []
-        # First loop generates values of the current cache
-        for _ in range(MATH_RANDOM_CACHE_SIZE):
-            self.state0, self.state1 = reverse_xs128(self.state0, self.state1)
-        saved_state0, saved_state1 = self.state0, self.state1
-        # Second loop fills the previous cache
-        for _ in range(MATH_RANDOM_CACHE_SIZE):
-            self.cache.append(self.state0)
-            self.state0, self.state1 = reverse_xs128(self.state0, self.state1)
-        self.state0, self.state1 = saved_state0, saved_state1
+        # The current cache was generated from the state one block before
+        _, (self.state0, self.state1) = reverse_xs128_states(self.state0, self.state1, MATH_RANDOM_CACHE_SIZE)
+        # The previous cache starts with the state0 of that state
+        previous_states, _ = reverse_xs128_states(self.state0, self.state1, MATH_RANDOM_CACHE_SIZE - 1)
+        previous_states.insert(0, self.state0)
         # Cache was generated backwards
-        self.cache = self.cache[::-1]
+        self.cache = array('Q', reversed(previous_states))
         self.cache_idx = 0
     
     def __copy__(self):
         """
         copy.copy() helper function.
         """
-        new_math_random = MathRandom()
-        new_math_random.state0 = self.state0
-        new_math_random.state1 = self.state1
-        new_math_random.cache_idx = self.cache_idx
-        new_math_random.cache = [d for d in self.cache]
-        return new_math_random
+        return self.fork()
     
     def __eq__(self, other):
         return self.cache_idx == other.cache_idx \
@@ -1,11 +1,570 @@
 from .mathrandom import *
-from .xs128crack import recover_seed_from_known_bits
+from .gf2 import EchelonBasis, SolutionSpace, solve_packed
+from .xs128crack import EQUATION_RESERVE, DEFAULT_SOLVER_BACKEND, SOLVER_BACKENDS, StateEquation, iter_solutions, log_equations_count, select_equations
+from .xs128tables import apply_rows, get_tables, jump_xs128
+from .stats import RecoveryStats
+from .resultcache import leak_set_fingerprint
 
+import copy
+import itertools
 import logging
+import math
+from concurrent.futures import as_completed
 
 logger = logging.getLogger(__name__)
 
-def recover_state_from_math_random_known_bits(known_bits, positions=None):
+# Number of equations checked for each hypothesis by RecoveryEngine.screen
+SCREEN_EQUATIONS = 192
+# Hypotheses are screened before being solved when there are more equations than this
+SCREEN_MIN_EQUATIONS = 4096
+# Segments are placed by generating values from each possible state of a segment when there are at most this many
+SEGMENT_SCAN_CANDIDATES = 1024
+# Number of ranges of hypotheses solved by each worker of a parallel search, the solutions of a range are
+# yielded as soon as it is solved so smaller ranges stream results earlier but share less elimination work
+PARALLEL_RANGES_PER_WORKER = 4
+# IncrementalCracker.state verifies the candidates against the leaked values when there are at most this many
+INCREMENTAL_VERIFY_CANDIDATES = 1 << 16
+# The symbolic search of the segments offsets warns about its duration when it may check more offsets than this
+SEGMENT_SYMBOLIC_OFFSETS = 1 << 16
+
+class RecoveryEngine():
+    """
+    A class that shares the linear algebra work between the 64 possible cache indices of the first Math.random() call.
+
+    For a cache_idx c, the value generated by the call at position p = 64 * u + v is the state0 of xs128 after
+    64 * u - v + 65 calls (plus 128 calls if v > c) counted from the state w that is 64 - c calls before the
+    state used for the first cache refill. Relatively to w, each known bit therefore only has two possible equations:
+    a "low" one used by all the hypotheses c >= v and a "high" one used by all the hypotheses c < v.
+    The equations of hypothesis c are the low equations of a prefix of the values grouped by v and the high
+    equations of the matching suffix, so the echelon forms of all prefixes and suffixes are computed once
+    incrementally and merged for each hypothesis. Equations are only selected along the prefixes and the suffixes
+    while they increase the rank, plus a few once it is full, and the unique solutions are checked against the
+    known bits of the other equations.
+
+    Attributes:
+        low_rows, high_rows: 64-long lists of packed equations relatively to w (see gf2.EchelonBasis)
+            where low_rows[v] and high_rows[v] hold the selected equations of values at positions equal to v modulo 64.
+
+        total_equations: the number of known bits, each one is an equation of every hypothesis.
+
+        unselected_bits: a list of (position, [(i, bit), ...]) tuples with the known bits of the values whose
+            equations are not all in the linear systems because the systems had full rank without them
+            (see matches_unselected_bits).
+
+        screen_rows: a list of (v, low_row, high_row) tuples with a small subset of the equations used to
+            quickly reject wrong hypotheses. Known bits are picked from all values in turn, most significant first.
+    """
+    def __init__(self, known_bits, positions):
+        assert all(len(state) == 64 for state in known_bits)
+        assert len(known_bits) == len(positions)
+        tables = get_tables()
+        self.low_rows = [[] for _ in range(MATH_RANDOM_CACHE_SIZE)]
+        self.high_rows = [[] for _ in range(MATH_RANDOM_CACHE_SIZE)]
+        leaks = []
+        for position, bits in sorted(zip(positions, known_bits), key=lambda leak: leak[0]):
+            known = [(i, bit) for i, bit in enumerate(bits) if bit is not None]
+            if known:
+                leaks.append((position, known))
+        self.total_equations = sum(len(known) for _, known in leaks)
+        log_equations_count(self.total_equations)
+        # Collect the steps of xs128 calls needed by the screening equations, their rows are shared with the selection
+        screen_leaks = leaks[:SCREEN_EQUATIONS]
+        step_to_rows = {}
+        for position, _ in screen_leaks:
+            step = self._low_step(position)
+            step_to_rows[step] = None
+            step_to_rows[step + 2 * MATH_RANDOM_CACHE_SIZE] = None
+        for step, rows in tables.iter_state0_rows(sorted(step_to_rows)):
+            step_to_rows[step] = rows
+        # Spread the screening equations over all values
+        self.screen_rows = []
+        for rank in range(HALF_STATE_SIZE):
+            for position, known in screen_leaks:
+                if rank < len(known) and len(self.screen_rows) < SCREEN_EQUATIONS:
+                    i, bit = known[-1 - rank]
+                    v = position % MATH_RANDOM_CACHE_SIZE
+                    low = step_to_rows[self._low_step(position)]
+                    high = step_to_rows[self._low_step(position) + 2 * MATH_RANDOM_CACHE_SIZE]
+                    self.screen_rows.append((v, low[i] | (bit << STATE_SIZE), high[i] | (bit << STATE_SIZE)))
+        groups = [[] for _ in range(MATH_RANDOM_CACHE_SIZE)]
+        for leak in leaks:
+            groups[leak[0] % MATH_RANDOM_CACHE_SIZE].append(leak)
+        # Equations are selected by rank along the prefixes of low equations and the suffixes of high equations,
+        # which every hypothesis merges (see solve_all), and the rows of the other equations are not even computed
+        low_consumed = self._select_rows(tables, step_to_rows, groups, range(MATH_RANDOM_CACHE_SIZE), 0, self.low_rows)
+        high_consumed = self._select_rows(tables, step_to_rows, groups, range(MATH_RANDOM_CACHE_SIZE - 1, -1, -1), 2 * MATH_RANDOM_CACHE_SIZE, self.high_rows)
+        self.unselected_bits = sorted(leak for v, group in enumerate(groups) for leak in group[min(low_consumed[v], high_consumed[v]):])
+        self._matching_hypotheses = {}
+        logger.debug(f'Selected {sum(map(len, self.low_rows))} low and {sum(map(len, self.high_rows))} high equation(s) out of {self.total_equations}')
+
+    @classmethod
+    def _select_rows(cls, tables, step_to_rows, groups, order, step_offset, selected_rows):
+        # Select the equations of the values grouped by position modulo 64, taking the groups in the given order,
+        # while they increase the rank of the equations of the previous groups and EQUATION_RESERVE more once
+        # it is full. A redundant equation of a group is implied by equations that all the hypotheses using it
+        # share, so it is checked and dropped on the way. If an equation is inconsistent, it is kept so that the
+        # hypotheses using it are rejected and the selection stops.
+        # step_to_rows maps steps to dependency rows that are already known.
+        # Return the number of values of each group whose equations were all consumed
+        basis = EchelonBasis()
+        reserve = EQUATION_RESERVE
+        consumed = [0] * MATH_RANDOM_CACHE_SIZE
+        for v in order:
+            steps = [cls._low_step(position) + step_offset for position, _ in groups[v]]
+            # Rows that are not known yet are only computed when they are reached
+            missing_rows = tables.iter_state0_rows([step for step in steps if step not in step_to_rows])
+            for step, (_, known) in zip(steps, groups[v]):
+                rows = step_to_rows.get(step)
+                if rows is None:
+                    _, rows = next(missing_rows)
+                for i, bit in known:
+                    if basis.rank == STATE_SIZE and reserve <= 0:
+                        return consumed
+                    row = rows[i] | (bit << STATE_SIZE)
+                    full_rank = basis.rank == STATE_SIZE
+                    try:
+                        if basis.add(row) or full_rank:
+                            reserve -= full_rank
+                            selected_rows[v].append(row)
+                    except ValueError:
+                        selected_rows[v].append(row)
+                        return consumed
+                consumed[v] += 1
+        return consumed
+
+    @staticmethod
+    def _low_step(position):
+        # Index of the xs128 call (starting at 0) relatively to w for the hypotheses c >= position % 64
+        u, v = divmod(position, MATH_RANDOM_CACHE_SIZE)
+        return MATH_RANDOM_CACHE_SIZE * u - v + MATH_RANDOM_CACHE_SIZE
+
+    def matches_unselected_bits(self, cache_idx, w_solution):
+        """
+        Check the unique solution relatively to w of a cache_idx hypothesis against the known bits of the values
+        whose equations were not all selected.
+        Hypotheses whose system has full rank from the same prefix or suffix share their solution, which is only
+        checked once for all of them.
+        """
+        matching = self._matching_hypotheses.get(w_solution)
+        if matching is None:
+            matching = self._matching_hypotheses[w_solution] = self._match_unselected_bits(w_solution)
+        return matching[0] <= cache_idx < matching[1]
+
+    def _match_unselected_bits(self, w_solution):
+        # Return the (first, end) range of the hypotheses matching the unselected bits from w_solution: the known bits
+        # of a value at v must match its low step for the hypotheses c >= v and its high step for the hypotheses c < v
+        steps = sorted(set(step for position, _ in self.unselected_bits
+                for step in (self._low_step(position), self._low_step(position) + 2 * MATH_RANDOM_CACHE_SIZE)))
+        values = {}
+        state0, state1 = w_solution & ((1 << HALF_STATE_SIZE) - 1), w_solution >> HALF_STATE_SIZE
+        calls = 0
+        for step in steps:
+            state0, state1 = jump_xs128(state0, state1, step + 1 - calls)
+            calls = step + 1
+            values[step] = state0
+        first, end = 0, MATH_RANDOM_CACHE_SIZE
+        for position, known in self.unselected_bits:
+            v = position % MATH_RANDOM_CACHE_SIZE
+            low = values[self._low_step(position)]
+            high = values[self._low_step(position) + 2 * MATH_RANDOM_CACHE_SIZE]
+            if any((low >> i) & 1 != bit for i, bit in known):
+                end = min(end, v)
+            if any((high >> i) & 1 != bit for i, bit in known):
+                first = max(first, v)
+        return first, end
+
+    def hypothesis_rows(self, cache_idx):
+        """
+        Yield the packed equations relatively to w of the given cache_idx hypothesis.
+        """
+        for v in range(MATH_RANDOM_CACHE_SIZE):
+            for row in (self.low_rows[v] if v <= cache_idx else self.high_rows[v]):
+                yield row
+
+    def screen(self, cache_idx):
+        """
+        Check the screening equations of a cache_idx hypothesis incrementally.
+
+        Return None as soon as a contradiction appears, else the number of redundant equations that were
+        found consistent. A wrong hypothesis passes each redundant check with probability 1/2, so the higher
+        the score, the more likely the hypothesis.
+        """
+        basis = EchelonBasis()
+        checks = 0
+        for v, low, high in self.screen_rows:
+            try:
+                if not basis.add(low if v <= cache_idx else high):
+                    checks += 1
+            except ValueError:
+                return None
+        return checks
+
+    def solve(self, cache_idx, backend=None):
+        """
+        Solve the linear system of a single cache_idx hypothesis with any solver backend.
+
+        Return a particular solution and a basis of the kernel for the xs128 state before the first cache refill.
+        Raise ValueError if the hypothesis has no solution.
+        """
+        backend = backend or DEFAULT_SOLVER_BACKEND
+        if backend == 'native':
+            v0, kernel = solve_packed(self.hypothesis_rows(cache_idx))
+        else:
+            # Only pass the equations that increase the rank and a few redundant ones to the solver
+            rows = self.hypothesis_rows(cache_idx)
+            equations, _, exhausted = select_equations(StateEquation.from_row(row) for row in rows)
+            v0, kernel = SOLVER_BACKENDS[backend](equations)
+            if not exhausted:
+                # Equations are only left in rows once the solution is unique, check them against it
+                for row in rows:
+                    if ((row & v0).bit_count() ^ (row >> STATE_SIZE)) & 1:
+                        raise ValueError('Linear system has no solution')
+        if self.unselected_bits and not kernel and not self.matches_unselected_bits(cache_idx, v0):
+            raise ValueError('Linear system has no solution')
+        return self._to_previous_state(cache_idx, v0, kernel)
+
+    def solve_all(self, first=0, last=MATH_RANDOM_CACHE_SIZE - 1):
+        """
+        Solve the linear systems of a range of cache_idx hypotheses by merging shared echelon forms.
+
+        Arguments:
+            (optional) first, last: the range of cache_idx hypotheses to solve. All hypotheses by default.
+
+        Yield (cache_idx, v0, kernel) tuples for each hypothesis that has solutions, where v0 is a particular solution
+        and kernel is a basis of the kernel for the xs128 state before the first cache refill.
+        """
+        # suffixes[c] holds the echelon form of the high equations of values with v > c
+        suffixes = {}
+        suffix = EchelonBasis()
+        try:
+            for v in range(MATH_RANDOM_CACHE_SIZE - 1, first - 1, -1):
+                if v <= last:
+                    # A basis with full rank never changes anymore and can be shared
+                    suffixes[v] = suffix if suffix.rank == STATE_SIZE else suffix.copy()
+                for row in self.high_rows[v]:
+                    suffix.add(row)
+        except ValueError:
+            # Hypotheses with a smaller cache_idx contain the inconsistent equations
+            pass
+        prefix = EchelonBasis()
+        # Unique solutions of the bases with full rank, by identity
+        solutions = {}
+        try:
+            for v in range(first):
+                for row in self.low_rows[v]:
+                    prefix.add(row)
+        except ValueError:
+            # All the hypotheses of the range contain the inconsistent equations
+            return
+        for cache_idx in range(first, last + 1):
+            logger.debug(f'Trying to find a good seed for cache index {cache_idx}')
+            try:
+                for row in self.low_rows[cache_idx]:
+                    prefix.add(row)
+            except ValueError:
+                # Hypotheses with a larger cache_idx contain the inconsistent equations
+                break
+            if cache_idx not in suffixes:
+                continue
+            if prefix.rank == STATE_SIZE or suffixes[cache_idx].rank == STATE_SIZE:
+                # Selected equations often give one side full rank, the other side is only checked against its solution
+                full, other = (prefix, suffixes[cache_idx]) if prefix.rank == STATE_SIZE else (suffixes[cache_idx], prefix)
+                solution = solutions.get(id(full))
+                if solution is None:
+                    solution = solutions[id(full)] = full.solve()
+                if any(((row & solution).bit_count() ^ (row >> STATE_SIZE)) & 1 for row in other.pivots.values()):
+                    # No solution, cache_idx is wrong
+                    continue
+                if self.unselected_bits and not self.matches_unselected_bits(cache_idx, solution):
+                    continue
+                v0, kernel = self._to_previous_state(cache_idx, solution, [])
+                yield cache_idx, v0, kernel
+                continue
+            basis = prefix.copy()
+            try:
+                for row in suffixes[cache_idx].pivots.values():
+                    basis.add(row)
+            except ValueError:
+                # No solution, cache_idx is wrong
+                continue
+            v0, kernel = self._to_previous_state(cache_idx, basis.solve(), basis.kernel())
+            yield cache_idx, v0, kernel
+
+    @staticmethod
+    def _to_previous_state(cache_idx, v0, kernel):
+        # The state before the first refill is 64 - cache_idx xs128 calls after w
+        # xs128 is linear so the kernel can be moved the same way as the particular solution
+        def move(vector):
+            s0, s1 = vector & ((1 << HALF_STATE_SIZE) - 1), vector >> HALF_STATE_SIZE
+            for _ in range(MATH_RANDOM_CACHE_SIZE - cache_idx):
+                s0, s1 = xs128(s0, s1)
+            return s0 | (s1 << HALF_STATE_SIZE)
+        return move(v0), [move(k) for k in kernel]
+
+    @staticmethod
+    def _to_w_state(cache_idx, v0, kernel):
+        # Inverse of _to_previous_state
+        def move(vector):
+            _, (s0, s1) = reverse_xs128_states(vector & ((1 << HALF_STATE_SIZE) - 1), vector >> HALF_STATE_SIZE, MATH_RANDOM_CACHE_SIZE - cache_idx)
+            return s0 | (s1 << HALF_STATE_SIZE)
+        return move(v0), [move(k) for k in kernel]
+
+class IncrementalCracker():
+    """
+    A class that recovers the MathRandom state from leaked values given one at a time.
+
+    Each leaked value is immediately folded into the echelon forms of the cache_idx hypotheses that are still possible,
+    so that the system never has to be solved again from scratch. Like RecoveryEngine, the equations are expressed
+    relatively to the state w of each hypothesis, so that each leaked value only needs two sets of dependency rows.
+    Hypotheses are dropped as soon as a leaked value contradicts them.
+
+    Positions are counted from the first call to Math.random() generated by the recovered states, and values can
+    be added in any order.
+
+    Attributes:
+        bases: a dict that maps each cache_idx hypothesis that is still possible to the EchelonBasis of its equations.
+
+        positions, state_bounds: the positions of the leaked values and the (low, high) inclusive bounds of the
+            64-bit values generated by xs128 at these positions.
+    """
+    def __init__(self, state0_rows=None):
+        """
+        Arguments:
+            (optional) state0_rows: a function that returns the 64 dependency rows of state0 after step+1 calls to xs128.
+                If not specified, the rows are read from the shared tables (see XS128Tables.state0_rows).
+        """
+        self.bases = {cache_idx: EchelonBasis() for cache_idx in range(MATH_RANDOM_CACHE_SIZE)}
+        self.positions = []
+        self.state_bounds = []
+        self._state0_rows = state0_rows or get_tables().state0_rows
+        # Solutions of the hypotheses that have full rank
+        self._solutions = {}
+
+    def copy(self):
+        cracker = IncrementalCracker(self._state0_rows)
+        cracker.bases = {cache_idx: basis.copy() for cache_idx, basis in self.bases.items()}
+        cracker.positions = list(self.positions)
+        cracker.state_bounds = list(self.state_bounds)
+        cracker._solutions = dict(self._solutions)
+        return cracker
+
+    def add_double(self, position, double):
+        """
+        Add a double generated by Math.random() at the given position.
+        """
+        assert 0.0 <= double <= 1.0
+        self.add_state_bounds(position, *state_bounds_from_double(double))
+
+    def add_scaled(self, position, scaled_val, factor, translation=0):
+        """
+        Add a value generated by Math.floor(Math.random() * factor + translation) at the given position.
+        """
+        assert type(factor) is int and factor > 0
+        assert type(translation) is int
+        self.add_state_bounds(position, *state_bounds_from_scaled_value(scaled_val, factor, translation))
+
+    def add_bounds(self, position, bounds):
+        """
+        Add the (low, high) bounds of a value generated by Math.random() at the given position.
+        """
+        assert len(bounds) == 2
+        self.add_state_bounds(position, *state_bounds_from_approximate_value(bounds))
+
+    def add_state_bounds(self, position, low, high):
+        """
+        Add the inclusive bounds of the 64-bit value generated by xs128 for the call to Math.random() at the given position.
+        The most significant bits shared by all values between the bounds are folded into the hypotheses.
+        """
+        assert position >= 0
+        self.positions.append(position)
+        self.state_bounds.append((low, high))
+        common_known_bits = common_bits_between(low, high)
+        known = [(i, bit) for i, bit in enumerate(common_known_bits, HALF_STATE_SIZE - len(common_known_bits))]
+        if not known:
+            return
+        low_step = RecoveryEngine._low_step(position)
+        low = self._state0_rows(low_step)
+        high = self._state0_rows(low_step + 2 * MATH_RANDOM_CACHE_SIZE)
+        low_rows = [low[i] | (bit << STATE_SIZE) for i, bit in known]
+        high_rows = [high[i] | (bit << STATE_SIZE) for i, bit in known]
+        v = position % MATH_RANDOM_CACHE_SIZE
+        for cache_idx in list(self.bases):
+            rows = low_rows if v <= cache_idx else high_rows
+            try:
+                self._add_rows(cache_idx, rows)
+            except ValueError:
+                # No solution, cache_idx is wrong
+                del self.bases[cache_idx]
+                self._solutions.pop(cache_idx, None)
+        logger.debug(f'{len(self.bases)} cache index(es) left after value at position {position}')
+
+    def _add_rows(self, cache_idx, rows):
+        solution = self._solutions.get(cache_idx)
+        if solution is not None:
+            # A full rank system only needs the equations to be checked against its solution
+            for row in rows:
+                if (row & solution).bit_count() & 1 != row >> STATE_SIZE:
+                    raise ValueError('Linear system has no solution')
+            return
+        basis = self.bases[cache_idx]
+        for row in rows:
+            basis.add(row)
+        if basis.rank == STATE_SIZE:
+            self._solutions[cache_idx] = basis.solve()
+
+    @property
+    def remaining_rank(self):
+        """
+        The largest number of unknown bits left among the possible cache_idx hypotheses.
+        """
+        return max((STATE_SIZE - basis.rank for basis in self.bases.values()), default=0)
+
+    @property
+    def candidates_count(self):
+        """
+        The number of states that are consistent with the known bits of the leaked values.
+        """
+        return sum(1 << (STATE_SIZE - basis.rank) for basis in self.bases.values())
+
+    @property
+    def state(self):
+        """
+        The recovered MathRandom state if it is unique, else None.
+        When there are few candidates left, they are checked against the bounds of the leaked values.
+        """
+        if self.candidates_count > INCREMENTAL_VERIFY_CANDIDATES:
+            return None
+        states = list(itertools.islice(self.states(), 2))
+        return states[0] if len(states) == 1 else None
+
+    def states(self):
+        """
+        Yield the possible MathRandom objects that generate values within the bounds of all the leaked values.
+        """
+        rows_cache = {}
+        for cache_idx, basis in self.bases.items():
+            v0, kernel = RecoveryEngine._to_previous_state(cache_idx, basis.solve(), basis.kernel())
+            yield from _iter_math_randoms(cache_idx, v0, kernel, self.positions, self.state_bounds, rows_cache=rows_cache)
+
+def iter_verified_solutions(v0, kernel, leak_rows, leak_bounds):
+    """
+    Yield the solutions of a linear system in GF(2) that also generate leaked values within known bounds.
+
+    The kernel is enumerated as a tree, one leaked value at a time from the tightest bounds to the loosest.
+    For each value, the kernel vectors are reduced to echelon form on the bits of the value, so that choosing
+    vectors from the highest pivot to the lowest fixes the bits of the value from the most significant one and
+    branches that cannot fall within the bounds are pruned early.
+
+    Arguments:
+        v0, kernel: a particular solution and a basis of the kernel as 128-bit integers.
+
+        leak_rows: a list of the 64 dependency rows of each leaked 64-bit value relatively to the solution.
+
+        leak_bounds: a list of (low, high) inclusive bounds for each leaked 64-bit value.
+    """
+    seed_mask = (1 << STATE_SIZE) - 1
+    value_mask = (1 << HALF_STATE_SIZE) - 1
+    shifts = [STATE_SIZE + HALF_STATE_SIZE * l for l in range(len(leak_rows))]
+    # Pack each vector with all its leaked values so that a single XOR updates every value at once
+    def pack(vector):
+        packed = vector
+        for shift, rows in zip(shifts, leak_rows):
+            packed |= apply_rows(rows, vector) << shift
+        return packed
+    order = sorted(range(len(leak_rows)), key=lambda l: leak_bounds[l][1] - leak_bounds[l][0])
+    logger.debug(f'Verifying {1 << len(kernel)} candidate xs128 seed(s) against {len(leak_rows)} leaked values')
+
+    def search(base, vectors, depth):
+        # Leaked values that do not depend on the remaining vectors are already fixed
+        while depth < len(order):
+            l = order[depth]
+            low, high = leak_bounds[l]
+            shift = shifts[l]
+            pivots = {}
+            free = []
+            for vector in vectors:
+                value = (vector >> shift) & value_mask
+                while value:
+                    pivot = value.bit_length() - 1
+                    if pivot not in pivots:
+                        pivots[pivot] = vector
+                        break
+                    vector ^= pivots[pivot]
+                    value = (vector >> shift) & value_mask
+                else:
+                    free.append(vector)
+            if pivots:
+                yield from descend(base, sorted(pivots, reverse=True), pivots, 0, free, depth)
+                return
+            if not low <= (base >> shift) & value_mask <= high:
+                return
+            depth += 1
+        # Remaining vectors do not change any leaked value
+        for candidate in SolutionSpace(base, vectors):
+            yield candidate & seed_mask
+
+    def descend(base, sorted_pivots, pivots, j, free, depth):
+        l = order[depth]
+        low, high = leak_bounds[l]
+        shift = shifts[l]
+        if j == len(sorted_pivots):
+            if low <= (base >> shift) & value_mask <= high:
+                yield from search(base, free, depth + 1)
+            return
+        pivot = sorted_pivots[j]
+        for candidate in (base, base ^ pivots[pivot]):
+            # Vectors with lower pivots cannot change the bits of the value from the pivot upwards
+            prefix = ((candidate >> shift) & value_mask) >> pivot
+            if low >> pivot <= prefix <= high >> pivot:
+                yield from descend(candidate, sorted_pivots, pivots, j + 1, free, depth)
+
+    yield from search(pack(v0), [pack(k) for k in kernel], 0)
+
+def state_bounds_from_double(double):
+    """
+    Return the inclusive bounds of the 64-bit xs128 state0 values that are converted to the given double.
+    """
+    low = v8_from_double(double)
+    return low, low | 0x7ff
+
+def state_bounds_from_scaled_value(scaled_val, factor, translation=0):
+    """
+    Return the inclusive bounds of the 64-bit xs128 state0 values that generate the given scaled value
+    with Math.floor(Math.random() * factor + translation). The factor must be positive.
+    """
+    assert factor > 0
+    # Math.floor(Math.random() * factor + translation) only increases with the 53-bit random value
+    scale = lambda m: math.floor(m / (1 << 53) * factor + translation)
+    m_low = _bisect_53_bits(lambda m: scale(m) >= scaled_val)
+    m_high = _bisect_53_bits(lambda m: scale(m) > scaled_val) - 1
+    return m_low << 11, (m_high << 11) | 0x7ff
+
+def state_bounds_from_approximate_value(bounds):
+    """
+    Return the inclusive bounds of the 64-bit xs128 state0 values that are converted to a double within bounds.
+    """
+    m_low = max(0, math.ceil(float(bounds[0]) * (1 << 53)))
+    m_high = min((1 << 53) - 1, math.floor(float(bounds[1]) * (1 << 53)))
+    return m_low << 11, (m_high << 11) | 0x7ff
+
+def _bisect_53_bits(predicate):
+    # Smallest 53-bit value for which a monotonic predicate is true, or 2^53 if there is none
+    low, high = 0, 1 << 53
+    while low < high:
+        mid = (low + high) // 2
+        if predicate(mid):
+            high = mid
+        else:
+            low = mid + 1
+    return low
+
+def _hypothesis_step(position, cache_idx):
+    # Index of the xs128 call (starting at 0) relatively to the state w of the cache_idx hypothesis (see RecoveryEngine)
+    # There are only two possible steps for each position, shared by all the hypotheses
+    step = RecoveryEngine._low_step(position)
+    return step + 2 * MATH_RANDOM_CACHE_SIZE if position % MATH_RANDOM_CACHE_SIZE > cache_idx else step
+
+def recover_state_from_math_random_known_bits(known_bits, positions=None, backend=None, workers=None, ordered=False, state_bounds=None, executor=None, stats=None):
     """
     Recover all the possible MathRandom states given a list of known bits of values generated by Math.random().
 
@@ -17,6 +576,25 @@ def recover_state_from_math_random_known_bits(known_bits, positions=None):
         positions: a list that defines the position of the call that generated each known_bits value with Math.random().
             If not specified, it will be assumed that values represented by known_bits were generated by successive Math.random() calls.
 
+        (optional) backend: the name of the linear system solver backend to use (see xs128crack.SOLVER_BACKENDS).
+
+        (optional) workers: the number of processes used to search the cache_idx hypotheses in parallel.
+            If not specified, the search runs in the current process.
+
+        (optional) ordered: if True, states are always yielded in increasing cache_idx order.
+            Else, states found by parallel workers are yielded as soon as they are available.
+
+        (optional) executor: a concurrent.futures.Executor that runs the search instead of a new pool of processes.
+            The hypotheses are split between the given number of workers. This avoids starting new processes
+            for each recovery (see batch.BatchCracker).
+
+        (optional) state_bounds: a list of (low, high) inclusive bounds of each 64-bit value generated by xs128.
+            If specified, only states that generate values within bounds are yielded.
+            This is useful when the bounds carry more information than the known bits.
+
+        (optional) stats: a stats.RecoveryStats object that collects the time spent in each phase of the recovery,
+            counters and information about each cache_idx hypothesis while the states are yielded.
+
     Yield possible MathRandom() objects that are initialized to a valid internal state before the
         generation of the given list of known_bits values at specified positions.
     """
@@ -25,33 +603,127 @@ def recover_state_from_math_random_known_bits(known_bits, positions=None):
     if not positions:
         positions = [i for i in range(len(known_bits))]
     assert len(known_bits) == len(positions)
-    index_to_known_bits = {positions[i]:known_bits[i] for i in range(len(known_bits))}
+    assert state_bounds is None or len(state_bounds) == len(known_bits)
+    stats = stats or RecoveryStats()
+    with stats.timer('equations'):
+        engine = RecoveryEngine(known_bits, positions)
+    stats.count('equations', engine.total_equations)
+    # Dependency rows of the leaked values shared by the verification of all the hypotheses
+    rows_cache = {}
     # Bruteforce the cache_idx value at the first Math.random call
+    for cache_idx, v0, kernel in _solve_hypotheses(engine, backend, workers, ordered, executor, stats):
+        stats.count('hypotheses_solved')
+        stats.hypothesis(cache_idx, equations=engine.total_equations, rank=STATE_SIZE - len(kernel), kernel_dimension=len(kernel))
+        states = 0
+        for math_random in _iter_math_randoms(cache_idx, v0, kernel, positions, state_bounds, stats, rows_cache):
+            states += 1
+            stats.emit('state', {'cache_idx': cache_idx, 'state0': math_random.state0, 'state1': math_random.state1})
+            yield math_random
+        stats.hypothesis(cache_idx, states=states)
     for cache_idx in range(MATH_RANDOM_CACHE_SIZE):
+        if cache_idx not in stats.hypotheses:
+            stats.count('hypotheses_rejected')
+            stats.hypothesis(cache_idx, rejected='solve')
+    stats.done()
+
+def _iter_math_randoms(cache_idx, v0, kernel, positions, state_bounds, stats=None, rows_cache=None):
+    # Yield the MathRandom objects of a solved cache_idx hypothesis that generate values within state_bounds
+    # rows_cache maps steps relatively to w to dependency rows and can be shared between hypotheses
+    stats = stats or RecoveryStats()
+    stats.count('linear_candidates', 1 << len(kernel))
+    if state_bounds is None:
+        seeds = iter_solutions(v0, kernel)
+    else:
+        with stats.timer('verify'):
+            # Candidates are checked relatively to w so that the rows of each position are only computed twice
+            rows_cache = {} if rows_cache is None else rows_cache
+            steps = [_hypothesis_step(position, cache_idx) for position in positions]
+            rows_cache.update(get_tables().iter_state0_rows(sorted(set(step for step in steps if step not in rows_cache))))
+            w0, w_kernel = RecoveryEngine._to_w_state(cache_idx, v0, kernel)
+        w_seeds = iter_verified_solutions(w0, w_kernel, [rows_cache[step] for step in steps], state_bounds)
+        seeds = (RecoveryEngine._to_previous_state(cache_idx, seed, [])[0] for seed in w_seeds)
+    for seed in stats.timed('verify', seeds):
+        with stats.timer('candidates'):
+            math_random = MathRandom.from_previous_state(seed & ((1 << HALF_STATE_SIZE) - 1), seed >> HALF_STATE_SIZE, cache_idx)
+        stats.count('states')
+        yield math_random
+
+def _solve_hypotheses(engine, backend, workers, ordered, executor=None, stats=None):
+    stats = stats or RecoveryStats()
+    native = (backend or DEFAULT_SOLVER_BACKEND) == 'native'
+    if not native or engine.total_equations > SCREEN_MIN_EQUATIONS:
+        # Reject most wrong hypotheses with a few equations and solve the most likely ones first
+        with stats.timer('screen'):
+            scores = {cache_idx: engine.screen(cache_idx) for cache_idx in range(MATH_RANDOM_CACHE_SIZE)}
+        survivors = [cache_idx for cache_idx, score in scores.items() if score is not None]
+        logger.debug(f'{len(survivors)} cache index(es) left after screening')
+        for cache_idx, score in scores.items():
+            if score is None:
+                stats.count('hypotheses_screened_out')
+                stats.hypothesis(cache_idx, rejected='screen')
+        if not ordered:
+            survivors.sort(key=lambda cache_idx: scores[cache_idx], reverse=True)
+        ranges = [(cache_idx, cache_idx) for cache_idx in survivors]
+    elif workers and workers > 1:
+        # Each range shares the elimination work within contiguous hypotheses
+        chunk_size = -(-MATH_RANDOM_CACHE_SIZE // (workers * PARALLEL_RANGES_PER_WORKER))
+        ranges = [(first, min(first + chunk_size, MATH_RANDOM_CACHE_SIZE) - 1) for first in range(0, MATH_RANDOM_CACHE_SIZE, chunk_size)]
+    else:
+        ranges = [(0, MATH_RANDOM_CACHE_SIZE - 1)]
+    yield from stats.timed('solve', _solve_ranges(engine, ranges, backend, workers, ordered, executor))
+
+def _solve_ranges(engine, ranges, backend, workers, ordered, executor):
+    if executor is not None:
+        # Workers of a shared executor receive the engine with each range
+        futures = [executor.submit(_solve_engine_range, engine, first, last, backend) for first, last in ranges]
+        try:
+            for future in (futures if ordered else as_completed(futures)):
+                yield from future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+        return
+    if not workers or workers <= 1:
+        for first, last in ranges:
+            yield from _solve_range(engine, first, last, backend)
+        return
+    # multiprocessing is only imported when a recovery actually runs in parallel
+    from concurrent.futures import ProcessPoolExecutor
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(engine,))
+    try:
+        futures = [executor.submit(_solve_worker_range, first, last, backend) for first, last in ranges]
+        for future in (futures if ordered else as_completed(futures)):
+            yield from future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def _solve_range(engine, first, last, backend):
+    if (backend or DEFAULT_SOLVER_BACKEND) == 'native' and first != last:
+        yield from engine.solve_all(first, last)
+        return
+    for cache_idx in range(first, last + 1):
         logger.debug(f'Trying to find a good seed for cache index {cache_idx}')
-        known_states_bits = []
-        # Account for Math.random cache reverting outputs order by blocks of size 64
-        for i in range(MATH_RANDOM_CACHE_SIZE * ((max(positions) // MATH_RANDOM_CACHE_SIZE) + 2)):
-            cache_n = i // MATH_RANDOM_CACHE_SIZE
-            value_index = cache_n * MATH_RANDOM_CACHE_SIZE + cache_idx - (i % MATH_RANDOM_CACHE_SIZE)
-            if value_index in index_to_known_bits:
-                # If we know bits of the value at this index, add its bits to the list of known states bits
-                known_states_bits.append(index_to_known_bits[value_index])
-            else:
-                # Else, we don't know any bits for this state
-                known_states_bits.append([None for _ in range(64)])
-        # Try to recover possible seeds for this starting cache_idx
-        seeds = recover_seed_from_known_bits(known_states_bits)
         try:
-            for seed in seeds:
-                math_random = MathRandom()
-                math_random.recover_from_previous_state(seed[0], seed[1], cache_idx)
-                yield math_random
+            v0, kernel = engine.solve(cache_idx, backend)
         except ValueError as e:
             # No solution, cache_idx is wrong
-            pass
+            continue
+        yield cache_idx, v0, kernel
+
+# RecoveryEngine shared by the hypotheses of a worker process
+_worker_engine = None
+
+def _init_worker(engine):
+    global _worker_engine
+    _worker_engine = engine
+
+def _solve_worker_range(first, last, backend):
+    return list(_solve_range(_worker_engine, first, last, backend))
+
+def _solve_engine_range(engine, first, last, backend):
+    return list(_solve_range(engine, first, last, backend))
 
-def recover_state_from_math_random_doubles(doubles, positions=None):
+def recover_state_from_math_random_doubles(doubles, positions=None, backend=None, workers=None, ordered=False, executor=None, stats=None, result_cache=None):
     """
     Recover all the possible MathRandom states given a list of doubles generated by Math.random().
 
@@ -62,20 +734,34 @@ def recover_state_from_math_random_doubles(doubles, positions=None):
         positions: a list that defines the position of the call that generated each double with Math.random().
             If not specified, it will be assumed that doubles were generated by successive Math.random() calls.
 
+        (optional) backend: the name of the linear system solver backend to use (see xs128crack.SOLVER_BACKENDS).
+
+        (optional) workers, ordered, executor: parallel search options (see recover_state_from_math_random_known_bits).
+
+        (optional) stats: a stats.RecoveryStats object (see recover_state_from_math_random_known_bits).
+
+        (optional) result_cache: a resultcache.ResultCache where the recovered states are looked up and stored.
+
     Yield possible MathRandom() objects that are initialized to a valid internal state before the
         generation of the given list of doubles at specified positions.
     """
     assert all(0.0 <= d <= 1.0 for d in doubles)
+    if result_cache is not None:
+        fingerprint = leak_set_fingerprint('doubles', doubles, positions)
+        yield from result_cache.cached(fingerprint, lambda: recover_state_from_math_random_doubles(doubles, positions, backend, workers, ordered, executor, stats), stats)
+        return
     # Convert doubles to known bits
     known_bits = []
     for double in doubles:
         # V8 double conversion loses 11 bits of information
         known_bits.append([None for _ in range(11)] + int64_to_bits(v8_from_double(double))[11:HALF_STATE_SIZE])
+    # Only yield states that generate the exact doubles
+    state_bounds = [state_bounds_from_double(double) for double in doubles]
     # Recover possible states from known bits
-    for math_random in recover_state_from_math_random_known_bits(known_bits, positions):
+    for math_random in recover_state_from_math_random_known_bits(known_bits, positions, backend, workers, ordered, state_bounds, executor, stats):
         yield math_random
 
-def recover_state_from_math_random_scaled_values(scaled_vals, factor, translation=0, positions=None):
+def recover_state_from_math_random_scaled_values(scaled_vals, factor, translation=0, positions=None, backend=None, workers=None, ordered=False, executor=None, stats=None, result_cache=None):
     """
     Recover all the possible MathRandom states given a list of values generated by Math.floor(Math.random() * factor + translate).
 
@@ -88,25 +774,44 @@ def recover_state_from_math_random_scaled_values(scaled_vals, factor, translatio
         positions: a list that defines the position of the call that generated each values with Math.floor(Math.random() * factor).
             If not specified, it will be assumed that values were generated by successive Math.random() calls.
 
+        (optional) backend: the name of the linear system solver backend to use (see xs128crack.SOLVER_BACKENDS).
+
+        (optional) workers, ordered, executor: parallel search options (see recover_state_from_math_random_known_bits).
+
+        (optional) stats: a stats.RecoveryStats object (see recover_state_from_math_random_known_bits).
+
+        (optional) result_cache: a resultcache.ResultCache where the recovered states are looked up and stored.
+
     Yield possible MathRandom() objects that are initialized to a valid internal state before the
         generation of the given list of scaled values at specified positions.
     """
     assert type(factor) is int
     assert type(translation) is int
+    if result_cache is not None:
+        fingerprint = leak_set_fingerprint('scaled', scaled_vals, positions, factor, translation)
+        yield from result_cache.cached(fingerprint, lambda: recover_state_from_math_random_scaled_values(scaled_vals, factor, translation, positions, backend, workers, ordered, executor, stats), stats)
+        return
+    # Only yield states that generate the exact scaled values
+    state_bounds = None
+    if factor > 0:
+        state_bounds = [state_bounds_from_scaled_value(scaled_val, factor, translation) for scaled_val in scaled_vals]
     # Convert scaled values to known bits
     known_bits = []
-    for scaled_val in scaled_vals:
+    for i, scaled_val in enumerate(scaled_vals):
         # Recover the lower and higher bound of the internal xs128 state
-        low, high = v8_from_double((scaled_val - translation) / factor), v8_from_double((scaled_val - translation + 1) / factor) | 0xfff
+        if state_bounds is not None:
+            low, high = state_bounds[i]
+        else:
+            low, high = v8_from_double((scaled_val - translation) / factor), v8_from_double((scaled_val - translation + 1) / factor) | 0xfff
         # Find the common bits in the state representation of all values between the bounds
         common_known_bits = common_bits_between(low, high)
         # Only keep the common bits
         known_bits.append([None for _ in range(64 - len(common_known_bits))] + common_known_bits)
     # Recover possible states from known bits
-    for math_random in recover_state_from_math_random_known_bits(known_bits, positions):
+    for math_random in recover_state_from_math_random_known_bits(known_bits, positions, backend, workers, ordered, state_bounds, executor, stats):
         yield math_random
 
-def recover_state_from_math_random_approximate_values(bounds, positions=None):
+def recover_state_from_math_random_approximate_values(bounds, positions=None, backend=None, workers=None, ordered=False, executor=None, stats=None, result_cache=None):
     """
     Recover all the possible MathRandom states given a list of bounds that bound values generated by Math.random().
 
@@ -116,23 +821,285 @@ def recover_state_from_math_random_approximate_values(bounds, positions=None):
         positions: a list that defines the position of the call that generated each values with Math.random().
             If not specified, it will be assumed that values were generated by successive Math.random() calls.
 
+        (optional) backend: the name of the linear system solver backend to use (see xs128crack.SOLVER_BACKENDS).
+
+        (optional) workers, ordered, executor: parallel search options (see recover_state_from_math_random_known_bits).
+
+        (optional) stats: a stats.RecoveryStats object (see recover_state_from_math_random_known_bits).
+
+        (optional) result_cache: a resultcache.ResultCache where the recovered states are looked up and stored.
+
     Yield possible MathRandom() objects that are initialized to a valid internal state before the
         generation of the given list of approximated values at specified positions.
     """
     assert all(len(b) == 2 for b in bounds)
+    if result_cache is not None:
+        fingerprint = leak_set_fingerprint('bounds', bounds, positions)
+        yield from result_cache.cached(fingerprint, lambda: recover_state_from_math_random_approximate_values(bounds, positions, backend, workers, ordered, executor, stats), stats)
+        return
+    # Only yield states that generate values within the exact bounds
+    state_bounds = [state_bounds_from_approximate_value(b) for b in bounds]
     # Convert bounds to known bits
     known_bits = []
-    for b in bounds:
-        # Recover the lower and higher bound of the internal xs128 state
-        low, high = v8_from_double(float(b[0])), v8_from_double(float(b[1])) | 0xfff
-        # Find the common bits in the state representation of all values between the bounds
+    for low, high in state_bounds:
+        # Find the common bits in the state representation of all values between the exact bounds of the internal xs128 state
         common_known_bits = common_bits_between(low, high)
         # Only keep the common bits
         known_bits.append([None for _ in range(64 - len(common_known_bits))] + common_known_bits)
     # Recover possible states from known bits
-    for math_random in recover_state_from_math_random_known_bits(known_bits, positions):
+    for math_random in recover_state_from_math_random_known_bits(known_bits, positions, backend, workers, ordered, state_bounds, executor, stats):
         yield math_random
 
+def recover_state_from_math_random_segments(segments, gaps, method='doubles', factor=1, translation=0, stats=None):
+    """
+    Recover all the possible MathRandom states given segments of successive values generated by Math.random(),
+    separated by unknown numbers of calls to Math.random().
+
+    If a segment has few possible states on its own, each of them generates the values around the segment in bulk
+    and the other segments are searched in these values. Else, the offsets of the segments are enumerated
+    symbolically, with the equations of the previous segments shared between all the offsets of the next one.
+    The symbolic search is much slower and should only be needed for segments that are too short to be solved alone:
+    each offset is checked against the solutions of the previous segments with small systems, in the order of a
+    millisecond per offset, and the offsets of successive gaps multiply so large ranges can take hours.
+
+    Arguments:
+        segments: a list of lists of successive leaked values, in the format given by method.
+            None represents an unknown output of Math.random() in a segment.
+
+        gaps: a list of len(segments) - 1 inclusive (min, max) ranges of the number of calls to Math.random()
+            between the end of a segment and the start of the next one.
+
+        (optional) method: the kind of leaked values ("doubles", "scaled" or "bounds").
+
+        (optional) factor, translation: the integers used by the "scaled" method.
+
+        (optional) stats: a stats.RecoveryStats object that collects the time spent in each phase of the search.
+
+    Yield (MathRandom, gaps) tuples where the MathRandom object is initialized to a valid internal state before the
+        generation of the first segment and gaps is the list of the numbers of calls between the segments.
+    """
+    assert len(gaps) == len(segments) - 1
+    assert all(0 <= low <= high for low, high in gaps)
+    stats = stats or RecoveryStats()
+    segments_bounds = [[None if leak is None else _leak_state_bounds(leak, method, factor, translation) for leak in segment] for segment in segments]
+    assert all(any(bounds is not None for bounds in segment_bounds) for segment_bounds in segments_bounds)
+    crackers = []
+    with stats.timer('equations'):
+        for segment_bounds in segments_bounds:
+            cracker = IncrementalCracker()
+            for position, bounds in enumerate(segment_bounds):
+                if bounds is not None:
+                    cracker.add_state_bounds(position, *bounds)
+            crackers.append(cracker)
+    stats.count('segments', len(segments))
+    yield from stats.timed('search', _search_segments(crackers, segments_bounds, gaps, stats))
+    stats.done()
+
+def _search_segments(crackers, segments_bounds, gaps, stats):
+    anchor = min(range(len(crackers)), key=lambda k: crackers[k].candidates_count)
+    if crackers[anchor].candidates_count <= SEGMENT_SCAN_CANDIDATES:
+        logger.debug(f'Scanning gaps from the {crackers[anchor].candidates_count} candidate state(s) of segment {anchor}')
+        stats.count('linear_candidates', crackers[anchor].candidates_count)
+        # Segments before the anchor are searched backwards in reverse order
+        before_bounds = [segment_bounds[::-1] for segment_bounds in segments_bounds[anchor - 1::-1]] if anchor else []
+        after_bounds = segments_bounds[anchor + 1:]
+        for state in crackers[anchor].states():
+            after_state = copy.copy(state)
+            after_state.advance(len(segments_bounds[anchor]))
+            for before_gaps in _scan_gaps(state, before_bounds, gaps[anchor - 1::-1] if anchor else [], True):
+                first_state = copy.copy(state)
+                first_state.rewind(sum(before_gaps) + sum(len(segment_bounds) for segment_bounds in segments_bounds[:anchor]))
+                for after_gaps in _scan_gaps(after_state, after_bounds, gaps[anchor:], False):
+                    stats.count('states')
+                    yield copy.copy(first_state), before_gaps[::-1] + after_gaps
+        return
+    logger.warning(f'No segment can be solved alone, searching the offsets of the segments symbolically')
+    offsets = math.prod(high - low + 1 for low, high in gaps)
+    if offsets > SEGMENT_SYMBOLIC_OFFSETS:
+        logger.warning(f'Up to {offsets} combinations of offsets may be checked, the search can be very slow, consider narrowing the gaps')
+    windows = [_StateRowsWindow() for _ in segments_bounds]
+    for state, found_gaps in _search_gaps(crackers[0], 0, len(segments_bounds[0]), segments_bounds, gaps, windows, []):
+        stats.count('states')
+        yield state, found_gaps
+
+def _leak_state_bounds(leak, method, factor, translation):
+    if method == 'doubles':
+        return state_bounds_from_double(leak)
+    elif method == 'scaled':
+        return state_bounds_from_scaled_value(leak, factor, translation)
+    elif method == 'bounds':
+        return state_bounds_from_approximate_value(leak)
+    else:
+        raise ValueError(f'Unsupported method "{method}"')
+
+def _scan_gaps(state, segments_bounds, gap_ranges, backwards):
+    # Yield the lists of gaps that place the segments in the values generated from state (or before state if backwards)
+    if not segments_bounds:
+        yield []
+        return
+    segment_bounds = segments_bounds[0]
+    low_gap, high_gap = gap_ranges[0]
+    generator = copy.copy(state)
+    values = (generator.take_previous if backwards else generator.take)(high_gap + len(segment_bounds), 'uint64')
+    first = next(j for j, bounds in enumerate(segment_bounds) if bounds is not None)
+    first_low, first_high = segment_bounds[first]
+    for gap in range(low_gap, high_gap + 1):
+        # Most gaps are rejected by the first known value
+        if not first_low <= values[gap + first] <= first_high:
+            continue
+        if all(bounds is None or bounds[0] <= values[gap + j] <= bounds[1] for j, bounds in enumerate(segment_bounds)):
+            next_state = copy.copy(state)
+            if backwards:
+                next_state.rewind(gap + len(segment_bounds))
+            else:
+                next_state.advance(gap + len(segment_bounds))
+            for gaps in _scan_gaps(next_state, segments_bounds[1:], gap_ranges[1:], backwards):
+                yield [gap] + gaps
+
+def _search_gaps(cracker, depth, end, segments_bounds, gaps, windows, chosen_gaps):
+    # Add the segments after depth (which ends before position end) to the cracker at each possible offset
+    if depth == len(gaps):
+        for state in cracker.states():
+            yield state, chosen_gaps
+        return
+    segment_bounds = segments_bounds[depth + 1]
+    window = windows[depth + 1]
+    low_gap, high_gap = gaps[depth]
+    segment_known = []
+    for j, bounds in enumerate(segment_bounds):
+        if bounds is not None:
+            common_known_bits = common_bits_between(*bounds)
+            segment_known.append((j, list(enumerate(common_known_bits, HALF_STATE_SIZE - len(common_known_bits)))))
+    projections = _KernelProjections(cracker)
+    for gap in range(low_gap, high_gap + 1):
+        position = end + gap
+        # Positions of this segment only increase from now on
+        min_step = RecoveryEngine._low_step(position - position % MATH_RANDOM_CACHE_SIZE + MATH_RANDOM_CACHE_SIZE - 1)
+        window.evict(min_step)
+        projections.evict(min_step)
+        # Most offsets are rejected by the small projected systems, without copying the echelon forms
+        survivors = projections.consistent_hypotheses(position, segment_known, window.state0_rows)
+        if not survivors:
+            continue
+        next_cracker = cracker.copy()
+        next_cracker.bases = {cache_idx: next_cracker.bases[cache_idx] for cache_idx in survivors}
+        next_cracker._state0_rows = window.state0_rows
+        for j, bounds in enumerate(segment_bounds):
+            if bounds is not None:
+                next_cracker.add_state_bounds(position + j, *bounds)
+        if next_cracker.bases:
+            yield from _search_gaps(next_cracker, depth + 1, position + len(segment_bounds), segments_bounds, gaps, windows, chosen_gaps + [gap])
+
+class _KernelProjections():
+    # Equations of the next segment projected on the solutions of the hypotheses of a cracker: with a particular
+    # solution v0 and a kernel basis K_0, ..., K_k-1, a row a with result b becomes the row (a.K_0, ..., a.K_k-1) with
+    # result b ^ a.v0 in the k unknowns of the kernel. An offset is checked with a small system of k unknowns instead
+    # of a copy of the echelon form of each hypothesis, and the projected rows of each step are shared by all the
+    # offsets that place a value there. Hypotheses with the same echelon form (most of them, as they only differ
+    # by the values at positions above their cache_idx) are checked together.
+    def __init__(self, cracker):
+        groups = {}
+        for cache_idx, basis in cracker.bases.items():
+            groups.setdefault(tuple(sorted(basis.pivots.items())), []).append(cache_idx)
+        self._groups = []
+        for members in groups.values():
+            basis = cracker.bases[members[0]]
+            # The particular solution is projected as an extra unknown
+            vectors = basis.kernel() + [basis.solve()]
+            # Projections of the 128 unknowns, combined by bytes so that a row is projected with 16 lookups
+            columns = [sum(((vector >> i) & 1) << k for k, vector in enumerate(vectors)) for i in range(STATE_SIZE)]
+            tables = []
+            for byte in range(STATE_SIZE // 8):
+                table = [0] * 256
+                for value in range(1, 256):
+                    low_bit = (value & -value).bit_length() - 1
+                    table[value] = table[value & (value - 1)] ^ columns[8 * byte + low_bit]
+                tables.append(table)
+            self._groups.append((members, len(vectors) - 1, tables, {}))
+
+    def consistent_hypotheses(self, position, segment_known, state0_rows):
+        # Return the hypotheses that are consistent with the known bits of a segment at the given position,
+        # where segment_known is a list of (j, [(i, bit), ...]) known bits of the j-th value of the segment
+        placed = [(RecoveryEngine._low_step(position + j), (position + j) % MATH_RANDOM_CACHE_SIZE, known) for j, known in segment_known]
+        survivors = []
+        for members, size, tables, projected_rows in self._groups:
+            # Hypotheses of a group only differ by the values of the segment that use their high step
+            classes = {}
+            for cache_idx in members:
+                classes.setdefault(tuple(v > cache_idx for _, v, _ in placed), []).append(cache_idx)
+            for high, cache_idxs in classes.items():
+                steps = [(low_step + 2 * MATH_RANDOM_CACHE_SIZE if is_high else low_step, known) for (low_step, _, known), is_high in zip(placed, high)]
+                if self._consistent(size, tables, projected_rows, steps, state0_rows):
+                    survivors.extend(cache_idxs)
+        return survivors
+
+    @staticmethod
+    def _consistent(size, tables, projected_rows, steps, state0_rows):
+        coeff_mask = (1 << size) - 1
+        # Echelon form of the small system (see gf2.EchelonBasis), inlined as this is the hot loop of the search
+        pivots = {}
+        for step, known in steps:
+            rows = projected_rows.get(step)
+            if rows is None:
+                rows = projected_rows[step] = {}
+            for i, bit in known:
+                row = rows.get(i)
+                if row is None:
+                    dependencies = state0_rows(step)[i]
+                    row = 0
+                    for table in tables:
+                        row ^= table[dependencies & 0xff]
+                        dependencies >>= 8
+                    rows[i] = row
+                row ^= bit << size
+                while True:
+                    coeffs = row & coeff_mask
+                    if not coeffs:
+                        if row:
+                            return False
+                        break
+                    pivot = coeffs.bit_length() - 1
+                    pivot_row = pivots.get(pivot)
+                    if pivot_row is None:
+                        pivots[pivot] = row
+                        break
+                    row ^= pivot_row
+        return True
+
+    def evict(self, min_step):
+        for _, _, _, projected_rows in self._groups:
+            for step in [step for step in projected_rows if step < min_step]:
+                del projected_rows[step]
+
+class _StateRowsWindow():
+    # Dependency rows of successive xs128 states generated on demand, for steps that are never below a minimum
+    # step that only increases
+    def __init__(self):
+        self._rows = {}
+        self._steps = None
+        self._next_step = None
+        self._min_step = 0
+
+    def state0_rows(self, step):
+        rows = self._rows.get(step)
+        if rows is not None:
+            return rows
+        if self._steps is None or step < self._next_step or self._next_step < self._min_step:
+            # All the steps from the minimum step are kept so that the iterator does not go back for them
+            start = step if step < self._min_step else self._min_step
+            self._steps = get_tables().iter_state0_rows(itertools.count(start))
+        for current_step, rows in self._steps:
+            self._next_step = current_step + 1
+            if current_step >= self._min_step:
+                self._rows[current_step] = rows
+            if current_step == step:
+                return rows
+
+    def evict(self, min_step):
+        self._min_step = max(self._min_step, min_step)
+        for step in [step for step in self._rows if step < self._min_step]:
+            del self._rows[step]
+
 def common_bits_between(low, high):
     """
     Returns the list of most significant bits that are the same for all value between low and high.
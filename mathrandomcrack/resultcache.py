@@ -0,0 +1,135 @@
+from .mathrandom import *
+from .stats import RecoveryStats
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_VERSION = 1
+# Number of leak sets kept by default in a ResultCache before the least recently used ones are evicted
+RESULT_CACHE_MAX_ENTRIES = 4096
+
+def leak_set_fingerprint(method, leaks, positions=None, factor=1, translation=0):
+    """
+    Return a canonical fingerprint of a leak set as a hexadecimal string.
+
+    Two leak sets have the same fingerprint if they have the same method, factor and translation and the same
+    leaked values at the same positions, whatever the order in which the values are given.
+
+    Arguments:
+        method: the kind of leaked values ("doubles", "scaled" or "bounds").
+
+        leaks, positions: the leaked values and their positions (successive positions if not specified).
+
+        (optional) factor, translation: the integers used by the "scaled" method.
+    """
+    if positions is None or not len(positions):
+        positions = range(len(leaks))
+    if method == 'doubles':
+        canonical = [float(d).hex() for d in leaks]
+    elif method == 'scaled':
+        canonical = [int(v) for v in leaks]
+    elif method == 'bounds':
+        canonical = [[float(low).hex(), float(high).hex()] for low, high in leaks]
+    else:
+        raise ValueError(f'Unsupported method "{method}"')
+    leak_set = [RESULT_CACHE_VERSION, method, factor, translation, sorted(zip((int(p) for p in positions), canonical))]
+    return hashlib.sha256(json.dumps(leak_set, separators=(',', ':')).encode()).hexdigest()
+
+def default_result_cache_path():
+    """
+    Return the path of the shared result cache.
+    Can be overridden with the MATHRANDOMCRACK_RESULT_CACHE environment variable.
+    """
+    path = os.environ.get('MATHRANDOMCRACK_RESULT_CACHE')
+    if path:
+        return path
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'mathrandomcrack', f'results-v{RESULT_CACHE_VERSION}.sqlite')
+
+class ResultCache():
+    """
+    An on-disk SQLite cache of the xs128 seeds and cache indices recovered from leak sets, keyed by their fingerprint.
+
+    A cached leak set only costs the creation of its MathRandom objects. When there are more than max_entries leak sets,
+    the least recently used ones are evicted.
+
+    Attributes:
+        path: the SQLite database file.
+
+        max_entries: the maximum number of cached leak sets.
+    """
+    def __init__(self, path=None, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.path = path or default_result_cache_path()
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS results (fingerprint TEXT PRIMARY KEY, seeds TEXT NOT NULL, last_used REAL NOT NULL)')
+
+    def _connect(self):
+        # A connection per operation, so that a ResultCache can be shared between threads
+        import sqlite3
+        return sqlite3.connect(self.path, timeout=30)
+
+    def __len__(self):
+        with self._connect() as connection:
+            return connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def get(self, fingerprint):
+        """
+        Return the list of (prev_state0, prev_state1, cache_idx) seeds of a leak set, or None if it is not cached.
+        """
+        with self._connect() as connection:
+            row = connection.execute('SELECT seeds FROM results WHERE fingerprint = ?', (fingerprint,)).fetchone()
+            if row is None:
+                return None
+            connection.execute('UPDATE results SET last_used = ? WHERE fingerprint = ?', (time.time(), fingerprint))
+        return [tuple(seed) for seed in json.loads(row[0])]
+
+    def put(self, fingerprint, seeds):
+        """
+        Store the list of (prev_state0, prev_state1, cache_idx) seeds of a leak set and evict the least recently used leak sets.
+        """
+        with self._connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?)', (fingerprint, json.dumps(seeds), time.time()))
+            connection.execute('DELETE FROM results WHERE fingerprint IN '
+                    '(SELECT fingerprint FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def clear(self):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM results')
+
+    def cached(self, fingerprint, recover, stats=None):
+        """
+        Yield the MathRandom states of a leak set from the cache, or from a recovery that is cached once it is done.
+
+        Arguments:
+            fingerprint: the fingerprint of the leak set (see leak_set_fingerprint).
+
+            recover: a function that returns the generator of the states of the leak set.
+
+            (optional) stats: a stats.RecoveryStats object where the cache hit or miss is counted.
+        """
+        stats = stats or RecoveryStats()
+        seeds = self.get(fingerprint)
+        stats.emit('cache', {'fingerprint': fingerprint, 'hit': seeds is not None})
+        if seeds is not None:
+            stats.count('cache_hits')
+            for prev_state0, prev_state1, cache_idx in seeds:
+                stats.count('states')
+                yield MathRandom.from_previous_state(prev_state0, prev_state1, cache_idx)
+            stats.done()
+            return
+        stats.count('cache_misses')
+        seeds = []
+        for math_random in recover():
+            # The seed is saved before the state can be changed by the caller
+            _, (prev_state0, prev_state1) = reverse_xs128_states(math_random.state0, math_random.state1, MATH_RANDOM_CACHE_SIZE)
+            seeds.append((prev_state0, prev_state1, math_random.cache_idx))
+            yield math_random
+        # Only complete recoveries are cached
+        self.put(fingerprint, seeds)
@@ -0,0 +1,234 @@
+from .batch import BatchCracker, predict
+from .resultcache import ResultCache
+from .stats import RecoveryStats
+from .xs128crack import DEFAULT_SOLVER_BACKEND, SOLVER_BACKENDS
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Number of requests handled at the same time by default, other requests wait for a free slot
+DEFAULT_MAX_JOBS = 4
+# Maximum size of a request line, leak sets can be large
+MAX_REQUEST_SIZE = 64 * 1024 * 1024
+# Errors of invalid requests, other errors are logged with their traceback. All of them are reported to the client
+REQUEST_ERRORS = (AssertionError, KeyError, TypeError, ValueError)
+
+class CrackServer():
+    """
+    A local service that cracks leak sets and predicts values for its clients, with warm worker processes.
+
+    Clients send one JSON request per line and receive JSON events, one per line, tagged with the "id" of the request:
+        - {"type": "crack", ...leak set...} (see batch.load_leak_sets for the keys of a leak set) streams one
+          {"event": "state", "state": {...}} event per possible state as soon as it is found (see batch.BatchCracker.crack),
+          then a {"event": "done", "states": n} event with the stats of the recovery if "stats" is true.
+        - {"type": "predict", "state0": ..., "state1": ..., "cache_idx": ..., ...} returns a {"event": "prediction", ...}
+          event (see batch.predict).
+        - invalid requests return a {"event": "error", "error": "..."} event.
+    Requests of a connection are handled concurrently, so events of different requests can be interleaved.
+
+    Backpressure: the next state of a recovery is only searched once the previous one has been sent, and a connection
+    is not read anymore while max_jobs requests are being handled.
+
+    Attributes:
+        cracker: the batch.BatchCracker that holds the tables and the worker processes.
+
+        max_jobs: the maximum number of requests handled at the same time.
+    """
+    def __init__(self, backend=None, workers=None, max_jobs=DEFAULT_MAX_JOBS, result_cache=None):
+        self.cracker = BatchCracker(backend, workers, result_cache=result_cache)
+        self.max_jobs = max_jobs
+        self._slots = asyncio.Semaphore(max_jobs)
+        # Recovery generators are driven from threads so that the event loop never blocks
+        self._threads = ThreadPoolExecutor(max_workers=max_jobs)
+
+    def close(self):
+        self._threads.shutdown(cancel_futures=True)
+        self.cracker.close()
+
+    async def warm_up(self):
+        await asyncio.get_running_loop().run_in_executor(self._threads, self.cracker.warm_up)
+
+    async def handle_connection(self, reader, writer):
+        lock = asyncio.Lock()
+        async def send(event):
+            async with lock:
+                writer.write(json.dumps(event).encode() + b'\n')
+                await writer.drain()
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                # Stop reading requests while all the slots are busy
+                await self._slots.acquire()
+                task = asyncio.create_task(self._handle_line(line, send))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                # Also called when the task is cancelled before it starts
+                task.add_done_callback(lambda _: self._slots.release())
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except (ConnectionError, ValueError) as e:
+            logger.debug(f'Connection closed: {e!r}')
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def _handle_line(self, line, send):
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('A request should be a JSON object')
+            request_id = request.get('id')
+            request_type = request.get('type', 'crack')
+            if request_type == 'crack':
+                await self._crack(request, send)
+            elif request_type == 'predict':
+                prediction = await asyncio.get_running_loop().run_in_executor(self._threads, predict, request)
+                await send(dict(prediction, id=request_id, event='prediction'))
+            else:
+                raise ValueError(f'Unsupported request type "{request_type}"')
+        except ConnectionError as e:
+            logger.debug(f'Could not answer request {request_id}: {e!r}')
+        except Exception as e:
+            if isinstance(e, REQUEST_ERRORS):
+                logger.debug(f'Invalid request {request_id}: {e!r}')
+            else:
+                logger.exception(f'Request {request_id} failed')
+            try:
+                await send({'id': request_id, 'event': 'error', 'error': str(e) or type(e).__name__})
+            except ConnectionError:
+                pass
+
+    async def _crack(self, request, send):
+        loop = asyncio.get_running_loop()
+        stats = RecoveryStats()
+        states = self.cracker.iter_states(request, stats)
+        results = asyncio.Queue()
+        stop = threading.Event()
+        sent = threading.Semaphore(0)
+        worker = loop.run_in_executor(self._threads, _drive_states, states, loop, results, stop, sent)
+        count = 0
+        try:
+            while True:
+                kind, value = await results.get()
+                if kind == 'error':
+                    raise value
+                if kind == 'done':
+                    break
+                count += 1
+                # Waits for the client to read the state before searching the next one
+                await send({'id': request.get('id'), 'event': 'state', 'state': value})
+                sent.release()
+        finally:
+            # The worker thread closes the generator once its current search is over
+            stop.set()
+            sent.release()
+        await worker
+        done = {'id': request.get('id'), 'event': 'done', 'states': count}
+        if request.get('stats'):
+            done['stats'] = stats.to_dict()
+        await send(done)
+
+def _drive_states(states, loop, results, stop, sent):
+    # Run a state generator in a worker thread, which is the only one that touches it, and put
+    # ("state", state), ("error", exception) and ("done", None) items in an asyncio.Queue of the event loop
+    try:
+        for state in states:
+            if stop.is_set():
+                return
+            loop.call_soon_threadsafe(results.put_nowait, ('state', state))
+            # Wait until the state is sent or the request is over
+            sent.acquire()
+            if stop.is_set():
+                return
+    except Exception as e:
+        loop.call_soon_threadsafe(results.put_nowait, ('error', e))
+        return
+    finally:
+        states.close()
+    loop.call_soon_threadsafe(results.put_nowait, ('done', None))
+
+async def serve(socket_path=None, host='127.0.0.1', port=None, backend=None, workers=None, max_jobs=DEFAULT_MAX_JOBS, result_cache=None, started=None):
+    """
+    Run a CrackServer on a Unix socket or on a TCP port until it is cancelled.
+
+    Arguments:
+        (optional) socket_path: the path of the Unix socket.
+
+        (optional) host, port: the TCP address, if socket_path is not specified.
+
+        (optional) backend, workers, max_jobs, result_cache: the options of the CrackServer.
+
+        (optional) started: an asyncio.Event that is set once the server accepts connections.
+    """
+    server = CrackServer(backend, workers, max_jobs, result_cache)
+    try:
+        await server.warm_up()
+        if socket_path is not None:
+            listener = await asyncio.start_unix_server(server.handle_connection, socket_path, limit=MAX_REQUEST_SIZE)
+            logger.info(f'Listening on {socket_path}')
+        else:
+            listener = await asyncio.start_server(server.handle_connection, host, port, limit=MAX_REQUEST_SIZE)
+            logger.info(f'Listening on {host}:{port}')
+        async with listener:
+            if started is not None:
+                started.set()
+            await listener.serve_forever()
+    finally:
+        server.close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+            prog = 'python3 -m mathrandomcrack serve',
+            description = 'Run a local service that cracks Math.random() leak sets sent as JSON lines',
+            formatter_class=argparse.RawTextHelpFormatter)
+    address = parser.add_mutually_exclusive_group(required=True)
+    address.add_argument('--socket',
+            help='the path of the Unix socket to listen on')
+    address.add_argument('--port', type=int,
+            help='the TCP port to listen on')
+    parser.add_argument('--host', default='127.0.0.1',
+            help='the TCP address to listen on with --port (default: 127.0.0.1)')
+    parser.add_argument('--solver', default=DEFAULT_SOLVER_BACKEND, choices=list(SOLVER_BACKENDS),
+            help='the backend used to solve linear systems in GF(2)')
+    parser.add_argument('--jobs', default=os.cpu_count() or 1, type=int,
+            help='the number of warm worker processes shared by all the requests (default: the number of CPUs)')
+    parser.add_argument('--max-jobs', default=DEFAULT_MAX_JOBS, type=int,
+            help=f'the number of requests handled at the same time (default: {DEFAULT_MAX_JOBS})')
+    parser.add_argument('--cache', action='store_true',
+            help='look up and store the recovered states in the default SQLite result cache')
+    parser.add_argument('--cache-file',
+            help='the SQLite file of the result cache, implies --cache')
+    parser.add_argument('--debug', action='store_true',
+            help='raise log level')
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        raise ValueError(f'--jobs should be at least 1')
+    if args.max_jobs < 1:
+        raise ValueError(f'--max-jobs should be at least 1')
+    return args
+
+def main(argv):
+    args = parse_args(argv)
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG if args.debug else logging.INFO)
+    result_cache = ResultCache(args.cache_file) if args.cache or args.cache_file else None
+    try:
+        asyncio.run(serve(args.socket, args.host, args.port, args.solver, args.jobs, args.max_jobs, result_cache))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,81 @@
+import time
+from contextlib import contextmanager
+
+class RecoveryStats():
+    """
+    A class that collects timers and counters during a state recovery.
+
+    Pass a RecoveryStats object to a recovery function with stats=... and read it during or after the recovery.
+
+    Attributes:
+        timers: a dict that maps the name of each phase to the total time spent in it, in seconds.
+
+        counters: a dict that maps the name of each counter to its value.
+
+        hypotheses: a dict that maps each cache_idx hypothesis to a dict of information about it
+            (number of equations, rank, kernel dimension, number of states yielded, or the reason why it was rejected).
+
+        callback: an optional function called with (event, data) for every "hypothesis" and "state" event,
+            and with ("done", to_dict()) at the end of the recovery.
+    """
+    def __init__(self, callback=None):
+        self.timers = {}
+        self.counters = {}
+        self.hypotheses = {}
+        self.callback = callback
+
+    def add_time(self, phase, seconds):
+        self.timers[phase] = self.timers.get(phase, 0.0) + seconds
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def timer(self, phase):
+        """
+        Context manager that adds the time spent in its block to a phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def timed(self, phase, iterable):
+        """
+        Yield the items of an iterable, adding the time spent to produce them to a phase.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.add_time(phase, time.perf_counter() - start)
+            yield item
+
+    def hypothesis(self, cache_idx, **info):
+        """
+        Record information about a cache_idx hypothesis.
+        """
+        self.hypotheses.setdefault(cache_idx, {}).update(info)
+        self.emit('hypothesis', dict(self.hypotheses[cache_idx], cache_idx=cache_idx))
+
+    def emit(self, event, data):
+        if self.callback is not None:
+            self.callback(event, data)
+
+    def done(self):
+        self.emit('done', self.to_dict())
+
+    def to_dict(self):
+        """
+        Return the collected stats as a JSON-serializable dict.
+        """
+        return {
+            'timers': dict(self.timers),
+            'counters': dict(self.counters),
+            'hypotheses': {str(cache_idx): dict(info) for cache_idx, info in sorted(self.hypotheses.items())},
+        }
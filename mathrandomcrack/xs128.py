@@ -1,3 +1,6 @@
+import sys
+from array import array
+
 STATE_SIZE = 128
 HALF_STATE_SIZE = STATE_SIZE // 2
 
@@ -19,6 +22,59 @@ def xs128(state0, state1):
     s1 ^= (s0 >> 26) & mask
     return s0, s1
 
+def xs128_states(state0, state1, n):
+    """
+    Execute XorShift128 n times in a row.
+    Equivalent to calling xs128 n times on 64-bit integers, without the function call overhead.
+
+    Return the list of the n successive state0 values and the final 128-bit state as a (state0, state1) tuple.
+    """
+    mask = (1 << HALF_STATE_SIZE) - 1
+    s0, s1 = state0 & mask, state1 & mask
+    states = []
+    append = states.append
+    for _ in range(n):
+        s0, s1 = s1, s0
+        s1 ^= (s1 << 23) & mask
+        s1 ^= s1 >> 17
+        s1 ^= s0 ^ (s0 >> 26)
+        append(s0)
+    return states, (s0, s1)
+
+def xs128_parallel_states(states, n):
+    """
+    Execute XorShift128 n times in a row on several independent 128-bit states at once.
+    The states are packed side by side in big integers so that each operation of xs128 runs on all the states at once.
+
+    Arguments:
+        states: a list of (state0, state1) tuples of 64-bit integers.
+
+        n: the number of calls to xs128 for each state.
+
+    Return an array of type 'Q' where the value at index t * len(states) + i is the state0 of the i-th state after
+    t + 1 calls to xs128, and the list of final 128-bit states as (state0, state1) tuples.
+    """
+    lanes = len(states)
+    size = lanes * HALF_STATE_SIZE // 8
+    lane_mask = (1 << HALF_STATE_SIZE) - 1
+    # Per-lane masks that drop the bits shifted in from neighbour lanes
+    repeat = lambda mask: int.from_bytes(array('Q', [mask] * lanes).tobytes(), sys.byteorder)
+    lshift23_mask = repeat((lane_mask << 23) & lane_mask)
+    rshift17_mask = repeat(lane_mask >> 17)
+    rshift26_mask = repeat(lane_mask >> 26)
+    pack = lambda values: int.from_bytes(array('Q', [v & lane_mask for v in values]).tobytes(), sys.byteorder)
+    s0, s1 = pack([s[0] for s in states]), pack([s[1] for s in states])
+    out = bytearray()
+    for _ in range(n):
+        s0, s1 = s1, s0
+        s1 ^= (s1 << 23) & lshift23_mask
+        s1 ^= (s1 >> 17) & rshift17_mask
+        s1 ^= s0 ^ ((s0 >> 26) & rshift26_mask)
+        out += s0.to_bytes(size, sys.byteorder)
+    unpack = lambda packed: array('Q', packed.to_bytes(size, sys.byteorder))
+    final_states = list(zip(unpack(s0), unpack(s1)))
+    return array('Q', out), final_states
+
 def reverse_xs128(state0, state1):
     """
     Reverse the execution of XorShift128 and return the previous 128-bit state.
@@ -35,15 +91,39 @@ def reverse_xs128(state0, state1):
     s0 = reverse_xor_lshift(s0, 23)
     return s0, s1
 
+def reverse_xs128_states(state0, state1, n):
+    """
+    Reverse the execution of XorShift128 n times in a row.
+    Equivalent to calling reverse_xs128 n times on 64-bit integers, without the function call overhead.
+
+    Return the list of the n successive state0 values and the final 128-bit state as a (state0, state1) tuple.
+    """
+    mask = (1 << HALF_STATE_SIZE) - 1
+    s0, s1 = state0 & mask, state1 & mask
+    states = []
+    append = states.append
+    for _ in range(n):
+        s0, s1 = s1 ^ s0 ^ (s0 >> 26), s0
+        # Inverse of s0 ^= s0 >> 17
+        s0 ^= s0 >> 17
+        s0 ^= s0 >> 34
+        # Inverse of s0 ^= s0 << 23
+        s0 ^= (s0 << 23) & mask
+        s0 ^= (s0 << 46) & mask
+        append(s0)
+    return states, (s0, s1)
+
 # Helper functions to reverse operations used in XorShift128
+# x ^= x << shift is undone by applying x ^= x << k for k = shift, 2*shift, 4*shift... while k < 64
 # https://stackoverflow.com/questions/31513168/finding-inverse-operation-to-george-marsaglias-xorshift-rng/31515396#31515396
 def reverse_xor_lshift(y, shift):
-    x = y & ((1 << shift) - 1)
-    for i in range(HALF_STATE_SIZE - shift):
-        x |= (1 if bool(x & (1 << i)) ^ bool(y & (1 << (shift + i))) else 0) << (shift + i)
-    return x
-def reverse_bin(x):
-    return int(bin(x)[2:].rjust(HALF_STATE_SIZE, '0')[::-1], 2)
+    mask = (1 << HALF_STATE_SIZE) - 1
+    while shift < HALF_STATE_SIZE:
+        y ^= (y << shift) & mask
+        shift <<= 1
+    return y
 def reverse_xor_rshift(y, shift):
-    return reverse_bin(reverse_xor_lshift(reverse_bin(y), shift))
-
+    while shift < HALF_STATE_SIZE:
+        y ^= y >> shift
+        shift <<= 1
+    return y
@@ -1,13 +1,17 @@
 from .xs128 import *
+from .xs128tables import get_tables, jump_xs128
+from .gf2 import EchelonBasis, SolutionSpace, solve_packed
+from .stats import RecoveryStats
 
 import logging
-from sage.all import Matrix, GF
 
 logger = logging.getLogger(__name__)
 
-# Should be a lot more than enough to get only one solution to any system (i think...)
-# Avoids the solver DOSing itself with too many equations
-MAX_EQUATIONS = 10000
+# Number of redundant equations kept by select_equations once the system has full rank, to check the solution
+EQUATION_RESERVE = 32
+
+# Backend used by solve_linear_system when none is specified
+DEFAULT_SOLVER_BACKEND = 'native'
 
 class StateBitDeps():
     """
@@ -18,6 +22,8 @@ class StateBitDeps():
         data: A 64-long list of 128 bit integers that represents dependency to the initial 128-bit state.
             data[i] represents a bitmask of all the bits from the initial state to sum together to obtain the i-th bit of the current state.
     """
+    __slots__ = ('data',)
+
     def __init__(self, data):
         assert len(data) == HALF_STATE_SIZE
         self.data = data
@@ -28,7 +34,7 @@ class StateBitDeps():
         return StateBitDeps(self.data)
 
     def __xor__(self, other):
-        return StateBitDeps([self.data[i] ^ other.data[i] for i in range(HALF_STATE_SIZE)])
+        return StateBitDeps([a ^ b for a, b in zip(self.data, other.data)])
 
     def __lshift__(self, shift):
         # Shifting left makes the less significant bits zero
@@ -38,57 +44,205 @@ class StateBitDeps():
         # Shifting right makes the most significant bits zero
         return StateBitDeps(self.data[shift:] + [0 for _ in range(shift)])
 
+    def equation(self, index, bit):
+        """
+        Return the StateEquation that states that the index-th bit of the current state is equal to bit.
+        """
+        return StateEquation(self.data[index], bit)
+
     def to_coeff(self, index):
         """
         Convert the bitmask of the index-th bit to a list of coefficients in GF(2).
+        Only needed by solvers that work on dense matrices.
         """
-        return [int((self.data[index] >> i) & 1) for i in range(STATE_SIZE)]
+        return [(self.data[index] >> i) & 1 for i in range(STATE_SIZE)]
 
 class StateEquation():
     """
     A class that represents a linear equation with 128 unknowns with values in GF(2).
     
     Attributes:
-        coefficients: 128 coefficients in GF(2).
+        mask: a 128-bit integer where bit i is the coefficient of the i-th unknown.
 
         result: the result of the equation in GF(2).
     """
-    def __init__(self, coefficients, result):
-        assert len(coefficients) == STATE_SIZE
-        assert all(c in [0, 1] for c in coefficients)
+    __slots__ = ('mask', 'result')
+
+    def __init__(self, mask, result):
+        assert 0 <= mask < (1 << STATE_SIZE)
         assert result in [0, 1]
-        self.coefficients = coefficients
+        self.mask = mask
         self.result = result
 
-def solve_linear_system(equations):
+    @classmethod
+    def from_row(cls, row):
+        """
+        Create an equation from a packed row where bit 128 is the result (see gf2.EchelonBasis).
+        """
+        return cls(row & ((1 << STATE_SIZE) - 1), row >> STATE_SIZE)
+
+    @property
+    def row(self):
+        """
+        The equation as a packed row where bit 128 is the result (see gf2.EchelonBasis).
+        """
+        return self.mask | (self.result << STATE_SIZE)
+
+    @property
+    def coefficients(self):
+        """
+        The 128 coefficients of the equation in GF(2) as a list.
+        Only needed by solvers that work on dense matrices.
+        """
+        return [(self.mask >> i) & 1 for i in range(STATE_SIZE)]
+
+def solve_linear_system_native(equations, stats=None):
+    """
+    Solve a list of equations in GF(2) with XOR-row elimination on bit-packed rows.
+    Return a particular solution and a basis of the kernel as 128-bit integers.
+    Raise ValueError if the system has no solution.
+    """
+    stats = stats or RecoveryStats()
+    with stats.timer('matrix'):
+        rows = [eq.row for eq in equations]
+    with stats.timer('solve'):
+        return solve_packed(rows, STATE_SIZE)
+
+def solve_linear_system_sage(equations, stats=None):
+    """
+    Solve a list of equations in GF(2) with Sage.
+    Return a particular solution and a basis of the kernel as 128-bit integers.
+    Raise ValueError if the system has no solution.
+    """
+    from sage.all import Matrix, GF
+    stats = stats or RecoveryStats()
+    with stats.timer('matrix'):
+        M = []
+        b = []
+        # Create dense linear system from the packed equations
+        for eq in equations:
+            M.append(eq.coefficients)
+            b.append(eq.result)
+        M = Matrix(GF(2), M)
+        b = Matrix(GF(2), b).transpose()
+    # Find a solution
+    with stats.timer('solve'):
+        v0 = M.solve_right(b).transpose()[0]
+    with stats.timer('kernel'):
+        K = M.right_kernel()
+        to_int = lambda v: sum(int(c) << i for i, c in enumerate(v))
+        return to_int(v0), [to_int(v) for v in K.basis()]
+
+SOLVER_BACKENDS = {
+    'native': solve_linear_system_native,
+    'sage': solve_linear_system_sage,
+}
+
+def solution_space(equations, backend=None, stats=None):
+    """
+    Solve a list of equations in GF(2).
+    Return a gf2.SolutionSpace that counts, enumerates, samples or slices the solutions without building them all.
+    Raise ValueError if the system has no solution.
+
+    Arguments:
+        equations: a list of StateEquation that represents the linear system.
+
+        (optional) backend: the name of the solver backend in SOLVER_BACKENDS.
+            If not specified, DEFAULT_SOLVER_BACKEND is used.
+
+        (optional) stats: a RecoveryStats object that collects timers and counters.
+    """
+    stats = stats or RecoveryStats()
+    solver = SOLVER_BACKENDS[backend or DEFAULT_SOLVER_BACKEND]
+    v0, kernel = solver(equations, stats)
+    stats.count('kernel_dimension', len(kernel))
+    return SolutionSpace(v0, kernel)
+
+def solve_linear_system(equations, backend=None, stats=None):
     """
     Solve a list of equations in GF(2). Yield all the solutions.
 
     Attributes:
         equations: a list of StateEquation that represents the linear system.
+
+        (optional) backend, stats: see solution_space.
     """
-    M = []
-    b = []
-    # Create linear system
-    for eq in equations:
-        row = [coeff for coeff in eq.coefficients]
-        M.append(row)
-        b.append(eq.result)
-    M = Matrix(GF(2), M)
-    b = Matrix(GF(2), b).transpose()
-    # Find a solution
-    v0 = M.solve_right(b).transpose()[0]
-    # Iterate over all solutions
-    K = M.right_kernel()
-    total_solutions = len(K)
-    if total_solutions > 100:
-        logger.warning(f'Found {len(K)} valid xs128 seed(s)')
+    stats = stats or RecoveryStats()
+    solutions = solution_space(equations, backend, stats)
+    for solution in stats.timed('enumerate', iter_solutions(solutions.v0, solutions.kernel)):
+        stats.count('solutions')
+        yield solution
+
+def iter_solutions(v0, kernel):
+    """
+    Yield all the solutions of a linear system in GF(2) from a particular solution and a basis of the kernel,
+    in Gray code order (see gf2.SolutionSpace).
+    """
+    solutions = SolutionSpace(v0, kernel)
+    if solutions.count > 100:
+        logger.warning(f'Found {solutions.count} valid xs128 seed(s)')
     else:
-        logger.debug(f'Found {len(K)} valid xs128 seed(s)')
-    for v in K:
-        yield sum(int(c) << i for i, c in enumerate(v0 + v))
+        logger.debug(f'Found {solutions.count} valid xs128 seed(s)')
+    yield from solutions
 
-def recover_seed_from_known_bits(known_states_bits):
+def select_equations(equations, reserve=EQUATION_RESERVE):
+    """
+    Select the equations of a linear system that are worth passing to a solver.
+
+    Equations are kept while they increase the rank of the system. Redundant equations are checked against the
+    selected ones and dropped. Once the system has full rank, only the reserve next equations are kept and the
+    remaining equations are not even consumed from the iterable: the solution is unique and the caller can check
+    the remaining known bits against it much more cheaply than by solving them.
+
+    Arguments:
+        equations: an iterable of StateEquation.
+
+        (optional) reserve: the number of equations kept after the system has full rank.
+
+    Return a (selected, rank, exhausted) tuple where selected is a list of StateEquation, rank is the rank of the
+    system and exhausted is False if equations may be left in the iterable, which only happens with full rank.
+    Raise ValueError if the consumed equations have no solution.
+    """
+    basis = EchelonBasis()
+    selected = []
+    for eq in equations:
+        if basis.rank == STATE_SIZE:
+            reserve -= 1
+            basis.add(eq.row)
+            selected.append(eq)
+        elif basis.add(eq.row):
+            selected.append(eq)
+        # Stop before consuming an equation that would not be selected
+        if basis.rank == STATE_SIZE and reserve <= 0:
+            return selected, basis.rank, False
+    return selected, basis.rank, True
+
+def matches_known_bits(seed0, seed1, known_bits):
+    """
+    Check a candidate initial xs128 state against known bits of xs128 state0s
+    (see recover_seed_from_sparse_known_bits) by jumping from one known state to the next.
+    """
+    state0, state1 = seed0, seed1
+    calls = 0
+    for step in sorted(known_bits):
+        state0, state1 = jump_xs128(state0, state1, step + 1 - calls)
+        calls = step + 1
+        for i, bit in enumerate(known_bits[step]):
+            if bit is not None and (state0 >> i) & 1 != bit:
+                return False
+    return True
+
+def log_equations_count(total_equations):
+    """
+    Log the number of equations in a linear system and warn if it is too small.
+    """
+    logger.debug(f'Total number of equations in linear system: {total_equations}')
+    if total_equations < 110:
+        logger.error(f'Number of equations is too small and will generate too many possible seeds')
+    elif total_equations < 140:
+        logger.warning(f'Number of equations is small and will generate a lot of possible seeds')
+
+def recover_seed_from_known_bits(known_states_bits, backend=None, stats=None):
     """
     Recover all the possible initial xs128 128-bit states from a list of known bits of successive xs128 state0s.
     The position of known bits can vary between states.
@@ -98,40 +252,59 @@ def recover_seed_from_known_bits(known_states_bits):
         known_states_bits: a list of 64-bit vectors where known_states_bits[i][j] is:
             - 0 or 1 if the j-th bit of the i-th state0 of xs128 is known.
             - None if the j-th bit of the i-th state0 of xs128 is unknown.
+
+        (optional) backend: the name of the solver backend to use (see solve_linear_system).
+
+        (optional) stats: a RecoveryStats object that collects timers and counters.
     
     Return a generator that yields all possible initial 128-bit states of xs128 as a (state0, state1) tuple.
     """
     assert all(len(state) == 64 for state in known_states_bits)
-    # Initial state before the xs128 call
-    # Initial s0 is the low 64 bits of the initial state
-    # Initial s1 is the high 64 bits of the initial state
-    s0 = StateBitDeps([1 << i for i in range(HALF_STATE_SIZE)])
-    s1 = StateBitDeps([1 << i for i in range(HALF_STATE_SIZE, STATE_SIZE)])
-    equations = []
-    # Generate bit dependencies between all states
-    total_equations = 0
-    for state_bits in known_states_bits:
-        s0, s1 = xs128(s0, s1)
-        # For each known bit, we generate a new equation
-        for i, bit in enumerate(state_bits):
-            if bit is not None:
-                total_equations += 1
-                coefficients = s0.to_coeff(i)
-                equations.append(StateEquation(coefficients, bit))
-        if total_equations > MAX_EQUATIONS:
-            total_equations = MAX_EQUATIONS
-            equations = equations[:MAX_EQUATIONS]
-            logger.debug(f'Total number of equations in linear system reduced to {MAX_EQUATIONS}')
-            break
-    logger.debug(f'Total number of equations in linear system: {total_equations}')
-    if total_equations < 110:
-        logger.error(f'Number of equations is too small and will generate too many possible seeds')
-    elif total_equations < 140:
-        logger.warning(f'Number of equations is small and will generate a lot of possible seeds')
+    known_bits = {step: state_bits for step, state_bits in enumerate(known_states_bits) if any(bit is not None for bit in state_bits)}
+    return recover_seed_from_sparse_known_bits(known_bits, backend, stats)
+
+def recover_seed_from_sparse_known_bits(known_bits, backend=None, stats=None):
+    """
+    Recover all the possible initial xs128 128-bit states from known bits of some xs128 state0s.
+    Only the states with known bits are handled and the gaps between them are jumped over, so that the cost
+    depends on the number of known states and not on how far they are from the initial state.
+
+    Arguments:
+        known_bits: a dict that maps a step to a 64-bit vector where known_bits[step][j] is:
+            - 0 or 1 if the j-th bit of state0 after step+1 calls to xs128 is known.
+            - None if it is unknown.
+
+        (optional) backend: the name of the solver backend to use (see solve_linear_system).
+
+        (optional) stats: a RecoveryStats object that collects timers and counters.
+
+    Return a generator that yields all possible initial 128-bit states of xs128 as a (state0, state1) tuple.
+    """
+    assert all(step >= 0 and len(state_bits) == 64 for step, state_bits in known_bits.items())
+    stats = stats or RecoveryStats()
+    # Bit dependencies of the states are read from the precomputed tables
+    tables = get_tables()
+    known_steps = sorted(known_bits)
+    total_equations = sum(bit is not None for state_bits in known_bits.values() for bit in state_bits)
+    log_equations_count(total_equations)
+    # For each known bit, we generate a new equation, only as long as they are needed
+    all_equations = (StateBitDeps(rows).equation(i, bit)
+            for step, rows in tables.iter_state0_rows(known_steps)
+            for i, bit in enumerate(known_bits[step]) if bit is not None)
+    with stats.timer('equations'):
+        equations, rank, exhausted = select_equations(all_equations)
+    logger.debug(f'Selected {len(equations)} equation(s) of rank {rank} out of {total_equations}')
+    stats.count('equations', len(equations))
     # Solve the linear system of equations to find all possible seeds
-    seeds = solve_linear_system(equations)
+    seeds = solve_linear_system(equations, backend, stats)
     for seed in seeds:
         seed0 = seed & ((1 << HALF_STATE_SIZE) - 1)
         seed1 = seed >> HALF_STATE_SIZE
+        if not exhausted:
+            # The solution is unique, check the known bits of the equations that were not consumed
+            with stats.timer('verify'):
+                if not matches_known_bits(seed0, seed1, known_bits):
+                    logger.debug('Found seed does not match the remaining known bits')
+                    continue
         yield seed0, seed1
-
+    stats.done()
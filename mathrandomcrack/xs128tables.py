@@ -0,0 +1,281 @@
+from .xs128 import *
+
+import logging
+import mmap
+import os
+import struct
+
+logger = logging.getLogger(__name__)
+
+# Number of successive xs128 calls for which the state0 dependency rows are precomputed
+TABLE_STEPS = 4096
+# Number of squared transition matrices T^(2^j) precomputed for long jumps
+TABLE_POWERS = STATE_SIZE
+# Each row is a 128-bit mask stored as 16 little-endian bytes
+ROW_SIZE = STATE_SIZE // 8
+
+# Jumps of at most this number of calls are done by calling xs128 directly
+JUMP_STEP_THRESHOLD = 256
+# xs128 has a period of 2^128 - 1 so any jump backwards is a jump forwards
+XS128_PERIOD = (1 << STATE_SIZE) - 1
+
+TABLE_MAGIC = b'MRCXS128'
+TABLE_VERSION = 1
+TABLE_HEADER = struct.Struct('<8sIII')
+
+def identity_rows():
+    """
+    Return the 128 dependency rows of the initial xs128 state relatively to itself.
+    """
+    return [1 << i for i in range(STATE_SIZE)]
+
+def transition_rows():
+    """
+    Return the 128 dependency rows of the state after one call to xs128 relatively to the state before.
+    """
+    columns = []
+    for j in range(STATE_SIZE):
+        # The image of the j-th basis vector is the j-th column of the transition matrix
+        s0, s1 = xs128((1 << j) & ((1 << HALF_STATE_SIZE) - 1), (1 << j) >> HALF_STATE_SIZE)
+        columns.append(s0 | (s1 << HALF_STATE_SIZE))
+    return [sum(((columns[j] >> i) & 1) << j for j in range(STATE_SIZE)) for i in range(STATE_SIZE)]
+
+def compose_rows(outer, inner):
+    """
+    Compose two linear maps in GF(2) represented by dependency rows.
+
+    Arguments:
+        outer: the rows of a map that expresses a state C relatively to a state B.
+
+        inner: the 128 rows of a map that expresses the state B relatively to a state A.
+
+    Return the rows that express the state C relatively to the state A.
+    """
+    composed = []
+    for row in outer:
+        acc = 0
+        while row:
+            low = row & -row
+            acc ^= inner[low.bit_length() - 1]
+            row ^= low
+        composed.append(acc)
+    return composed
+
+def apply_rows(rows, state):
+    """
+    Apply a linear map in GF(2) represented by dependency rows to a concrete packed state.
+
+    Arguments:
+        rows: the dependency rows of the map.
+
+        state: an integer where bit i is the i-th bit of the input state.
+    """
+    return sum(((row & state).bit_count() & 1) << i for i, row in enumerate(rows))
+
+class XS128Tables():
+    """
+    Precomputed symbolic xs128 tables shared by all the state recovery attempts.
+
+    Rows are 128-bit masks relatively to the initial 128-bit state of xs128 (initial state0
+    is the low 64 bits, initial state1 is the high 64 bits), like StateBitDeps data.
+
+    Attributes:
+        steps: the number of successive xs128 calls for which state0 rows are stored.
+            Rows of step k represent state0 after k+1 calls to xs128.
+
+        powers: the number of stored transition matrices.
+            Matrix j represents 2^j successive calls to xs128.
+    """
+    def __init__(self, buffer, steps, powers):
+        self._buffer = buffer
+        self.steps = steps
+        self.powers = powers
+        self._steps_offset = TABLE_HEADER.size
+        self._powers_offset = self._steps_offset + steps * HALF_STATE_SIZE * ROW_SIZE
+        self._step_rows = [None for _ in range(steps)]
+        self._power_rows = [None for _ in range(powers)]
+
+    @staticmethod
+    def build(steps=TABLE_STEPS, powers=TABLE_POWERS):
+        """
+        Compute the tables and return their compact binary representation.
+        """
+        out = bytearray(TABLE_HEADER.pack(TABLE_MAGIC, TABLE_VERSION, steps, powers))
+        transition = transition_rows()
+        rows = identity_rows()
+        for _ in range(steps):
+            rows = compose_rows(transition, rows)
+            for row in rows[:HALF_STATE_SIZE]:
+                out += row.to_bytes(ROW_SIZE, 'little')
+        for _ in range(powers):
+            for row in transition:
+                out += row.to_bytes(ROW_SIZE, 'little')
+            transition = compose_rows(transition, transition)
+        return bytes(out)
+
+    @classmethod
+    def load(cls, path=None):
+        """
+        Memory-map the tables stored at path, building and saving them first if needed.
+        If the tables cannot be saved, they are only kept in memory.
+
+        Arguments:
+            (optional) path: the tables file. If not specified, default_tables_path() is used.
+        """
+        if path is None:
+            path = default_tables_path()
+        try:
+            return cls._map(path)
+        except (OSError, ValueError) as e:
+            logger.debug(f'Could not load xs128 tables from {path}: {e}')
+        data = cls.build()
+        try:
+            import tempfile
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # Write to a temporary file first so that concurrent loaders never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            logger.debug(f'Saved xs128 tables to {path}')
+            return cls._map(path)
+        except OSError as e:
+            logger.debug(f'Could not save xs128 tables to {path}: {e}')
+        return cls(data, TABLE_STEPS, TABLE_POWERS)
+
+    @classmethod
+    def _map(cls, path):
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(buffer) < TABLE_HEADER.size:
+            raise ValueError('truncated tables file')
+        magic, version, steps, powers = TABLE_HEADER.unpack_from(buffer, 0)
+        if magic != TABLE_MAGIC or version != TABLE_VERSION:
+            raise ValueError('unsupported tables file')
+        if len(buffer) != TABLE_HEADER.size + (steps * HALF_STATE_SIZE + powers * STATE_SIZE) * ROW_SIZE:
+            raise ValueError('truncated tables file')
+        return cls(buffer, steps, powers)
+
+    def _read_rows(self, offset, count):
+        buffer = self._buffer
+        return [int.from_bytes(buffer[offset + i * ROW_SIZE:offset + (i + 1) * ROW_SIZE], 'little') for i in range(count)]
+
+    def state0_rows(self, step):
+        """
+        Return the 64 dependency rows of state0 after step+1 calls to xs128.
+        """
+        if step >= self.steps:
+            return self.transition(step + 1)[:HALF_STATE_SIZE]
+        rows = self._step_rows[step]
+        if rows is None:
+            rows = self._read_rows(self._steps_offset + step * HALF_STATE_SIZE * ROW_SIZE, HALF_STATE_SIZE)
+            self._step_rows[step] = rows
+        return rows
+
+    def iter_state0_rows(self, steps):
+        """
+        Yield (step, rows) tuples with the 64 dependency rows of state0 after step+1 calls to xs128
+        for each step of an increasing sequence of steps.
+        Steps beyond the tables are reached by moving a symbolic state forward with the squared transition
+        matrices, so that the cost only depends on the number of steps and not on the gaps between them.
+        """
+        state = None
+        state_step = None
+        for step in steps:
+            if step < self.steps:
+                yield step, self.state0_rows(step)
+                continue
+            if state is None:
+                # Jump over the tabulated states using the squared transition matrices
+                state = self.transition(step + 1)
+            else:
+                state = self.advance_rows(state, step - state_step)
+            state_step = step
+            yield step, state[:HALF_STATE_SIZE]
+
+    def advance_rows(self, rows, n):
+        """
+        Return the 128 dependency rows of the state n calls to xs128 after the state represented by rows.
+        A gap of n calls costs one composition per set bit of n.
+        """
+        assert 0 <= n < (1 << self.powers)
+        j = 0
+        while n:
+            if n & 1:
+                rows = compose_rows(self.power(j), rows)
+            n >>= 1
+            j += 1
+        return rows
+
+    def power(self, j):
+        """
+        Return the 128 dependency rows of the transition matrix of 2^j successive calls to xs128.
+        """
+        rows = self._power_rows[j]
+        if rows is None:
+            rows = self._read_rows(self._powers_offset + j * STATE_SIZE * ROW_SIZE, STATE_SIZE)
+            self._power_rows[j] = rows
+        return rows
+
+    def transition(self, n):
+        """
+        Return the 128 dependency rows of the transition matrix of n successive calls to xs128.
+        The matrix is obtained by composing squared transition matrices.
+        """
+        return self.advance_rows(identity_rows(), n)
+
+    def jump(self, state0, state1, n):
+        """
+        Return the 128-bit state of xs128 after n calls to xs128 as a (state0, state1) tuple.
+        Negative values of n go backwards. Long jumps cost O(log n) using the squared transition matrices.
+        """
+        if 0 <= n <= JUMP_STEP_THRESHOLD:
+            for _ in range(n):
+                state0, state1 = xs128(state0, state1)
+            return state0, state1
+        if -JUMP_STEP_THRESHOLD <= n < 0:
+            for _ in range(-n):
+                state0, state1 = reverse_xs128(state0, state1)
+            return state0, state1
+        n %= XS128_PERIOD
+        state = state0 | (state1 << HALF_STATE_SIZE)
+        j = 0
+        while n:
+            if n & 1:
+                state = apply_rows(self.power(j), state)
+            n >>= 1
+            j += 1
+        return state & ((1 << HALF_STATE_SIZE) - 1), state >> HALF_STATE_SIZE
+
+def jump_xs128(state0, state1, n):
+    """
+    Return the 128-bit state of xs128 after n calls to xs128 (or -n calls to reverse_xs128 if n is negative)
+    as a (state0, state1) tuple, using the shared tables.
+    """
+    return get_tables().jump(state0, state1, n)
+
+def default_tables_path():
+    """
+    Return the path of the shared xs128 tables file.
+    Can be overridden with the MATHRANDOMCRACK_TABLES environment variable.
+    """
+    path = os.environ.get('MATHRANDOMCRACK_TABLES')
+    if path:
+        return path
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'mathrandomcrack', f'xs128tables-v{TABLE_VERSION}-{TABLE_STEPS}.bin')
+
+_shared_tables = None
+
+def get_tables():
+    """
+    Return the XS128Tables shared by every state recovery in this process.
+    """
+    global _shared_tables
+    if _shared_tables is None:
+        _shared_tables = XS128Tables.load()
+    return _shared_tables
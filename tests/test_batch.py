@@ -0,0 +1,96 @@
+import json
+import logging
+import math
+import os
+import struct
+import tempfile
+import unittest
+from array import array
+
+from mathrandomcrack.batch import *
+
+logging.basicConfig(level=logging.ERROR)
+
+class TestBatch(unittest.TestCase):
+
+    def test_crack_batch(self):
+        math_random = MathRandom(6770692079143846949, 12009346246601641483)
+        # Leaks cross a cache refill so that the cache index is unique
+        for _ in range(57):
+            math_random.next()
+        previous = [math_random.at(i) for i in range(-3, 0)]
+        doubles = [math_random.next() for _ in range(12)]
+        next_doubles = [math_random.next() for _ in range(4)]
+
+        leak_sets = [
+            {'id': 'doubles', 'method': 'doubles', 'leaks': doubles[:2] + [None] + doubles[3:], 'previous': 3, 'next': 4},
+            {'id': 'scaled', 'method': 'scaled', 'factor': 1 << 20, 'leaks': [math.floor(d * (1 << 20)) for d in doubles],
+                'positions': list(range(12)), 'next': 4, 'output_fmt': 'scaled'},
+            {'id': 'invalid', 'method': 'doubles', 'leaks': doubles, 'positions': [0]},
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'leaks.jsonl')
+            with open(path, 'w') as f:
+                for leak_set in leak_sets:
+                    f.write(json.dumps(leak_set) + '\n')
+            for workers in [None, 2]:
+                results = list(crack_batch(load_leak_sets(path, {'next': 10}), workers=workers))
+                self.assertEqual([result['id'] for result in results], ['doubles', 'scaled', 'invalid'])
+                self.assertEqual(len(results[0]['states']), 1)
+                self.assertEqual(results[0]['states'][0]['previous'], previous)
+                self.assertEqual(results[0]['states'][0]['next'], next_doubles)
+                self.assertEqual(results[1]['states'][0]['next'], [math.floor(d * (1 << 20)) for d in next_doubles])
+                self.assertIn('error', results[2])
+
+    def test_load_leak_sets_directory(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(os.path.join(tmp_dir, 'leaks.txt'), 'w') as f:
+                f.write('0.25\n\n0.5\n')
+            leak_sets = list(load_leak_sets(tmp_dir, {'method': 'doubles'}))
+            self.assertEqual(leak_sets, [{'method': 'doubles', 'id': 'leaks.txt', 'leaks': [0.25, 0.5], 'positions': [0, 2]}])
+            # The method of the files of a directory cannot be guessed
+            with self.assertRaises(ValueError):
+                list(load_leak_sets(tmp_dir))
+
+    def test_load_leaks(self):
+        math_random = MathRandom(6770692079143846949, 12009346246601641483)
+        doubles = [math_random.next() for _ in range(6)]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'doubles.txt')
+            with open(path, 'w') as f:
+                f.write('# comment\n' + '\n'.join(repr(d) if i != 2 else '' for i, d in enumerate(doubles)) + '\n')
+            expected = ([d for i, d in enumerate(doubles) if i != 2], [0, 1, 3, 4, 5])
+            self.assertEqual(load_leaks(path, 'doubles'), expected)
+            # NaN doubles are unknown outputs in raw float64 files
+            path = os.path.join(tmp_dir, 'doubles.f64')
+            with open(path, 'wb') as f:
+                array('d', [d if i != 2 else math.nan for i, d in enumerate(doubles)]).tofile(f)
+            leaks, positions = load_leaks(path, 'doubles', 'f64')
+            self.assertEqual((list(leaks), list(positions)), expected)
+            # Bounds in a .npy file with a position column
+            path = os.path.join(tmp_dir, 'bounds.npy')
+            header = "{'descr': '<f8', 'fortran_order': False, 'shape': (2, 2), }"
+            header += ' ' * (63 - (10 + len(header)) % 64) + '\n'
+            with open(path, 'wb') as f:
+                f.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1'))
+                array('d', [0.25, 0.5, 0.0, 1.0]).tofile(f)
+            positions_path = os.path.join(tmp_dir, 'positions.u64')
+            with open(positions_path, 'wb') as f:
+                array('Q', [10, 5000]).tofile(f)
+            leaks, positions = load_leaks(path, 'bounds', positions_path=positions_path)
+            self.assertEqual((leaks, list(positions)), ([(0.25, 0.5), (0.0, 1.0)], [10, 5000]))
+            with self.assertRaises(ValueError):
+                load_leaks(path, 'scaled')
+            # Doubles out of [0, 1] are rejected
+            for invalid in [1.0000001, 1.5, -0.5, math.inf]:
+                path = os.path.join(tmp_dir, 'invalid.f64')
+                with open(path, 'wb') as f:
+                    array('d', doubles + [invalid]).tofile(f)
+                with self.assertRaises(AssertionError):
+                    load_leaks(path, 'doubles', 'f64')
+            # Negative int64 scaled values are rejected
+            path = os.path.join(tmp_dir, 'scaled.i64')
+            with open(path, 'wb') as f:
+                array('q', [3, -1]).tofile(f)
+            with self.assertRaises(AssertionError):
+                load_leaks(path, 'scaled', 'i64')
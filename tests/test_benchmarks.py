@@ -0,0 +1,19 @@
+import json
+import logging
+import unittest
+
+from benchmarks.bench import *
+
+logging.basicConfig(level=logging.ERROR)
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_run_benchmarks(self):
+        results = run_benchmarks(['doubles-4', 'bounds-1e-3'], repeat=1)
+        self.assertEqual(sorted(results['benchmarks']), ['bounds-1e-3', 'doubles-4'])
+        self.assertIn('phase.solve', results['benchmarks']['doubles-4']['measures'])
+        # Results are JSON-serializable and can be compared with themselves
+        baseline = json.loads(json.dumps(results))
+        comparison = compare(results, baseline)
+        self.assertTrue(comparison)
+        self.assertFalse(any(regression for *_, regression in comparison))
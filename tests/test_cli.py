@@ -0,0 +1,39 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from array import array
+
+SAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'samples')
+
+def run_cli(*args):
+    return subprocess.run([sys.executable, '-m', 'mathrandomcrack', *args], capture_output=True, check=True).stdout
+
+class TestCLI(unittest.TestCase):
+
+    def test_output_modes(self):
+        options = ['--method', 'scaled', '--factor', '36', '--output-fmt', 'scaled', '--previous', '2', '--next', '3', os.path.join(SAMPLES, 'scaled_values.txt')]
+        self.assertIn(b'Predicted next 3 values: [20, 29, 1]', run_cli(*options))
+        self.assertEqual(run_cli('--output-mode', 'lines', *options).split(), [b'4', b'5', b'20', b'29', b'1'])
+        records = [json.loads(line) for line in run_cli('--output-mode', 'ndjson', *options).splitlines()]
+        self.assertEqual(records[0]['cache_idx'], 58)
+        self.assertEqual([(record['kind'], record['values']) for record in records[1:]], [('previous', [4, 5]), ('next', [20, 29, 1])])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Each possible state is written to its own file
+            run_cli('--output-mode', 'binary', '--output-file', os.path.join(tmp_dir, 'state-{state}.bin'), *options)
+            values = array('q')
+            with open(os.path.join(tmp_dir, 'state-0.bin'), 'rb') as f:
+                values.frombytes(f.read())
+            if sys.byteorder != 'little':
+                values.byteswap()
+            self.assertEqual(values.tolist(), [4, 5, 20, 29, 1])
+
+    def test_batch_directory_without_method(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(os.path.join(tmp_dir, 'leaks.txt'), 'w') as f:
+                f.write('0.5\n')
+            process = subprocess.run([sys.executable, '-m', 'mathrandomcrack', '--batch', tmp_dir], capture_output=True)
+        self.assertNotEqual(process.returncode, 0)
+        self.assertIn(b'ValueError: --method should be specified when using --batch with a directory', process.stderr)
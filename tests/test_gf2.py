@@ -0,0 +1,58 @@
+import random
+import unittest
+
+from mathrandomcrack.gf2 import *
+
+class TestGF2(unittest.TestCase):
+
+    def test_solve_packed(self):
+        rng = random.Random(1337)
+        size = 10
+        secret = rng.getrandbits(size)
+        # Underdetermined system satisfied by secret
+        rows = []
+        for _ in range(7):
+            coeffs = rng.getrandbits(size)
+            rows.append(coeffs | (((coeffs & secret).bit_count() & 1) << size))
+        v0, kernel = solve_packed(rows, size)
+        # Compare the solutions with a brute force search
+        expected = {x for x in range(1 << size) if all(((row & x).bit_count() & 1) == (row >> size) for row in rows)}
+        solutions = set()
+        for i in range(1 << len(kernel)):
+            v = v0
+            for j, k in enumerate(kernel):
+                if (i >> j) & 1:
+                    v ^= k
+            solutions.add(v)
+        self.assertIn(secret, solutions)
+        self.assertEqual(solutions, expected)
+
+    def test_solve_packed_inconsistent(self):
+        # x0 ^ x1 = 1, x0 = 0, x1 = 0
+        rows = [0b111, 0b001, 0b010]
+        with self.assertRaises(ValueError):
+            solve_packed(rows, 2)
+
+    def test_solution_space(self):
+        rng = random.Random(1337)
+        size = 12
+        rows = []
+        for _ in range(5):
+            coeffs = rng.getrandbits(size)
+            rows.append(coeffs | (rng.getrandbits(1) << size))
+        solutions = SolutionSpace(*solve_packed(rows, size))
+        expected = {x for x in range(1 << size) if all(((row & x).bit_count() & 1) == (row >> size) for row in rows)}
+        self.assertEqual(solutions.count, len(expected))
+        enumerated = list(solutions)
+        self.assertEqual(set(enumerated), expected)
+        self.assertEqual(len(enumerated), len(expected))
+        # Solutions can be accessed by index and enumerated by chunks
+        self.assertEqual([solutions[i] for i in range(solutions.count)], enumerated)
+        self.assertEqual(solutions[-1], enumerated[-1])
+        chunks = [solution for start in range(0, solutions.count, 7) for solution in solutions.iter_range(start, start + 7)]
+        self.assertEqual(chunks, enumerated)
+        self.assertTrue(set(solutions.sample(20, rng)) <= expected)
+        with self.assertRaises(IndexError):
+            solutions[solutions.count]
+        # Counting does not need enumeration
+        self.assertEqual(SolutionSpace(0, [1 << i for i in range(100)]).count, 1 << 100)
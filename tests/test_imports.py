@@ -0,0 +1,32 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules that are only needed to recover states, to run in parallel or to use the result cache
+HEAVY_MODULES = ['sage', 'sage.all', 'numpy', 'multiprocessing', 'concurrent.futures.process', 'sqlite3', 'asyncio',
+        'mathrandomcrack.xs128crack', 'mathrandomcrack.gf2', 'mathrandomcrack.mathrandomcrack']
+# Generous bound on the import time, only meant to catch an import of a heavy module
+MAX_IMPORT_TIME = 1.0
+
+def imported_modules(statement):
+    code = ('import json, sys, time\n'
+            'start = time.perf_counter()\n'
+            f'{statement}\n'
+            'print(json.dumps({"time": time.perf_counter() - start, "modules": sorted(sys.modules)}))\n')
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, check=True, cwd=ROOT).stdout
+    return json.loads(output)
+
+class TestImports(unittest.TestCase):
+
+    def test_simulation_import_is_light(self):
+        result = imported_modules('import mathrandomcrack.mathrandom')
+        self.assertEqual([module for module in HEAVY_MODULES if module in result['modules']], [])
+        self.assertLess(result['time'], MAX_IMPORT_TIME)
+
+    def test_recovery_import_does_not_load_backends(self):
+        result = imported_modules('import mathrandomcrack.mathrandomcrack, mathrandomcrack.batch, mathrandomcrack.resultcache')
+        for module in ['sage', 'sage.all', 'numpy', 'multiprocessing', 'concurrent.futures.process', 'sqlite3']:
+            self.assertNotIn(module, result['modules'])
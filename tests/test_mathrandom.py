@@ -1,3 +1,5 @@
+import copy
+import math
 import unittest
 
 from mathrandomcrack.mathrandom import *
@@ -24,3 +26,110 @@ class TestMathRandom(unittest.TestCase):
         # Test backward generation
         for d in expected_doubles[::-1]:
             self.assertEqual(d, math_random.previous())
+
+    def test_math_random_jumps(self):
+        math_random = MathRandom(6770692079143846949, 12009346246601641483)
+        for _ in range(10):
+            math_random.next()
+        expected_doubles = [math_random.at(i) for i in range(-5, 300)]
+
+        for n in [0, 1, 53, 54, 64, 117, 118, 200]:
+            # Jumping forward and backward is the same as calling next() and previous() n times
+            stepped, jumped = copy.copy(math_random), copy.copy(math_random)
+            for _ in range(n):
+                stepped.next()
+            jumped.advance(n)
+            self.assertEqual(stepped, jumped)
+            self.assertEqual(jumped.next(), expected_doubles[n + 5])
+            stepped.next()
+            for _ in range(n + 1):
+                stepped.previous()
+            jumped.rewind(n + 1)
+            self.assertEqual(stepped, jumped)
+
+        # Long jumps
+        for _ in range(1000):
+            math_random.next()
+        expected = math_random.next()
+        math_random.rewind(1011)
+        math_random.advance(10 ** 15)
+        math_random.rewind(10 ** 15 - 1010)
+        self.assertEqual(math_random.next(), expected)
+
+    def test_math_random_take(self):
+        math_random = MathRandom(6770692079143846949, 12009346246601641483)
+        for _ in range(10):
+            math_random.next()
+
+        # Small and bulk sizes give the same values and state as calling next() n times
+        for n in [0, 1, 54, 64, 200, 64 * 100 + 7]:
+            stepped, taken = copy.copy(math_random), copy.copy(math_random)
+            expected = [stepped.next() for _ in range(n)]
+            self.assertEqual(list(taken.take(n)), expected)
+            self.assertEqual(stepped, taken)
+
+        taken = copy.copy(math_random)
+        self.assertEqual(list(taken.take(300, 'scaled', 36, -5)), [math.floor(math_random.next() * 36 - 5) for _ in range(300)])
+        self.assertEqual(taken, math_random)
+        self.assertEqual([v8_to_double(v) for v in taken.take(100, 'uint64')], [math_random.next() for _ in range(100)])
+        # Values are converted by chunks
+        n = FORMAT_CHUNK_SIZE + 100
+        self.assertEqual(list(taken.fork().take(n, 'scaled', 36, -5)), [math.floor(d * 36 - 5) for d in taken.take(n)])
+        self.assertEqual(list(taken.take(n)), [math_random.next() for _ in range(2 * n)][n:])
+        with self.assertRaises(ValueError):
+            math_random.take(1, 'float')
+
+    def test_math_random_take_previous(self):
+        math_random = MathRandom(6770692079143846949, 12009346246601641483)
+        for _ in range(10):
+            math_random.next()
+
+        # Same values and state as calling previous() n times
+        for n in [0, 1, 11, 64, 300, 64 * 100 + 7]:
+            stepped, taken = copy.copy(math_random), copy.copy(math_random)
+            expected = [stepped.previous() for _ in range(n)]
+            self.assertEqual(list(taken.take_previous(n)), expected)
+            self.assertEqual(stepped, taken)
+
+    def test_math_random_fork_and_snapshot(self):
+        math_random = MathRandom(6770692079143846949, 12009346246601641483)
+        math_random.advance(100)
+        fork = math_random.fork()
+        snapshot = math_random.snapshot()
+        self.assertEqual(len(snapshot), SNAPSHOT_STRUCT.size)
+        expected = [math_random.next() for _ in range(200)]
+        # Forks and restored snapshots are independent from the original state
+        self.assertEqual([fork.next() for _ in range(200)], expected)
+        self.assertEqual(MathRandom.from_snapshot(snapshot).next(), expected[0])
+        math_random.restore(snapshot)
+        self.assertEqual(math_random.take(200).tolist(), expected)
+        self.assertFalse(hasattr(math_random, '__dict__'))
+        # Candidates are created with a single refill
+        recovered = MathRandom.from_previous_state(6770692079143846949, 12009346246601641483, 20)
+        reference = MathRandom(6770692079143846949, 12009346246601641483)
+        reference.advance(43)
+        self.assertEqual(recovered, reference)
+
+    def test_math_random_find(self):
+        math_random = MathRandom(6770692079143846949, 12009346246601641483)
+        math_random.advance(10)
+        reference = math_random.fork()
+        values = math_random.fork().take(200000, 'scaled', 1000)
+        # A pattern that crosses a chunk of generated values
+        pattern = values[FIND_CHUNK_SIZE - 2:FIND_CHUNK_SIZE + 3]
+        self.assertEqual(math_random.find(pattern, 'scaled', 1000, max_distance=200000), [FIND_CHUNK_SIZE - 2])
+        self.assertEqual(math_random.find(pattern, 'scaled', 1000, max_distance=FIND_CHUNK_SIZE), [])
+        self.assertEqual(math_random, reference)
+        self.assertEqual(math_random.find(math_random.at(123456)), [123456])
+        self.assertEqual(math_random.find(math_random.at(-70000), direction='backward'), [-70000])
+
+        # Several patterns, nearest matches first
+        previous = math_random.fork().take_previous(1000, 'scaled', 4)
+        patterns = [[previous[1], previous[0]], [previous[2]]]
+        expected = [(-i - 2, 0) for i in range(999) if [previous[i + 1], previous[i]] == patterns[0]]
+        expected += [(-i - 1, 1) for i in range(1000) if previous[i] == previous[2]]
+        expected.sort(key=lambda match: (-match[0], match[1]))
+        self.assertEqual(math_random.find(patterns, 'scaled', 4, max_distance=1000, direction='backward'), expected)
+        self.assertEqual(math_random.find(patterns, 'scaled', 4, max_distance=1000, direction='backward', limit=3), expected[:3])
+        with self.assertRaises(ValueError):
+            math_random.find([])
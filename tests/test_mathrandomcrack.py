@@ -1,8 +1,14 @@
+import copy
+import json
 import math
 import logging
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
 from mathrandomcrack.mathrandomcrack import *
+from mathrandomcrack.stats import RecoveryStats
+from mathrandomcrack.xs128crack import EQUATION_RESERVE, solve_linear_system_native
 
 logging.basicConfig(level=logging.ERROR)
 
@@ -82,3 +88,198 @@ class TestMathRandomCrack(unittest.TestCase):
             if found_correct_state:
                 break
         self.assertTrue(found_correct_state)
+
+    def test_recover_state_from_math_random_doubles_long_span(self):
+        math_random = MathRandom(6770692079143846949, 12009346246601641483)
+        math_random.advance(17)
+        # Values millions of calls apart only cost their own dependency rows
+        positions = [0, 1, 2, 5000000, 5000001, 5000002, 9000000]
+        known_doubles = [math_random.at(position) for position in positions]
+        states = list(recover_state_from_math_random_doubles(known_doubles, positions))
+        self.assertIn(math_random, states)
+        for state in states:
+            self.assertEqual([state.at(position) for position in positions], known_doubles)
+
+    def test_recovery_engine(self):
+        generated_doubles = [0.28312656309821627, 0.2126296311778575, 0.045291001697600364, 0.9069011015169577, 0.5988258696130254, 0.8028144523905971, 0.2993948573359255, 0.7836084709175235, 0.36330960376322163, 0.5966969790645456]
+        positions = [0, 4, 5, 9]
+        known_bits = [[None for _ in range(11)] + int64_to_bits(v8_from_double(generated_doubles[pos]))[11:] for pos in positions]
+
+        engine = RecoveryEngine(known_bits, positions)
+        # Solutions from shared echelon forms should match independent solves of each hypothesis
+        shared_solutions = {cache_idx: (v0, len(kernel)) for cache_idx, v0, kernel in engine.solve_all()}
+        independent_solutions = {}
+        for cache_idx in range(MATH_RANDOM_CACHE_SIZE):
+            try:
+                v0, kernel = engine.solve(cache_idx)
+                independent_solutions[cache_idx] = (v0, len(kernel))
+            except ValueError:
+                pass
+        self.assertTrue(len(shared_solutions) > 0)
+        self.assertEqual(shared_solutions, independent_solutions)
+
+    def test_recovery_engine_selected_equations(self):
+        math_random = MathRandom(6770692079143846949, 12009346246601641483)
+        known_bits = [[None] * 11 + int64_to_bits(value)[11:] for value in math_random.fork().take(100, 'uint64')]
+        self.assertEqual(list(recover_state_from_math_random_known_bits(known_bits)), [math_random])
+        # Non-native backends only solve the selected equations, the other ones must still be checked
+        with mock.patch.dict(SOLVER_BACKENDS, {'selected': solve_linear_system_native}):
+            self.assertEqual(list(recover_state_from_math_random_known_bits(known_bits, backend='selected')), [math_random])
+
+    def test_recovery_engine_unselected_bits(self):
+        math_random = MathRandom(6770692079143846949, 12009346246601641483)
+        known_bits = [[None] * 11 + int64_to_bits(value)[11:] for value in math_random.fork().take(200, 'uint64')]
+        engine = RecoveryEngine(known_bits, list(range(200)))
+        self.assertEqual(engine.total_equations, 200 * 53)
+        # Each chain of shared echelon forms stops selecting equations once it has full rank and a few checks
+        self.assertEqual(sum(map(len, engine.low_rows)), STATE_SIZE + EQUATION_RESERVE)
+        self.assertEqual(sum(map(len, engine.high_rows)), STATE_SIZE + EQUATION_RESERVE)
+        self.assertTrue(engine.unselected_bits)
+        self.assertEqual(list(recover_state_from_math_random_known_bits(known_bits)), [math_random])
+        # A known bit of a value whose equations were not selected is still checked
+        known_bits[-1][-1] ^= 1
+        self.assertEqual(list(recover_state_from_math_random_known_bits(known_bits)), [])
+
+    def test_recover_state_parallel(self):
+        known_doubles = [0.3729983038966259, 0.17496511670650206, 0.49159038738927563, 0.9421448261165485]
+
+        expected_states = list(recover_state_from_math_random_doubles(known_doubles))
+        # Parallel search should find the same states in the same order when ordered
+        parallel_states = list(recover_state_from_math_random_doubles(known_doubles, workers=3, ordered=True))
+        self.assertEqual(parallel_states, expected_states)
+        # Unordered parallel search should find the same states
+        parallel_states = list(recover_state_from_math_random_doubles(known_doubles, workers=3))
+        self.assertEqual(len(parallel_states), len(expected_states))
+        self.assertTrue(all(state in expected_states for state in parallel_states))
+        # Hypotheses are split in small ranges whose solutions are yielded as soon as each one is solved
+        submitted = []
+        class Executor(ThreadPoolExecutor):
+            def submit(self, function, engine, first, last, backend):
+                submitted.append((first, last))
+                return super().submit(function, engine, first, last, backend)
+        with Executor(2) as executor:
+            parallel_states = list(recover_state_from_math_random_doubles(known_doubles, workers=2, ordered=True, executor=executor))
+        self.assertEqual(parallel_states, expected_states)
+        self.assertEqual(len(submitted), 2 * PARALLEL_RANGES_PER_WORKER)
+
+    def test_recovery_engine_screening(self):
+        math_random = MathRandom(6770692079143846949, 12009346246601641483)
+        generated_doubles = [math_random.next() for _ in range(100)]
+        known_bits = [[None for _ in range(11)] + int64_to_bits(v8_from_double(d))[11:] for d in generated_doubles]
+
+        engine = RecoveryEngine(known_bits, list(range(len(known_bits))))
+        solved = [cache_idx for cache_idx, _, _ in engine.solve_all()]
+        survivors = [cache_idx for cache_idx in range(MATH_RANDOM_CACHE_SIZE) if engine.screen(cache_idx) is not None]
+        # Screening never rejects a valid hypothesis and rejects most of the wrong ones
+        self.assertEqual(solved, [63])
+        self.assertTrue(all(cache_idx in survivors for cache_idx in solved))
+        self.assertTrue(len(survivors) < 8)
+        # Enough equations to screen hypotheses during recovery
+        self.assertTrue(engine.total_equations > SCREEN_MIN_EQUATIONS)
+        recovered = list(recover_state_from_math_random_known_bits(known_bits))
+        self.assertEqual(len(recovered), 1)
+        self.assertEqual([recovered[0].next() for _ in range(100)], generated_doubles)
+
+    def test_recover_state_from_math_random_scaled_values_underdetermined(self):
+        factor = 10
+        math_random = MathRandom(6770692079143846949, 12009346246601641483)
+        known_values = [math.floor(factor * math_random.next()) for _ in range(60)]
+        expected_next = [math_random.next() for _ in range(10)]
+
+        # Known bits alone leave 2^11 possible seeds for each cache_idx, bounds of the values prune them
+        recovered_states = list(recover_state_from_math_random_scaled_values(known_values, factor))
+        self.assertTrue(len(recovered_states) < 10)
+        found_correct_state = False
+        for recovered_math_random in recovered_states:
+            # Verify that the state generates the correct integers
+            self.assertEqual([math.floor(factor * recovered_math_random.next()) for _ in known_values], known_values)
+            found_correct_state |= all(d == recovered_math_random.next() for d in expected_next)
+        self.assertTrue(found_correct_state)
+
+    def test_known_bits_from_exact_bounds(self):
+        math_random = MathRandom(6770692079143846949, 12009346246601641483)
+        math_random.advance(5)
+        doubles = math_random.fork().take(200)
+        # With factor 2, each value only leaks its most significant bit, which must not be lost to rounding
+        stats = RecoveryStats()
+        recovered_states = list(recover_state_from_math_random_scaled_values([math.floor(2 * d) for d in doubles], 2, stats=stats))
+        self.assertEqual(stats.counters['equations'], 200)
+        self.assertIn(math_random, recovered_states)
+        # Known bits of approximate values are the common bits of the exact bounds of the states
+        bounds = [(d - 1e-4, d + 1e-4) for d in doubles[:30]]
+        stats = RecoveryStats()
+        self.assertIn(math_random, list(recover_state_from_math_random_approximate_values(bounds, stats=stats)))
+        self.assertEqual(stats.counters['equations'], sum(len(common_bits_between(*state_bounds_from_approximate_value(b))) for b in bounds))
+
+    def test_incremental_cracker(self):
+        math_random = MathRandom(6770692079143846949, 12009346246601641483)
+        for _ in range(20):
+            math_random.next()
+        expected_state = copy.copy(math_random)
+        generated_doubles = [math_random.next() for _ in range(100)]
+
+        cracker = IncrementalCracker()
+        self.assertEqual(cracker.candidates_count, MATH_RANDOM_CACHE_SIZE << STATE_SIZE)
+        # Values arrive in any order, with positions on both sides of a cache refill
+        for position in [70, 3, 50, 12, 43, 44]:
+            candidates_count = cracker.candidates_count
+            self.assertIsNone(cracker.state)
+            cracker.add_scaled(position, math.floor(generated_doubles[position] * (1 << 24)), 1 << 24)
+            self.assertLess(cracker.candidates_count, candidates_count)
+        cracker.add_double(80, generated_doubles[80])
+        cracker.add_bounds(81, (generated_doubles[81] - 0.001, generated_doubles[81] + 0.001))
+        self.assertEqual(cracker.remaining_rank, 0)
+        self.assertEqual(cracker.state, expected_state)
+        self.assertEqual(list(cracker.states()), [expected_state])
+
+        # Inconsistent values leave no possible state
+        cracker.add_double(90, generated_doubles[91])
+        self.assertEqual(cracker.candidates_count, 0)
+        self.assertIsNone(cracker.state)
+
+    def test_recover_state_from_math_random_segments(self):
+        math_random = MathRandom(6770692079143846949, 12009346246601641483)
+        for _ in range(20):
+            math_random.next()
+        expected_state = copy.copy(math_random)
+        factor = 1 << 20
+        segments = [[math.floor(math_random.next() * factor) for _ in range(2)]]
+        math_random.advance(3000)
+        # Only the second segment can be solved alone, the first one is searched backwards
+        segments.append([math.floor(math_random.next() * factor) for _ in range(12)])
+        math_random.advance(70)
+        # Unknown value inside a segment
+        segments.append([math.floor(math_random.at(i) * factor) if i != 1 else None for i in range(3)])
+        results = list(recover_state_from_math_random_segments(segments, [(0, 5000), (60, 80)], 'scaled', factor))
+        self.assertIn((expected_state, [3000, 70]), results)
+        for state, gaps in results:
+            # Other cache indices generate the same segments
+            positions = [0, 1] + [2 + gaps[0] + i for i in range(12)] + [14 + sum(gaps) + i for i in [0, 2]]
+            scaled_vals = [math.floor(state.at(position) * factor) for position in positions]
+            self.assertEqual(scaled_vals, [val for segment in segments for val in segment if val is not None])
+
+        # Segments that cannot be solved alone
+        short_segments = [segments[0] + [math.floor(expected_state.at(i) * factor) for i in range(2, 5)], segments[1][:4]]
+        results = list(recover_state_from_math_random_segments(short_segments, [(2990, 3010)], 'scaled', factor))
+        self.assertIn((expected_state, [2997]), results)
+        # Large ranges of offsets are reported as slow
+        with mock.patch('mathrandomcrack.mathrandomcrack.SEGMENT_SYMBOLIC_OFFSETS', 20):
+            with self.assertLogs('mathrandomcrack.mathrandomcrack', 'WARNING') as logs:
+                self.assertEqual(list(recover_state_from_math_random_segments(short_segments, [(2990, 3010)], 'scaled', factor)), results)
+        self.assertTrue(any('21 combinations of offsets' in message for message in logs.output))
+
+    def test_recovery_stats(self):
+        known_doubles = [0.3729983038966259, 0.17496511670650206, 0.49159038738927563, 0.9421448261165485]
+        events = []
+        stats = RecoveryStats(lambda event, data: events.append(event))
+        states = list(recover_state_from_math_random_doubles(known_doubles, stats=stats))
+        self.assertEqual(stats.counters['states'], len(states))
+        self.assertTrue(all(phase in stats.timers for phase in ['equations', 'solve', 'verify']))
+        # Every cache_idx hypothesis is reported once, either solved or rejected
+        self.assertEqual(len(stats.hypotheses), 64)
+        solved = [info for info in stats.hypotheses.values() if 'rejected' not in info]
+        self.assertEqual(len(solved), stats.counters['hypotheses_solved'])
+        self.assertEqual(sum(info['states'] for info in solved), len(states))
+        self.assertEqual(events.count('state'), len(states))
+        self.assertEqual(events[-1], 'done')
+        self.assertEqual(json.loads(json.dumps(stats.to_dict()))['counters'], stats.counters)
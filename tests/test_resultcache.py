@@ -0,0 +1,29 @@
+import os
+import tempfile
+import unittest
+
+from mathrandomcrack.mathrandomcrack import *
+from mathrandomcrack.resultcache import *
+from mathrandomcrack.stats import RecoveryStats
+
+class TestResultCache(unittest.TestCase):
+
+    def test_result_cache(self):
+        known_doubles = [0.3729983038966259, 0.17496511670650206, 0.49159038738927563, 0.9421448261165485]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result_cache = ResultCache(os.path.join(tmp_dir, 'results.sqlite'), max_entries=1)
+            stats = RecoveryStats()
+            states = list(recover_state_from_math_random_doubles(known_doubles, result_cache=result_cache, stats=stats))
+            self.assertEqual(stats.counters['cache_misses'], 1)
+            # A repeated query rebuilds the same states from the cached seeds without solving
+            stats = RecoveryStats()
+            self.assertEqual(list(recover_state_from_math_random_doubles(known_doubles, [0, 1, 2, 3], result_cache=result_cache, stats=stats)), states)
+            self.assertEqual(stats.counters['cache_hits'], 1)
+            self.assertNotIn('solve', stats.timers)
+            # The fingerprint does not depend on the order of the leaks
+            self.assertEqual(leak_set_fingerprint('doubles', known_doubles[::-1], [3, 2, 1, 0]), leak_set_fingerprint('doubles', known_doubles))
+            self.assertNotEqual(leak_set_fingerprint('scaled', [1, 2], factor=36), leak_set_fingerprint('scaled', [1, 2], factor=37))
+            # The least recently used leak set is evicted
+            list(recover_state_from_math_random_doubles(known_doubles[:3] + [0.5], result_cache=result_cache))
+            self.assertEqual(len(result_cache), 1)
+            self.assertIsNone(result_cache.get(leak_set_fingerprint('doubles', known_doubles)))
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from mathrandomcrack.mathrandom import MathRandom
+from mathrandomcrack.server import *
+
+logging.basicConfig(level=logging.ERROR)
+
+class Reader():
+    """
+    A connection that returns request lines, then waits and is reset or closed.
+    """
+    def __init__(self, lines, reset=False, delay=0):
+        self.lines = lines
+        self.reset = reset
+        self.delay = delay
+
+    async def readline(self):
+        if self.lines:
+            return self.lines.pop(0)
+        await asyncio.sleep(self.delay)
+        if self.reset:
+            raise ConnectionResetError()
+        return b''
+
+class Writer():
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+class TestServer(unittest.TestCase):
+
+    def test_serve(self):
+        math_random = MathRandom(6770692079143846949, 12009346246601641483)
+        # Leaks cross a cache refill so that the cache index is unique
+        math_random.advance(57)
+        expected = math_random.fork()
+        doubles = [math_random.next() for _ in range(12)]
+        next_doubles = [math_random.next() for _ in range(3)]
+        requests = [
+            {'id': 1, 'method': 'doubles', 'leaks': doubles, 'next': 3, 'stats': True},
+            {'id': 2, 'type': 'predict', 'state0': expected.state0, 'state1': expected.state1, 'cache_idx': expected.cache_idx, 'next': 15},
+            {'id': 3, 'method': 'doubles', 'leaks': [2.0]},
+        ]
+
+        async def run(socket_path):
+            started = asyncio.Event()
+            server = asyncio.create_task(serve(socket_path, max_jobs=2, started=started))
+            await started.wait()
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+            for request in requests:
+                writer.write(json.dumps(request).encode() + b'\n')
+            await writer.drain()
+            events = []
+            while len([event for event in events if event['event'] != 'state']) < len(requests):
+                events.append(json.loads(await reader.readline()))
+            writer.close()
+            server.cancel()
+            return events
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            events = asyncio.run(run(os.path.join(tmp_dir, 'server.sock')))
+        by_id = lambda request_id: [event for event in events if event['id'] == request_id]
+        states, done = by_id(1)[:-1], by_id(1)[-1]
+        self.assertEqual([state['event'] for state in states], ['state'])
+        self.assertEqual(states[0]['state']['next'], next_doubles)
+        self.assertEqual((done['event'], done['states']), ('done', 1))
+        self.assertIn('timers', done['stats'])
+        self.assertEqual(by_id(2)[0]['next'], doubles + next_doubles)
+        self.assertEqual(by_id(3)[0]['event'], 'error')
+
+    def test_connection_reset(self):
+        async def run():
+            server = CrackServer(max_jobs=1)
+            try:
+                # The requests are cancelled before they start when the connection is reset
+                await server.handle_connection(Reader([b'{"type": "predict"}\n'], reset=True), Writer())
+                # Their slot is released for the next requests
+                writer = Writer()
+                request = {'id': 1, 'type': 'predict', 'state0': 1, 'state1': 2, 'cache_idx': 0, 'next': 1}
+                await asyncio.wait_for(server.handle_connection(Reader([json.dumps(request).encode() + b'\n']), writer), 10)
+                return json.loads(writer.data)
+            finally:
+                server.close()
+
+        event = asyncio.run(run())
+        self.assertEqual((event['id'], event['event']), (1, 'prediction'))
+
+    def test_cancelled_recovery(self):
+        closed = threading.Event()
+        def iter_states(request, stats):
+            try:
+                while True:
+                    time.sleep(0.2)
+                    yield {}
+            finally:
+                closed.set()
+
+        async def run():
+            server = CrackServer()
+            server.cracker.iter_states = iter_states
+            try:
+                # The connection is reset while a state is being searched
+                writer = Writer()
+                await server.handle_connection(Reader([b'{"id": 1}\n'], reset=True, delay=0.1), writer)
+                await asyncio.get_running_loop().run_in_executor(None, closed.wait, 10)
+                return writer.data
+            finally:
+                server.close()
+
+        # The generator is closed by its worker thread once the search is over, without any error
+        self.assertEqual(asyncio.run(run()), b'')
+        self.assertTrue(closed.is_set())
+
+    def test_unexpected_error(self):
+        def iter_states(request, stats):
+            raise OverflowError('int too large to convert to float')
+            yield
+
+        async def run():
+            server = CrackServer()
+            server.cracker.iter_states = iter_states
+            try:
+                writer = Writer()
+                await server.handle_connection(Reader([b'{"id": 1}\n']), writer)
+                return json.loads(writer.data)
+            finally:
+                server.close()
+
+        logging.disable(logging.CRITICAL)
+        try:
+            event = asyncio.run(run())
+        finally:
+            logging.disable(logging.NOTSET)
+        # Any error is reported so that the client does not wait forever
+        self.assertEqual((event['id'], event['event'], event['error']), (1, 'error', 'int too large to convert to float'))
@@ -27,3 +27,20 @@ class TestXS128(unittest.TestCase):
             state0, state1 = reverse_xs128(state0, state1)
         self.assertEqual(state0, init_state0)
         self.assertEqual(state1, init_state1)
+
+    def test_xs128_bulk(self):
+        states = [(5753612509715215338, 17782382993159823008), (1, 2), (6770692079143846949, 12009346246601641483)]
+        expected = []
+        for state0, state1 in states:
+            lane = []
+            for _ in range(100):
+                state0, state1 = xs128(state0, state1)
+                lane.append(state0)
+            expected.append((lane, (state0, state1)))
+            self.assertEqual(xs128_states(*states[len(expected) - 1], 100), (lane, (state0, state1)))
+        values, final_states = xs128_parallel_states(states, 100)
+        for i, (lane, final_state) in enumerate(expected):
+            self.assertEqual(list(values[i::len(states)]), lane)
+            self.assertEqual(final_states[i], final_state)
+            # Going backwards visits the same states in reverse order
+            self.assertEqual(reverse_xs128_states(*final_state, 100), (lane[-2::-1] + [states[i][0]], states[i]))
@@ -1,6 +1,8 @@
 import unittest
 
 from mathrandomcrack.xs128crack import *
+from mathrandomcrack.stats import RecoveryStats
+from mathrandomcrack.xs128tables import jump_xs128
 
 class TestXS128Crack(unittest.TestCase):
 
@@ -36,3 +38,47 @@ class TestXS128Crack(unittest.TestCase):
                 break
         self.assertTrue(found_correct_seed)
 
+    def test_state_equation(self):
+        state0, state1 = 12092933408070727569, 7218780437263453395
+        deps = StateBitDeps([1 << i for i in range(64)])
+        deps = deps ^ (deps << 23)
+        value = state0 ^ ((state0 << 23) & ((1 << 64) - 1))
+        seed = state0 | (state1 << 64)
+        for i in range(64):
+            eq = deps.equation(i, (value >> i) & 1)
+            # Equations are packed rows, dense coefficients are only built on demand
+            self.assertEqual(eq.coefficients, deps.to_coeff(i))
+            self.assertEqual(StateEquation.from_row(eq.row).mask, eq.mask)
+            self.assertEqual((eq.mask & seed).bit_count() & 1, eq.result)
+        with self.assertRaises(AttributeError):
+            eq.coeffs = []
+
+    def test_recover_seed_from_many_known_bits(self):
+        seed0, seed1 = 12092933408070727569, 7218780437263453395
+        states, _ = xs128_states(seed0, seed1, 3000)
+        known_states_bits = [[(n >> j) & 1 if j >= 40 else None for j in range(64)] for n in states]
+        # Only the equations that increase the rank and a small reserve are solved
+        stats = RecoveryStats()
+        self.assertEqual(list(recover_seed_from_known_bits(known_states_bits, stats=stats)), [(seed0, seed1)])
+        self.assertEqual(stats.counters['equations'], STATE_SIZE + EQUATION_RESERVE)
+        # Known bits after the selected equations are still checked
+        known_states_bits[-1][63] ^= 1
+        self.assertEqual(list(recover_seed_from_known_bits(known_states_bits)), [])
+
+    def test_select_equations(self):
+        low, high = StateBitDeps([1 << i for i in range(64)]), StateBitDeps([1 << (64 + i) for i in range(64)])
+        # Redundant equations are dropped but the iterable is exhausted until the system has full rank
+        selected, rank, exhausted = select_equations([low.equation(i, 1) for i in range(64)] * 2)
+        self.assertEqual((len(selected), rank, exhausted), (64, 64, True))
+        equations = iter([deps.equation(i, 1) for deps in [low, high] for i in range(64)] + [low.equation(0, 1)] * (EQUATION_RESERVE + 10))
+        selected, rank, exhausted = select_equations(equations)
+        self.assertEqual((len(selected), rank, exhausted), (STATE_SIZE + EQUATION_RESERVE, STATE_SIZE, False))
+        self.assertEqual(len(list(equations)), 10)
+
+    def test_recover_seed_from_sparse_known_bits(self):
+        seed0, seed1 = 12092933408070727569, 7218780437263453395
+        known_bits = {}
+        for step in [0, 1, 10 ** 6, 10 ** 6 + 1, 5 * 10 ** 6]:
+            state0, _ = jump_xs128(seed0, seed1, step + 1)
+            known_bits[step] = [(state0 >> j) & 1 if j >= 30 else None for j in range(64)]
+        self.assertEqual(list(recover_seed_from_sparse_known_bits(known_bits)), [(seed0, seed1)])
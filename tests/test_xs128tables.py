@@ -0,0 +1,38 @@
+import os
+import tempfile
+import unittest
+
+from mathrandomcrack.xs128tables import *
+
+class TestXS128Tables(unittest.TestCase):
+
+    def test_tables(self):
+        state0, state1 = 12092933408070727569, 7218780437263453395
+        initial_state = state0 | (state1 << HALF_STATE_SIZE)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'tables.bin')
+            # First load builds and saves the tables, second load maps the saved file
+            XS128Tables.load(path)
+            tables = XS128Tables.load(path)
+            self.assertEqual(tables.steps, TABLE_STEPS)
+            for step in range(TABLE_STEPS + 10):
+                state0, state1 = xs128(state0, state1)
+                if step in [0, 1, 63, 64, TABLE_STEPS - 1, TABLE_STEPS + 9]:
+                    # Check per-step state0 rows
+                    self.assertEqual(apply_rows(tables.state0_rows(step), initial_state), state0)
+            # Check long jump using squared transition matrices
+            self.assertEqual(apply_rows(tables.transition(TABLE_STEPS + 10), initial_state), state0 | (state1 << HALF_STATE_SIZE))
+            # Jumps forward and backward
+            self.assertEqual(tables.jump(*tables.jump(state0, state1, 10 ** 12), -10 ** 12), (state0, state1))
+            self.assertEqual(tables.jump(state0, state1, -(TABLE_STEPS + 10)), (initial_state & ((1 << HALF_STATE_SIZE) - 1), initial_state >> HALF_STATE_SIZE))
+            # xs128 has a period of 2^128 - 1
+            self.assertEqual(tables.transition((1 << STATE_SIZE) - 1), identity_rows())
+
+    def test_iter_state0_rows_gaps(self):
+        tables = get_tables()
+        state0, state1 = 12092933408070727569, 7218780437263453395
+        initial_state = state0 | (state1 << HALF_STATE_SIZE)
+        steps = [3, TABLE_STEPS + 5, 10 ** 6, 10 ** 6 + 1, 5 * 10 ** 6]
+        # Gaps between steps beyond the tables are jumped over
+        for step, rows in tables.iter_state0_rows(steps):
+            self.assertEqual(apply_rows(rows, initial_state), tables.jump(state0, state1, step + 1)[0])